@@ -14,8 +14,10 @@ import os.path as op
 import subprocess
 import sys
 
-import pytest
-pytest.register_assert_rewrite('podoc.core')
+# NOTE: rewrite the assertions in Podoc.assert_equal() when testing, without importing
+# pytest in normal use.
+if 'pytest' in sys.modules:  # pragma: no cover
+    sys.modules['pytest'].register_assert_rewrite('podoc.core')
 
 from .core import Podoc  # noqa
 from .plugin import (IPlugin, discover_plugins,
@@ -23,6 +25,7 @@ from .plugin import (IPlugin, discover_plugins,
 from .ast import ASTPlugin
 from .markdown import MarkdownPlugin
 from .notebook import NotebookPlugin
+from .utils import _set_lazy_attrs
 
 
 #-------------------------------------------------------------------------------------------------
@@ -49,7 +52,10 @@ def _git_version():
 __author__ = 'Cyrille Rossant'
 __email__ = 'cyrille.rossant at gmail.com'
 __version__ = '0.1.0.dev0'
-__version_git__ = __version__ + _git_version()
+
+
+# NOTE: the git version is computed lazily as it requires a git subprocess.
+_set_lazy_attrs(__name__, __version_git__=lambda: __version__ + _git_version())
 
 
 # Set a null handler on the root logger
@@ -93,4 +99,5 @@ add_default_handler('DEBUG' if DEBUG else 'INFO')
 
 def test():  # pragma: no cover
     """Run the full testing suite of podoc."""
+    import pytest
     pytest.main()
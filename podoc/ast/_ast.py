@@ -13,10 +13,11 @@ import logging
 import os.path as op
 import re
 
-from podoc.tree import Node, TreeTransformer, filter_tree
+from podoc.tree import Node, NodeIndex, TreeTransformer
 from podoc.plugin import IPlugin
-from podoc.utils import (has_pandoc, pandoc, get_pandoc_formats,
-                         PANDOC_API_VERSION,
+from podoc.tracing import span
+from podoc.utils import (has_pandoc, pandoc, get_pandoc_formats, get_pandoc_api_version,
+                         PANDOC_COST,
                          _save_resources, _get_resources_path,
                          _merge_str, _get_file,
                          )
@@ -96,6 +97,19 @@ PANDOC_FILE_EXTENSIONS = {
     'ms': '.ms',
 }
 
+# pandoc elements, decoded as nodes while parsing the pandoc JSON. The other objects with
+# a type, like the list number styles or the metadata values, are kept as dicts.
+PANDOC_ELEMENT_NAMES = frozenset((
+    # Blocks.
+    'Plain', 'Para', 'LineBlock', 'CodeBlock', 'RawBlock', 'BlockQuote', 'OrderedList',
+    'BulletList', 'DefinitionList', 'Header', 'HorizontalRule', 'Table', 'Figure', 'Div',
+    'Null',
+    # Inlines.
+    'Str', 'Emph', 'Underline', 'Strong', 'Strikeout', 'Superscript', 'Subscript',
+    'SmallCaps', 'Quoted', 'Cite', 'Code', 'Space', 'SoftBreak', 'LineBreak', 'Math',
+    'RawInline', 'Link', 'Image', 'Note', 'Span',
+))
+
 # List of allowed inline names.
 INLINE_NAMES = (
     # The following are pandoc inline names:
@@ -128,7 +142,41 @@ NATIVE_NAMES = BLOCK_NAMES + INLINE_NAMES + (
 )
 
 
+class ASTIndex(NodeIndex):
+    """Index of the nodes of an AST by name, url and language."""
+
+    def __init__(self, ast):
+        self._by_url = {}
+        self._by_lang = {}
+        super(ASTIndex, self).__init__(ast)
+
+    def add(self, node):
+        super(ASTIndex, self).add(node)
+        url = getattr(node, 'url', None)
+        if url is not None:
+            self._by_url.setdefault(url, []).append(node)
+        lang = getattr(node, 'lang', None)
+        if lang is not None:
+            self._by_lang.setdefault(lang, []).append(node)
+
+    def urls(self):
+        """Return the urls of the descendant Image and Link nodes."""
+        return list(self._by_url)
+
+    def find_url(self, url):
+        """Return the descendant nodes with a given url, in depth-first order."""
+        return list(self._by_url.get(url, ()))
+
+    def find_lang(self, lang):
+        """Return the descendant nodes with a given language, in depth-first order."""
+        return list(self._by_lang.get(lang, ()))
+
+
 class ASTNode(Node):
+    __slots__ = ('level', 'url', 'lang', 'start', 'style', 'delimiter', 'bullet_char',
+                 'raw_type')
+    index_class = ASTIndex
+
     def is_block(self):
         return self.name in BLOCK_NAMES
 
@@ -150,13 +198,14 @@ class ASTNode(Node):
                     assert not child.is_block()  # pragma: no cover
 
     def to_pandoc(self):
-        return PodocToPandoc().transform_main(self)
+        with span('PodocToPandoc', cat='transform'):
+            return PodocToPandoc().transform_main(self)
 
     def display(self):
         """Print-friendly representation of a node, used in tree show()."""
         if self.name == 'Header':
             return '{} {}'.format(self.name, self.level)
-        elif hasattr(self, 'url'):
+        elif self.url is not None:
             return '{} <{}>'.format(self.name, self.url)
         elif self.name == 'OrderedList':
             return '{} ({})'.format(self.name, self.start)
@@ -208,27 +257,21 @@ def _to_pandoc_metadata(ast_metadata):
 def _from_pandoc_metadata(pandoc_metadata):
     l = pandoc_metadata.get('podoc', {}).get('c', {})
     for k, v in l.items():
-        yield k, v['c'][0]['c']
-
-
-class PodocToPandocPreProcessor(TreeTransformer):
-    def transform_Node(self, node):
-        """Call the transformation methods recursively."""
-        children = self.transform_children(node)
-        node.children = children
-        return node
+        value = v['c'][0]
+        # NOTE: the Str elements with a string are decoded by `ast_from_pandoc_json()`.
+        yield k, value['c'] if isinstance(value, dict) else value
 
 
 class PodocToPandoc(TreeTransformer):
     def transform_Node(self, node):
+        children = yield node
         if node.is_native():
-            return _node_dict(node,
-                              self.transform_children(node))
+            return _node_dict(node, children)
         else:
             # Skip the current unknown node and use the list of children
             # instead.
             # logger.debug("Unknown node `%s`.", node)
-            return self.transform_children(node)
+            return children
 
     def transform_str(self, text):
         """Split on spaces and insert Space elements for pandoc."""
@@ -240,8 +283,7 @@ class PodocToPandoc(TreeTransformer):
         return {'t': 'LineBreak'}
 
     def transform_Header(self, node):
-        children = [node.level, ['', [], []],
-                    self.transform_children(node)]
+        children = [node.level, ['', [], []], (yield node)]
         return _node_dict(node, children)
 
     def transform_MathBlock(self, node):
@@ -261,7 +303,7 @@ class PodocToPandoc(TreeTransformer):
 
     def transform_OrderedList(self, node):
         # NOTE: we remove the ListItem node for pandoc
-        items = [_['c'] for _ in self.transform_children(node)]
+        items = [_['c'] for _ in (yield node)]
         # NOTE: we only support OneParen and Period delimiter for now,
         # following the CommonMark spec.
         style = node.get('style', 'Decimal')
@@ -273,16 +315,16 @@ class PodocToPandoc(TreeTransformer):
 
     def transform_BulletList(self, node):
         # NOTE: we remove the ListItem node for pandoc
-        items = [_['c'] for _ in self.transform_children(node)]
+        items = [_['c'] for _ in (yield node)]
         return _node_dict(node, items)
 
     def transform_Link(self, node):
-        children = [['', [], []], self.transform_children(node), [node.url, '']]
+        children = [['', [], []], (yield node), [node.url, '']]
         return _node_dict(node, children)
 
     def transform_Image(self, node):
         children = [['', [], []],
-                    self.transform_children(node),
+                    (yield node),
                     [node.url, 'fig:']]
         return _node_dict(node, children)
 
@@ -296,32 +338,76 @@ class PodocToPandoc(TreeTransformer):
         return {'t': 'Math', 'c': [{'t': 'InlineMath'}, contents]}
 
     def transform_main(self, ast):
-        ast = PodocToPandocPreProcessor().transform(ast)
         blocks = self.transform(ast)['c']
-        # Save podoc metadata in the pandoc JSON.
-        m = ast.get('metadata', {})
-        m = {k: v for k, v in m.items() if v}
-        meta = _to_pandoc_metadata(m) if m else {}
-        return {'meta': meta,
+        return {'meta': self.transform_meta(ast),
                 'blocks': blocks,
-                'pandoc-api-version': PANDOC_API_VERSION,
+                'pandoc-api-version': get_pandoc_api_version(),
                 }
 
+    def transform_meta(self, ast):
+        """Save podoc metadata in the pandoc JSON."""
+        m = ast.get('metadata', {})
+        m = {k: v for k, v in m.items() if v}
+        return _to_pandoc_metadata(m) if m else {}
+
+    def iter_blocks(self, ast):
+        """Yield the pandoc JSON of the blocks of an AST, one at a time."""
+        if ast.name != 'root':
+            yield from self.transform(ast)['c']
+            return
+        for child in ast.children:
+            block = self.transform(child)
+            if isinstance(block, list):
+                yield from (_ for _ in block if _ is not None)
+            elif block is not None:
+                yield block
+
+
+def _write_pandoc_json(asts, f):
+    """Write the pandoc JSON of a sequence of ASTs into a file object, one block at a time.
+
+    The blocks of the ASTs are concatenated in a single document. For a single AST, this
+    writes the same JSON as `json.dump(ast.to_pandoc(), f, sort_keys=True, indent=2,
+    separators=(',', ': '))`, without creating the pandoc JSON of the whole AST.
+
+    """
+    encoder = json.JSONEncoder(sort_keys=True, indent=2, separators=(',', ': '))
+    # NOTE: the JSON strings do not contain new lines, so that the JSON of a block is
+    # indented by adding spaces after all new lines.
+    t = PodocToPandoc()
+    with span('PodocToPandoc', cat='transform'):
+        f.write('{\n  "blocks": [')
+        empty = True
+        meta = {}
+        for ast in asts:
+            for block in t.iter_blocks(ast):
+                f.write('\n    ' if empty else ',\n    ')
+                empty = False
+                for chunk in encoder.iterencode(block):
+                    f.write(chunk.replace('\n', '\n    '))
+            # NOTE: the first value of a metadata field has precedence.
+            for key, value in t.transform_meta(ast).items():
+                meta.setdefault(key, value)
+        f.write(']' if empty else '\n  ]')
+        for key, value in (('meta', meta),
+                           ('pandoc-api-version', get_pandoc_api_version())):
+            f.write(',\n  "%s": %s' % (key, encoder.encode(value).replace('\n', '\n  ')))
+        f.write('\n}')
+
 
 #-------------------------------------------------------------------------------------------------
 # pandoc -> AST
 #-------------------------------------------------------------------------------------------------
 
 def ast_from_pandoc(d, **kwargs):
-    return PandocToPodoc(**kwargs).transform_main(d)
+    with span('PandocToPodoc', cat='transform'):
+        return PandocToPodoc(**kwargs).transform_main(d)
 
 
-class PandocToPodocPostProcessor(TreeTransformer):
-    def transform_Node(self, node):
-        """Call the transformation methods recursively."""
-        children = self.transform_children(node)
-        node.children = children
-        return node
+def ast_from_pandoc_json(s, **kwargs):
+    """Return the AST of a pandoc JSON string, without creating the pandoc JSON dict."""
+    with span('PandocToPodoc', cat='transform'):
+        return PandocToPodoc(**kwargs).decode_main(s)
 
 
 class PandocToPodoc(TreeTransformer):
@@ -335,24 +421,42 @@ class PandocToPodoc(TreeTransformer):
     def get_node_children(self, node):
         return node.get('c', None)
 
-    def set_next_child(self, child, next_child):
-        pass
-
-    def transform(self, d):
-        if isinstance(d, str):
-            return d
+    def _make_node(self, d):
+        """Return a new node and the list of its children to transform, or a string."""
         c = self.get_node_children(d)
         node = ASTNode(self.get_node_name(d))
-        children = self.get_transform_func(d)(c, node)
+        children = self._get_transform_func(d)[0](self, c, node)
         if isinstance(children, str):
-            return children
+            return children, None
         children = children or []
         assert isinstance(children, list)
-        # Recursively transform all children and assign them to the node.
-        node.children = [self.transform(child) for child in children]
-        # Merge consecutive strings in the list of children.
-        node.children = _merge_str(node.children)
-        return node
+        return node, children
+
+    def transform(self, d):
+        if isinstance(d, str):
+            return d
+        node, children = self._make_node(d)
+        if children is None:
+            return node
+        # NOTE: the children are transformed with a stack of `(node, iterator over the
+        # children to transform, transformed children)` rather than recursively.
+        stack = [(node, iter(children), [])]
+        while True:
+            node, children, out = stack[-1]
+            for child in children:
+                if not isinstance(child, str):
+                    child, grandchildren = self._make_node(child)
+                    if grandchildren is not None:
+                        stack.append((child, iter(grandchildren), []))
+                        break
+                out.append(child)
+            else:
+                stack.pop()
+                # Merge consecutive strings in the list of children.
+                node.children = _merge_str(out)
+                if not stack:
+                    return node
+                stack[-1][2].append(node)
 
     def transform_Node(self, c, node):
         # By default, obj['c'] is the list of children to process.
@@ -422,6 +526,14 @@ class PandocToPodoc(TreeTransformer):
         children = c[-2]
         return children
 
+    def _make_root(self, obj, children):
+        out = ASTNode('root', children=children)
+        # Load metadata.
+        m = obj.get('meta', {})
+        if m:
+            out['metadata'] = dict(_from_pandoc_metadata(m))
+        return out
+
     def transform_main(self, obj):
         assert isinstance(obj, dict)
         # Check that this is really the root.
@@ -430,13 +542,38 @@ class PandocToPodoc(TreeTransformer):
         # Process the root: obj is a list, and the second item
         # is a list of blocks to process.
         children = [self.transform(block) for block in obj['blocks']]
-        out = ASTNode('root', children=children)
-        out = PandocToPodocPostProcessor().transform(out)
-        # Load metadata.
-        m = obj.get('meta', {})
-        if m:
-            out['metadata'] = dict(_from_pandoc_metadata(m))
-        return out
+        return self._make_root(obj, children)
+
+    # JSON decoding
+    # --------------------------------------------------------------------------------------------
+
+    def object_hook(self, d):
+        """Decode a JSON object as a node if it is a pandoc element, or return it as is."""
+        name = d.get('t', None)
+        if name not in PANDOC_ELEMENT_NAMES:
+            return d
+        # NOTE: the podoc metadata are saved in Str elements that may not contain a string.
+        if name == 'Str' and not isinstance(d.get('c', None), str):
+            return d
+        return self._decode(d)
+
+    def _decode(self, d):
+        # NOTE: the children have already been decoded, except the objects that are not
+        # pandoc elements, like the ListItem objects created by the transform methods.
+        if isinstance(d, (Node, str)):
+            return d
+        node, children = self._make_node(d)
+        if children is not None:
+            node.children = _merge_str([self._decode(child) for child in children])
+        return node
+
+    def decode_main(self, s):
+        """Decode a pandoc JSON string, creating the nodes while parsing the JSON."""
+        obj = json.loads(s, object_hook=self.object_hook)
+        assert isinstance(obj, dict)
+        assert 'blocks' in obj
+        children = [self._decode(block) for block in obj['blocks']]
+        return self._make_root(obj, children)
 
 
 #-------------------------------------------------------------------------------------------------
@@ -445,6 +582,11 @@ class PandocToPodoc(TreeTransformer):
 
 class PandocPlugin(IPlugin):
     def attach(self, podoc):
+        # NOTE: the pandoc languages are only registered when they are first needed,
+        # so that pandoc is not launched when only native languages are used.
+        podoc.register_lazy(self.attach_pandoc)
+
+    def attach_pandoc(self, podoc):
         if not has_pandoc():  # pragma: no cover
             logger.debug("pandoc is not available.")
             return
@@ -457,9 +599,7 @@ class PandocPlugin(IPlugin):
                 """Convert a document from `lang` to the podoc AST, via
                 pandoc."""
                 d = pandoc(doc, 'json', format=lang)
-                # Convert the
-                ast = ast_from_pandoc(json.loads(d))
-                return ast
+                return ast_from_pandoc_json(d)
             return conv
 
         # podoc_langs = podoc.languages
@@ -470,7 +610,8 @@ class PandocPlugin(IPlugin):
             podoc.register_lang(source, pandoc=True,
                                 file_ext=PANDOC_FILE_EXTENSIONS.get(source, None),
                                 )
-            podoc.register_func(source=source, target='ast', func=func)
+            podoc.register_func(source=source, target='ast', func=func, cost=PANDOC_COST,
+                                pandoc=True)
 
         # From AST to pandoc target formats.
         def _make_target_func(lang):
@@ -499,7 +640,8 @@ class PandocPlugin(IPlugin):
             podoc.register_lang(target, pandoc=True,
                                 file_ext=PANDOC_FILE_EXTENSIONS.get(source, None),
                                 )
-            podoc.register_func(source='ast', target=target, func=func)
+            podoc.register_func(source='ast', target=target, func=func, cost=PANDOC_COST,
+                                pandoc=True)
 
 
 #-------------------------------------------------------------------------------------------------
@@ -513,7 +655,7 @@ class ASTPlugin(IPlugin):
         podoc.register_lang('ast', file_ext='.json',
                             load_func=self.load, dump_func=self.dump,
                             loads_func=self.loads, dumps_func=self.dumps,
-                            eq_filter=self.eq_filter,
+                            eq_filter=self.eq_filter, dump_chunks=self.dump_chunks,
                             )
 
     def load(self, file_or_path):
@@ -522,33 +664,38 @@ class ASTPlugin(IPlugin):
         with _get_file(file_or_path, 'r') as f:
             # Get the path to the JSON file.
             # path = op.realpath(f.name)
-            d = json.load(f)
-        assert isinstance(d, dict)
-        ast = ast_from_pandoc(d)
-        assert isinstance(ast, ASTNode)
-        return ast
+            s = f.read()
+        return self.loads(s)
 
     def dump(self, ast, file_or_path, context=None):
         """Dump an AST instance to a JSON file."""
         assert isinstance(ast, ASTNode)
-        d = ast.to_pandoc()
-        assert isinstance(d, dict)
         # logger.debug("Save JSON file `%s`.", path)
         with _get_file(file_or_path, 'w') as f:
             path = op.realpath(f.name)
-            json.dump(d, f, sort_keys=True, indent=2,
-                      separators=(',', ': '))  # avoid trailing whitespaces
+            # NOTE: the JSON is written block by block.
+            _write_pandoc_json([ast], f)
             # Add a new line at the end.
             f.write('\n')
         # Save the resources.
         if (context or {}).get('resources', {}):
             _save_resources(context.get('resources', {}), _get_resources_path(path))
 
+    def dump_chunks(self, asts, f, context=None):
+        """Write a sequence of AST instances into a single JSON file object.
+
+        The resources are saved next to the output file of the context, if any.
+
+        """
+        _write_pandoc_json(asts, f)
+        f.write('\n')
+        path = (context or {}).get('output', None) or op.realpath(f.name)
+        if (context or {}).get('resources', {}):
+            _save_resources(context.get('resources', {}), _get_resources_path(path))
+
     def loads(self, s):
         """Load a JSON string and return an AST instance."""
-        d = json.loads(s)
-        assert isinstance(d, dict)
-        ast = ast_from_pandoc(d)
+        ast = ast_from_pandoc_json(s)
         assert isinstance(ast, ASTNode)
         return ast
 
@@ -561,7 +708,6 @@ class ASTPlugin(IPlugin):
                           separators=(',', ': '))
 
     def eq_filter(self, ast):
-        def f(node):
-            # node.pop('metadata', None)
-            return node
-        return filter_tree(ast, f)
+        # NOTE: the equality of the trees already discards the visit metadata, there is
+        # no need to copy them.
+        return ast
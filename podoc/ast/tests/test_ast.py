@@ -7,15 +7,18 @@
 # Imports
 #-------------------------------------------------------------------------------------------------
 
+from io import StringIO
 import json
+import os.path as op
 
 from pytest import fixture
 
-from .._ast import (ASTNode, ast_from_pandoc, _split_spaces)
+from .._ast import (ASTNode, ASTPlugin, ast_from_pandoc, ast_from_pandoc_json,
+                    _split_spaces)
 from podoc.core import Podoc
 from podoc.utils import (has_pandoc, pandoc,
                          PANDOC_MARKDOWN_FORMAT,
-                         PANDOC_API_VERSION,
+                         get_pandoc_api_version,
                          )
 
 
@@ -26,7 +29,7 @@ from podoc.utils import (has_pandoc, pandoc,
 @fixture
 def ast_pandoc():
     ast_dict = {'meta': {},
-                'pandoc-api-version': PANDOC_API_VERSION,
+                'pandoc-api-version': get_pandoc_api_version(),
                 'blocks': [
                     {'c': [{'c': 'hello', 't': 'Str'},
                            {'t': 'Space'},
@@ -74,7 +77,7 @@ def ast():
 def test_repr_ast():
     d = json.dumps(ASTNode('Para').to_pandoc(), separators=(',', ':'), sort_keys=True)
     assert d == ('{"blocks":[],"meta":{},"pandoc-api-version":%s}' %
-                 str(PANDOC_API_VERSION).replace(' ', ''))
+                 str(get_pandoc_api_version()).replace(' ', ''))
 
 
 def test_equal(ast):
@@ -86,6 +89,42 @@ def test_equal(ast):
     assert ast == ast_2
 
 
+def test_attributes():
+    node = ASTNode('Link', url='http://example.com')
+    assert not hasattr(node, '__dict__')
+    assert node.url == 'http://example.com'
+    # Unset attributes are None.
+    assert node.level is None
+    assert 'level' not in node
+    assert node.get('level', 1) == 1
+    assert node.keys() == ['name', 'children', 'url']
+    assert node.display() == 'Link <http://example.com>'
+
+    node_2 = node.copy()
+    del node_2['url']
+    assert node_2.url is None
+    assert node_2 != node
+
+
+def test_index(ast_pandoc):
+    ast = ast_from_pandoc(ast_pandoc)
+    # The index is only built on demand.
+    assert ast._meta is None
+    index = ast.index()
+    assert [node.name for node in index.find('Para')] == ['Para', 'Para']
+    assert index.find('Emph')[0].children == ['world']
+    assert index.urls() == []
+
+    ast.add_child(ASTNode('Para', children=[ASTNode('Image', url='a.png')]))
+    assert not index.valid
+    assert [node.url for node in ast.find_all('Image')] == ['a.png']
+    index = ast.index()
+    assert index.valid
+    assert index.urls() == ['a.png']
+    assert index.find_url('a.png')[0].name == 'Image'
+    assert index.find_lang('python') == []
+
+
 def test_metadata():
     m = {'hello': 'two *words*'}
     ast = ASTNode('root', metadata=m)
@@ -94,6 +133,47 @@ def test_metadata():
     assert ast_2.metadata == m
 
 
+def test_from_pandoc_json(ast, ast_pandoc):
+    assert ast_from_pandoc_json(json.dumps(ast_pandoc)) == ast
+
+    # Lists, links, math, code, and metadata.
+    ast = ASTNode('root', metadata={'hello': 'two *words*', 'list': [1, 2]})
+    item = ASTNode('ListItem', children=[ASTNode('Plain', children=[
+        'a ', ASTNode('Link', url='http://x', children=['link']), ' ',
+        ASTNode('Math', children=['x^2'])])])
+    ast.add_child(ASTNode('OrderedList', start=2, style='Decimal', delimiter='.',
+                          children=[item]))
+    ast.add_child(ASTNode('BulletList', bullet_char='*', delimiter=' ',
+                          children=[item.copy()]))
+    ast.add_child(ASTNode('CodeBlock', lang='python', children=['print(1)']))
+    s = json.dumps(ast.to_pandoc())
+    ast_2 = ast_from_pandoc_json(s)
+    assert ast_2 == ast_from_pandoc(json.loads(s)) == ast
+    assert ast_2.metadata == ast.metadata
+
+
+def test_dump_stream(tempdir, ast):
+    def _dump(ast):
+        f = StringIO()
+        json.dump(ast.to_pandoc(), f, sort_keys=True, indent=2, separators=(',', ': '))
+        return f.getvalue() + '\n'
+
+    ast_2 = ast.copy()
+    ast_2.metadata = {'hello': 'two *words*', 'list': [1, {'a': 'b'}]}
+    path = op.join(tempdir, 'ast.json')
+    for tree in (ast, ast_2, ASTNode('root'), ASTNode('Para', children=['hello'])):
+        ASTPlugin().dump(tree, path)
+        with open(path) as f:
+            assert f.read() == _dump(tree)
+
+    # Several ASTs are written in a single document.
+    with open(path, 'w') as f:
+        ASTPlugin().dump_chunks([ast, ast_2], f)
+    with open(path) as f:
+        assert f.read() == _dump(ASTNode('root', metadata=ast_2.metadata,
+                                         children=ast.children + ast_2.children))
+
+
 def test_split_spaces():
     assert _split_spaces('a  b') == ['a', '', 'b']
     assert _split_spaces('a b  \tc,d ') == ['a', '', 'b', '', 'c,d', '']
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmarks of the native conversions on synthetic documents.
+
+Run the benchmarks, and save or compare against a baseline, with:
+
+    python -m podoc.benchmark --save baseline.json
+    python -m podoc.benchmark --compare baseline.json
+
+"""
+
+
+#-------------------------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------------------------
+
+import base64
+from copy import deepcopy
+import json
+import logging
+import math
+import platform
+import random
+import sys
+from time import perf_counter
+
+import click
+
+from .tree import Node
+from .utils import get_pandoc_cache, set_pandoc_cache
+
+logger = logging.getLogger(__name__)
+
+
+#-------------------------------------------------------------------------------------------------
+# Synthetic documents
+#-------------------------------------------------------------------------------------------------
+
+_WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+          'incididunt ut labore et dolore magna aliqua enim ad minim veniam quis nostrud '
+          'exercitation ullamco laboris nisi aliquip ex ea commodo consequat').split()
+
+# A 1x1 PNG image.
+_PNG = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8Dw'
+                        'HwAFBQIAX8jx0gAAAABJRU5ErkJggg==')
+
+
+def _sentence(rng, n=12):
+    """Return a sentence with some inline markup, if it is long enough."""
+    words = [rng.choice(_WORDS) for _ in range(n)]
+    if n >= 8:
+        words[1] = '*%s*' % words[1]
+        words[3] = '**%s**' % words[3]
+        words[5] = '`%s`' % words[5]
+        words[7] = '[%s](http://example.com/%d)' % (words[7], rng.randint(0, 1000))
+    return ' '.join(words).capitalize() + '.'
+
+
+def _list(rng, depth, n_items=3, indent=0):
+    """Return the lines of a nested bullet list."""
+    lines = []
+    for _ in range(n_items):
+        lines.append(' ' * indent + '* ' + _sentence(rng, 8))
+        if depth > 1:
+            lines.extend(_list(rng, depth - 1, n_items=2, indent=indent + 2))
+    return lines
+
+
+def _code(rng, code_lines):
+    return '\n'.join('x_%d = %d * %d' % (i, rng.randint(0, 100), rng.randint(0, 100))
+                     for i in range(code_lines))
+
+
+def generate_markdown(n_cells=10, list_depth=2, n_images=0, code_lines=5, seed=0):
+    """Generate a Markdown document.
+
+    Parameters
+    ----------
+
+    n_cells : int
+        Number of sections, each with a header, a paragraph, a list, a code block and
+        its outputs, like a notebook.
+    list_depth : int
+        Nesting depth of the bullet lists.
+    n_images : int
+        Number of code blocks followed by an image output. Note that pandoc 3 reads
+        standalone images as figures, which are not supported yet.
+    code_lines : int
+        Number of lines of every code block.
+    seed : int
+        Seed of the random generator.
+
+    """
+    rng = random.Random(seed)
+    blocks = []
+    for i in range(n_cells):
+        blocks.append('## Section %d' % i)
+        blocks.append(_sentence(rng) + ' ' + _sentence(rng))
+        if list_depth:
+            blocks.append('\n'.join(_list(rng, list_depth)))
+        blocks.append('```python\n%s\n```' % _code(rng, code_lines))
+        blocks.append('```{output:stdout}\n%s\n```' % _sentence(rng, 4))
+        if i < n_images:
+            blocks.append('![Output %d](image_%d.png)' % (i, i))
+    return '\n\n'.join(blocks) + '\n'
+
+
+def generate_notebook(n_cells=10, list_depth=2, n_images=0, code_lines=5, seed=0):
+    """Generate a Jupyter notebook with the same structure as `generate_markdown()`."""
+    from nbformat.v4 import (new_notebook, new_markdown_cell, new_code_cell, new_output)
+    rng = random.Random(seed)
+    png = base64.b64encode(_PNG).decode('ascii')
+    nb = new_notebook()
+    nb.metadata.language_info = {'name': 'python'}
+    for i in range(n_cells):
+        md = ['## Section %d' % i, _sentence(rng) + ' ' + _sentence(rng)]
+        if list_depth:
+            md.append('\n'.join(_list(rng, list_depth)))
+        nb.cells.append(new_markdown_cell('\n\n'.join(md)))
+        outputs = [new_output('stream', name='stdout', text=_sentence(rng, 4) + '\n')]
+        if i < n_images:
+            outputs.append(new_output('display_data',
+                                      data={'image/png': png,
+                                            'text/plain': 'Output %d' % i}))
+        nb.cells.append(new_code_cell(_code(rng, code_lines), execution_count=i + 1,
+                                      outputs=outputs))
+    return nb
+
+
+def generate_ast(podoc=None, **kwargs):
+    """Generate a podoc AST from the Markdown document generated by `generate_markdown()`."""
+    from .core import Podoc
+    podoc = podoc or Podoc(with_pandoc=False)
+    return podoc.convert_text(generate_markdown(**kwargs), source='markdown', target='ast')
+
+
+def generate_ast_json(podoc=None, **kwargs):
+    """Generate the JSON string of the podoc AST generated by `generate_ast()`."""
+    from .core import Podoc
+    podoc = podoc or Podoc(with_pandoc=False)
+    return podoc.dumps(generate_ast(podoc=podoc, **kwargs), 'ast')
+
+
+#-------------------------------------------------------------------------------------------------
+# Benchmarks
+#-------------------------------------------------------------------------------------------------
+
+def _copy(obj):
+    if isinstance(obj, str):
+        return obj
+    # NOTE: Node.copy() copies the tree iteratively, without the visit metadata.
+    if isinstance(obj, Node):
+        return obj.copy()
+    return deepcopy(obj)
+
+
+def _time(func, obj, repeat):
+    """Return the best time of `func(obj)` over several runs, on copies of `obj`."""
+    best = float('inf')
+    for _ in range(repeat):
+        arg = _copy(obj)
+        t = perf_counter()
+        func(arg)
+        best = min(best, perf_counter() - t)
+    return best
+
+
+def run_benchmarks(repeat=3, podoc=None, **kwargs):
+    """Time all native conversions of synthetic documents.
+
+    The keyword arguments are passed to the document generators. Return a dictionary
+    `{'source->target': time}` with the best times in seconds.
+
+    """
+    from .core import Podoc
+    podoc = podoc or Podoc(with_pandoc=False)
+    # NOTE: the pandoc cache would hide the cost of pandoc after the first run.
+    cache = get_pandoc_cache()
+    set_pandoc_cache(None)
+    try:
+        ast = generate_ast(podoc=podoc, **kwargs)
+        inputs = {'markdown': generate_markdown(**kwargs),
+                  'ast': ast,
+                  'notebook': generate_notebook(**kwargs),
+                  }
+        results = {}
+        for source, target in podoc.conversion_pairs:
+            if source not in inputs:  # pragma: no cover
+                continue
+            results['%s->%s' % (source, target)] = _time(
+                lambda obj: podoc.convert_text(obj, source=source, target=target),
+                inputs[source], repeat)
+        # AST (de)serialization.
+        js = podoc.dumps(ast, 'ast')
+        results['json->ast'] = _time(lambda s: podoc.loads(s, 'ast'), js, repeat)
+        results['ast->json'] = _time(lambda obj: podoc.dumps(obj, 'ast'), ast, repeat)
+    finally:
+        set_pandoc_cache(cache)
+    return results
+
+
+def growth_exponent(sizes, times):
+    """Return the growth exponent `k` of `time ~ size ** k`, by least squares in log-log
+    scale."""
+    assert len(sizes) == len(times) >= 2
+    x = [math.log(size) for size in sizes]
+    y = [math.log(max(t, 1e-9)) for t in times]
+    mx, my = sum(x) / len(x), sum(y) / len(y)
+    return (sum((a - mx) * (b - my) for a, b in zip(x, y)) /
+            sum((a - mx) ** 2 for a in x))
+
+
+def measure_scaling(func, make_input, n, factors=(1, 2, 4), repeat=3):
+    """Time `func(make_input(size))` at sizes `n`, `2n`, `4n`, and return the growth
+    exponent and the times."""
+    sizes = [n * f for f in factors]
+    times = [_time(func, make_input(size), repeat) for size in sizes]
+    logger.debug("Times for sizes %s: %s.", sizes, ', '.join('%.4f' % t for t in times))
+    return growth_exponent(sizes, times), times
+
+
+def save_baseline(results, path, **params):
+    """Save benchmark results and their parameters in a JSON file."""
+    from podoc import __version__
+    with open(path, 'w') as f:
+        json.dump({'results': results,
+                   'params': params,
+                   'podoc_version': __version__,
+                   'python_version': platform.python_version(),
+                   }, f, indent=2, sort_keys=True)
+
+
+def load_baseline(path):
+    """Load benchmark results saved with `save_baseline()`."""
+    with open(path, 'r') as f:
+        return json.load(f)['results']
+
+
+def compare_to_baseline(results, baseline, tolerance=.25):
+    """Return the regressions `{name: ratio}`, where the time is more than
+    `1 + tolerance` times the baseline time."""
+    ratios = {name: t / baseline[name] for name, t in results.items()
+              if baseline.get(name, None)}
+    return {name: ratio for name, ratio in ratios.items() if ratio > 1 + tolerance}
+
+
+#-------------------------------------------------------------------------------------------------
+# CLI
+#-------------------------------------------------------------------------------------------------
+
+@click.command()
+@click.option('--cells', default=50, help='Number of cells.')
+@click.option('--list-depth', default=3, help='Nesting depth of the lists.')
+@click.option('--images', default=0, help='Number of images.')
+@click.option('--code-lines', default=10, help='Number of lines of the code blocks.')
+@click.option('--repeat', default=3, help='Number of runs of every benchmark.')
+@click.option('--save', type=click.Path(dir_okay=False), help='Save a baseline.')
+@click.option('--compare', type=click.Path(exists=True, dir_okay=False),
+              help='Compare to a baseline, and fail on regressions.')
+@click.option('--tolerance', default=.25, help='Tolerated slowdown relative to the baseline.')
+def benchmark(cells=50, list_depth=3, images=0, code_lines=10, repeat=3,
+              save=None, compare=None, tolerance=.25):
+    """Benchmark the native podoc conversions on synthetic documents."""
+    params = dict(n_cells=cells, list_depth=list_depth, n_images=images,
+                  code_lines=code_lines)
+    results = run_benchmarks(repeat=repeat, **params)
+    baseline = load_baseline(compare) if compare else {}
+    for name, t in sorted(results.items()):
+        line = '{:<20s} {:>10.2f} ms'.format(name, t * 1000)
+        if name in baseline:
+            line += '  ({:+.0%})'.format(t / baseline[name] - 1)
+        click.echo(line)
+    if save:
+        save_baseline(results, save, **params)
+    regressions = compare_to_baseline(results, baseline, tolerance=tolerance)
+    for name, ratio in sorted(regressions.items()):
+        click.echo('Regression: {} is {:.2f}x slower than the baseline.'.format(name, ratio),
+                   err=True)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    benchmark()
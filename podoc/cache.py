@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""Content-addressed cache of conversions."""
+
+
+#-------------------------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------------------------
+
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import os
+import os.path as op
+
+from .utils import Bunch, _create_dir_if_not_exists
+
+logger = logging.getLogger(__name__)
+
+
+#-------------------------------------------------------------------------------------------------
+# Conversion cache
+#-------------------------------------------------------------------------------------------------
+
+class ConversionCache(object):
+    """Size-bounded cache of conversion outputs, keyed by a hash of the inputs.
+
+    The outputs are kept in an in-memory LRU cache, and optionally in a directory
+    on disk shared between processes and runs.
+
+    Parameters
+    ----------
+
+    max_size : int
+        Maximum total size of the outputs kept in memory, in characters.
+    path : str (None)
+        Directory of the on-disk store. By default, there is no on-disk store.
+    max_disk_size : int
+        Maximum total size of the on-disk store, in bytes.
+
+    """
+
+    def __init__(self, max_size=1 << 25, path=None, max_disk_size=1 << 29):
+        self.max_size = max_size
+        self.path = op.realpath(op.expanduser(path)) if path else None
+        self.max_disk_size = max_disk_size
+        self._items = OrderedDict()  # mapping `key => output`, least recently used first
+        self._size = 0
+        self._disk_size = None  # computed lazily
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(source, *args):
+        """Return the key of the conversion of a source string with some parameters."""
+        h = hashlib.sha256(source.encode('utf-8'))
+        h.update(json.dumps(args, sort_keys=True, default=str).encode('utf-8'))
+        return h.hexdigest()
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        """Return the cache statistics."""
+        return Bunch(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                     count=len(self._items), size=self._size)
+
+    def clear(self):
+        """Clear the in-memory cache. The on-disk store is kept."""
+        self._items.clear()
+        self._size = 0
+
+    # In-memory cache
+    # --------------------------------------------------------------------------------------------
+
+    def _set_memory(self, key, output):
+        if len(output) > self.max_size:
+            return
+        if key in self._items:
+            self._size -= len(self._items.pop(key))
+        self._items[key] = output
+        self._size += len(output)
+        # Evict the least recently used outputs.
+        while self._size > self.max_size:
+            _, evicted = self._items.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    # On-disk store
+    # --------------------------------------------------------------------------------------------
+
+    def _disk_path(self, key):
+        return op.join(self.path, key[:2], key)
+
+    def _get_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                output = f.read()
+        except OSError:
+            return None
+        # Mark the entry as recently used.
+        os.utime(path)
+        return output
+
+    def _disk_files(self):
+        for dirpath, _, filenames in os.walk(self.path):
+            for fn in filenames:
+                yield op.join(dirpath, fn)
+
+    def _set_disk(self, key, output):
+        path = self._disk_path(key)
+        data = output.encode('utf-8')
+        # Size of the file replaced by this one, if any.
+        old_size = op.getsize(path) if op.exists(path) else 0
+        try:
+            _create_dir_if_not_exists(op.dirname(path))
+            # NOTE: concurrent writers of the same key write the same contents, so
+            # that writing to a temporary file and renaming it is safe.
+            tmp_path = '%s.%d.tmp' % (path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:  # pragma: no cover
+            logger.debug("Unable to write `%s` in the conversion cache.", path)
+            return
+        if self._disk_size is None:
+            self._disk_size = sum(op.getsize(p) for p in self._disk_files())
+        else:
+            self._disk_size += len(data) - old_size
+        if self._disk_size > self.max_disk_size:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """Remove the least recently used files until the store is below 3/4 of its
+        maximum size."""
+        files = sorted(((op.getmtime(p), op.getsize(p), p) for p in self._disk_files()))
+        size = sum(s for _, s, _ in files)
+        for _, s, p in files:
+            if size <= .75 * self.max_disk_size:
+                break
+            try:
+                os.remove(p)
+            except OSError:  # pragma: no cover
+                continue
+            size -= s
+            self.evictions += 1
+        self._disk_size = size
+
+    # Public methods
+    # --------------------------------------------------------------------------------------------
+
+    def get(self, key):
+        """Return the cached output, or None."""
+        output = self._items.get(key, None)
+        if output is not None:
+            self._items.move_to_end(key)
+        elif self.path:
+            output = self._get_disk(key)
+            if output is not None:
+                self._set_memory(key, output)
+        if output is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return output
+
+    def set(self, key, output):
+        """Cache an output."""
+        assert isinstance(output, str)
+        self._set_memory(key, output)
+        if self.path:
+            self._set_disk(key, output)
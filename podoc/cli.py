@@ -7,13 +7,14 @@
 # Imports
 #-------------------------------------------------------------------------------------------------
 
+from contextlib import ExitStack
 import logging
 import sys
 import textwrap
 
 import click
 
-from podoc import __version__, Podoc
+from podoc import __version__, Podoc, profiling
 from podoc.utils import _shorten_string
 
 logger = logging.getLogger(__name__)
@@ -57,10 +58,15 @@ def get_podoc_docstring():
                              _wrap(l1, 'pandoc formats: '))
 
 
-PODOC_HELP = get_podoc_docstring()
+class PodocCommand(click.Command):
+    """The help string is only generated when it is displayed, as listing the
+    languages requires loading all plugins."""
+    def format_help_text(self, ctx, formatter):
+        self.help = get_podoc_docstring()
+        super(PodocCommand, self).format_help_text(ctx, formatter)
 
 
-@click.command(help=PODOC_HELP)
+@click.command(cls=PodocCommand)
 @click.argument('files',
                 nargs=-1,
                 required=False,
@@ -78,6 +84,24 @@ PODOC_HELP = get_podoc_docstring()
               type=click.Path(exists=False, file_okay=False,
                               dir_okay=True, resolve_path=True),
               help='Output directory.')
+@click.option('-j', '--jobs', default=1, type=int,
+              help='Number of processes converting the files in parallel.')
+@click.option('--incremental', default=False, is_flag=True,
+              help='Only convert the files that changed since the last conversion '
+                   'to the output directory.')
+@click.option('--chunk-size', default=None, type=int,
+              help='Convert the files by chunks of about this number of characters, '
+                   'for huge documents (requires an output file).')
+@click.option('--trace',
+              type=click.Path(exists=False, file_okay=True,
+                              dir_okay=False, resolve_path=True),
+              help='Save a Chrome trace of the conversion in a JSON file.')
+@click.option('--profile', default=False, is_flag=True,
+              help='Display the time spent in every tree transformation method.')
+@click.option('--profile-output',
+              type=click.Path(exists=False, file_okay=True,
+                              dir_okay=False, resolve_path=True),
+              help='Save cProfile statistics in a file (implies --profile).')
 @click.option('--no-pandoc', default=False, is_flag=True,
               help='Disable pandoc formats.')
 @click.version_option(__version__)
@@ -87,28 +111,51 @@ def podoc(files=None,
           write=None,
           output=None,
           output_dir=None,
+          jobs=1,
+          incremental=False,
+          chunk_size=None,
+          trace=None,
+          profile=False,
+          profile_output=None,
           no_pandoc=False,
           ):
     """Convert a file or a string from one format to another."""
+    profile = profile or bool(profile_output)
+    if incremental and not output_dir:
+        raise click.UsageError("--incremental requires an output directory (-d).")
+    if chunk_size and not (output_dir or (output and len(files or ()) <= 1)):
+        raise click.UsageError("--chunk-size requires an output file per input: "
+                               "use -o with a single input, or -d.")
+    if profile and jobs > 1:
+        # NOTE: the transformations made in worker processes would not be profiled.
+        logger.info("Profiling disables the parallel conversion.")
+        jobs = 1
     # Create the Podoc instance.
-    podoc = Podoc(with_pandoc=not(no_pandoc))
-    # If no files are provided, read from the standard input (like pandoc).
-    if not files:
-        logger.debug("Reading contents from stdin...")
-        contents_s = ''.join(sys.stdin.readlines())
-        # From string to object.
-        contents = podoc.loads(contents_s, read)
-        logger.debug("Converting `%s` from %s to %s (file: `%s`).",
-                     _shorten_string(contents_s),
-                     read, write, output,
-                     )
-        out = podoc.convert_text(contents, source=read, target=write,
-                                 output=output)
-    else:
-        out = podoc.convert_files(files, source=read, target=write,
-                                  output=output, output_dir=output_dir)
-    if output is None and output_dir is None:
-        click.echo(podoc.dumps(out, write))
+    podoc = Podoc(with_pandoc=not(no_pandoc), trace=trace)
+    with ExitStack() as stack:
+        profiler = (stack.enter_context(profiling.profile(profile_output))
+                    if profile else None)
+        # If no files are provided, read from the standard input (like pandoc).
+        if not files:
+            logger.debug("Reading contents from stdin...")
+            contents_s = ''.join(sys.stdin.readlines())
+            # From string to object.
+            contents = podoc.loads(contents_s, read)
+            logger.debug("Converting `%s` from %s to %s (file: `%s`).",
+                         _shorten_string(contents_s),
+                         read, write, output,
+                         )
+            out = podoc.convert_text(contents, source=read, target=write,
+                                     output=output, stream=True, chunk_size=chunk_size)
+        else:
+            out = podoc.convert_files(files, source=read, target=write,
+                                      output=output, output_dir=output_dir,
+                                      jobs=jobs, incremental=incremental, stream=True,
+                                      chunk_size=chunk_size)
+        if output is None and output_dir is None:
+            click.echo(podoc.dumps(out, write))
+    if profiler:
+        click.echo(profiler.report(), err=True)
 
 
 if __name__ == '__main__':  # pragma: no cover
@@ -8,12 +8,22 @@
 #-------------------------------------------------------------------------------------------------
 
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 import glob
+import heapq
 import inspect
+from io import StringIO
 import logging
+import multiprocessing
 import os.path as op
+from time import perf_counter
 
-from .utils import Bunch, load_text, dump_text, _create_dir_if_not_exists
+from .manifest import Manifest
+from .tracing import Tracer, get_tracer, set_tracer, span
+from .tree import Node, RewritePass, run_passes
+from .utils import (Bunch, load_text, dump_text, _create_dir_if_not_exists, _open_atomic,
+                    get_pandoc_call_count)
 from .plugin import get_plugins
 
 logger = logging.getLogger(__name__)
@@ -23,25 +33,19 @@ logger = logging.getLogger(__name__)
 # Graph routines
 #-------------------------------------------------------------------------------------------------
 
-def _graph_from_edges(edges):
-    """Return the adjacency list of a graph defined by a list of edges."""
-    g = defaultdict(set)
-    for a, b in edges:
-        g[a].add(b)
-    return g
+# Default cost of a conversion function, in seconds. This is the order of magnitude of
+# an in-process tree transformation on a small document.
+DEFAULT_COST = .01
 
 
-def _bfs_paths(graph, start, target):
-    """Generate paths from start to target."""
-    # http://eddmann.com/posts/depth-first-search-and-breadth-first-search-in-python/  # noqa
-    queue = [(start, [start])]
-    while queue:
-        (vertex, path) = queue.pop(0)
-        for next in graph[vertex] - set(path):
-            if next == target:
-                yield path + [next]
-            else:
-                queue.append((next, path + [next]))
+def _graph_from_edges(edges, costs=None):
+    """Return the weighted adjacency list `{a: {b: cost}}` of a graph defined by a list
+    of edges. The cost of the edges not in `costs` is 1."""
+    costs = costs or {}
+    g = defaultdict(dict)
+    for a, b in edges:
+        g[a][b] = costs.get((a, b), 1)
+    return g
 
 
 def _bfs_component(graph, start):
@@ -50,17 +54,47 @@ def _bfs_component(graph, start):
         vertex = queue.pop(0)
         if vertex not in visited:
             visited.add(vertex)
-            queue.extend(graph[vertex] - visited)
+            queue.extend(set(graph[vertex]) - visited)
     return visited
 
 
-def _find_path(edges, start, target):
-    """Return a shortest path in a graph defined by a list of edges."""
-    graph = _graph_from_edges(edges)
-    try:
-        return next(_bfs_paths(graph, start, target))
-    except StopIteration:
-        return None
+def _shortest_paths(graph, start):
+    """Return a dictionary `{target: path}` with a cheapest path from start to every
+    other vertex reachable from start (Dijkstra algorithm)."""
+    paths = {}
+    # NOTE: ties between paths with the same cost are broken deterministically by
+    # comparing the paths themselves.
+    heap = [(0, (start,))]
+    while heap:
+        cost, path = heapq.heappop(heap)
+        vertex = path[-1]
+        if vertex in paths:
+            continue
+        paths[vertex] = path
+        for next, edge_cost in graph[vertex].items():
+            if next not in paths:
+                heapq.heappush(heap, (cost + edge_cost, path + (next,)))
+    # A vertex is not connected to itself.
+    del paths[start]
+    return paths
+
+
+def _all_shortest_paths(edges, costs=None):
+    """Return a dictionary `{(start, target): path}` with a cheapest path between
+    all pairs of connected vertices in a graph defined by a list of edges."""
+    graph = _graph_from_edges(edges, costs)
+    routes = {}
+    for start in sorted(graph):
+        for target, path in _shortest_paths(graph, start).items():
+            routes[(start, target)] = path
+    return routes
+
+
+def _find_path(edges, start, target, costs=None):
+    """Return a cheapest path in a graph defined by a list of edges."""
+    graph = _graph_from_edges(edges, costs)
+    path = _shortest_paths(graph, start).get(target, None)
+    return list(path) if path else None
 
 
 def _connected_component(edges, start):
@@ -69,10 +103,56 @@ def _connected_component(edges, start):
     return sorted(_bfs_component(graph, start) - set([start]))
 
 
+#-------------------------------------------------------------------------------------------------
+# Parallel conversion
+#-------------------------------------------------------------------------------------------------
+
+# Podoc instance of a worker process, created once when the worker starts.
+_WORKER_PODOC = None
+
+
+def _init_worker(podoc):
+    global _WORKER_PODOC
+    _WORKER_PODOC = podoc
+    # Warm the instance once per worker rather than once per file.
+    podoc._get_routes()
+
+
+def _convert_in_worker(context, do_dump):
+    """Convert a file in a worker process, and return the object, the context, and the
+    trace events recorded during the conversion."""
+    podoc = _WORKER_PODOC
+    logger.debug("Converting `%s` from %s to %s.", op.basename(context.path),
+                 context.source, context.target)
+    n = len(podoc._tracer.events) if podoc._tracer else 0
+    with podoc._tracing(save=False):
+        obj = podoc._convert_from_context(context.path, context, is_path=True,
+                                          do_dump=do_dump)
+    events = podoc._tracer.events[n:] if podoc._tracer else []
+    return obj, context, events
+
+
 #-------------------------------------------------------------------------------------------------
 # Main class
 #-------------------------------------------------------------------------------------------------
 
+def _get_size(obj):
+    """Return the size of an object: the length of a string, the number of nodes of a
+    tree, or None."""
+    if isinstance(obj, (str, bytes)):
+        return len(obj)
+    if isinstance(obj, Node):
+        n = 0
+        stack = [obj]
+        while stack:
+            node = stack.pop()
+            n += 1
+            if isinstance(node, Node):
+                stack.extend(node.children)
+        return n
+    return None
+
+
 def _get_annotation(func, name):
     return getattr(func, '__annotations__', {}).get(name, None)
 
@@ -89,14 +169,32 @@ class Podoc(object):
         List of plugins to load. By default, load all plugins found.
     with_pandoc : bool (True)
         Whether to load all pandoc conversion paths.
+    trace : str (None)
+        Path of a Chrome trace-event JSON file recording the conversions.
+    tree_sizes : bool (None)
+        Whether to count the nodes of the trees in the statistics. By default, the trees
+        are only counted when tracing.
 
     """
 
-    def __init__(self, plugins=None, with_pandoc=True):
+    def __init__(self, plugins=None, with_pandoc=True, trace=None, tree_sizes=None):
+        self._init_args = (plugins, with_pandoc, trace, tree_sizes)
+        self._tracer = Tracer(trace) if trace else None
+        self._tree_sizes = tree_sizes
         self._funcs = {}  # mapping `(lang0, lang1) => func`
+        self._passes = {}  # mapping `(stage, lang0, lang1) => [rewrite passes]`
         self._langs = {}  # mapping `lang: Bunch()`
+        self._routes = None  # mapping `(lang0, lang1) => lang_chain`, computed lazily
+        self._stats = {}  # mapping `(stage, lang0, lang1) => Bunch(count, time, ...)`
+        self._learned_costs = {}  # mapping `(lang0, lang1) => cost`
+        self._lazy = []  # functions registering languages when they are first needed
         self._load_plugins(plugins, with_pandoc)
 
+    def __reduce__(self):
+        # NOTE: conversion functions are often closures that cannot be pickled, so a
+        # Podoc instance is recreated from its plugins in another process.
+        return (self.__class__, self._init_args)
+
     def _load_plugins(self, plugins=None, with_pandoc=True):
         """Load plugins. By default (None), all plugins found are loaded."""
         # Load plugins.
@@ -107,16 +205,56 @@ class Podoc(object):
                 continue
             p().attach(self)
 
+    def register_lazy(self, func):
+        """Register a function `func(podoc)` that registers languages and conversion
+        functions. It is only called when an unknown language or conversion is requested."""
+        self._lazy.append(func)
+
+    def _attach_lazy(self):
+        """Call the lazy registration functions. Return whether any was called."""
+        if not self._lazy:
+            return False
+        lazy, self._lazy = self._lazy, []
+        for func in lazy:
+            func(self)
+        return True
+
+    def _get_lang(self, lang):
+        """Return the Bunch registered for a language."""
+        if lang not in self._langs:
+            self._attach_lazy()
+        return self._langs[lang]
+
+    def _get_func(self, source, target):
+        """Return the Bunch registered for a conversion function, or None."""
+        if (source, target) not in self._funcs:
+            self._attach_lazy()
+        return self._funcs.get((source, target), None)
+
     # Main methods
     # --------------------------------------------------------------------------------------------
 
     def register_func(self, func=None, source=None, target=None,
-                      pre_filter=None, post_filter=None,
+                      pre_filter=None, post_filter=None, cost=None,
+                      stream_func=None, pandoc=False,
                       ):
-        """Register a conversion function between two languages."""
+        """Register a conversion function between two languages.
+
+        The optional cost is an estimate of the conversion time in seconds, used to find
+        the cheapest conversion path between two languages. `pandoc=True` declares that
+        the function calls pandoc.
+
+        The optional `stream_func(obj, f, context=None)` writes the output of the
+        conversion directly into the output file object `f`, when the conversion is the
+        last one of a streaming conversion (see `convert_file()`). It is responsible for
+        the whole file, as the dump function of the target language. `f` is a temporary
+        file, moved onto `context.output` once the conversion succeeds.
+
+        """
         if func is None:
             return lambda _: self.register_func(_, source=source,
-                                                target=target)
+                                                target=target,
+                                                cost=cost, pandoc=pandoc)
         assert func
         assert 'context' in inspect.getargspec(func).args
         source = source or _get_annotation(func, 'source')
@@ -131,7 +269,29 @@ class Podoc(object):
         self._funcs[(source, target)] = Bunch(func=func,
                                               pre_filter=pre_filter,
                                               post_filter=post_filter,
+                                              cost=cost,
+                                              stream_func=stream_func,
+                                              pandoc=pandoc,
                                               )
+        # The conversion graph has changed: the routes need to be recomputed.
+        self._routes = None
+
+    def register_pass(self, rewrite_pass, source=None, target=None, stage='post_filter'):
+        """Register a rewrite pass applied to the input (`stage='pre_filter'`) or to the
+        output (`stage='post_filter'`) of a conversion function.
+
+        The passes of a stage are applied after the filter registered with the conversion
+        function, in the order of their registration. Consecutive passes are fused in a
+        single traversal of the tree when this does not change the result (see
+        `run_passes()`).
+
+        """
+        if stage not in ('pre_filter', 'post_filter'):
+            raise ValueError("Unknown stage `{}`.".format(stage))
+        assert isinstance(rewrite_pass, RewritePass)
+        assert source
+        assert target
+        self._passes.setdefault((stage, source, target), []).append(rewrite_pass)
 
     def register_lang(self, name, file_ext=None,
                       load_func=None, dump_func=None,
@@ -139,7 +299,12 @@ class Podoc(object):
                       eq_filter=None,
                       **kwargs):
         """Register a language with a file extension and load/dump
-        functions."""
+        functions.
+
+        The optional `split_func` and `dump_chunks` keyword arguments enable the conversion
+        by chunks from and to the language (see `convert_file()`).
+
+        """
         if file_ext:
             assert file_ext.startswith('.')
         if name in self._langs:
@@ -160,7 +325,7 @@ class Podoc(object):
                                   **kwargs)
 
     def _create_context(self, path=None, source=None, target=None, lang_chain=None,
-                        output=None, output_dir=None,
+                        output=None, output_dir=None, stream=False, chunk_size=None,
                         ):
 
         # Infer source and target from lang_chain.
@@ -198,10 +363,9 @@ class Podoc(object):
 
         # At this point, we should have a non-empty object.
         if lang_chain is None:
-            # Find the shortest path from source to target in the conversion graph.
+            # Find the cheapest path from source to target in the conversion graph.
             assert source and target
-            lang_chain = _find_path(self.conversion_pairs,
-                                    source, target)
+            lang_chain = self.get_route(source, target)
             if not lang_chain:
                 raise ValueError("No path found from `{}` to `{}`.".format(
                                  source, target))
@@ -215,80 +379,406 @@ class Podoc(object):
             output = op.join(output_dir, op.splitext(op.basename(path))[0] + extension)
 
         return Bunch(path=path, source=source, target=target,
-                     lang_chain=lang_chain, output=output)
-
-    def _make_conversion(self, obj, context):
+                     lang_chain=lang_chain, output=output,
+                     stream=stream, chunk_size=chunk_size)
+
+    def _record_stage(self, context, stage, source, target, start, end=None,
+                      size_in=None, size_out=None):
+        """Record the statistics of a conversion stage started at `start`, returned
+        by `_start_stage()`, and ended at `end` (by default, now)."""
+        t, n = start
+        end = end if end is not None else perf_counter()
+        record = Bunch(stage=stage, source=source, target=target,
+                       time=end - t,
+                       size_in=size_in, size_out=size_out,
+                       pandoc_calls=get_pandoc_call_count() - n,
+                       )
+        context.setdefault('stats', []).append(record)
+        self._add_stats(record)
+        tracer = get_tracer()
+        if tracer:
+            tracer.add('%s %s' % (stage, ' => '.join(filter(None, (source, target)))),
+                       t, t + record.time, cat='stage',
+                       size_in=size_in, size_out=size_out)
+
+    def _start_stage(self):
+        return perf_counter(), get_pandoc_call_count()
+
+    def _get_size(self, obj):
+        """Return the size of an object for the statistics. Counting the nodes of a tree
+        takes a full traversal, so that it is only done when tracing or if requested."""
+        if isinstance(obj, Node) and not (self._tree_sizes or get_tracer()):
+            return None
+        return _get_size(obj)
+
+    @contextmanager
+    def _tracing(self, save=True):
+        """Activate the tracer of this instance, if any, and save the trace at the end."""
+        if self._tracer is None or get_tracer() is self._tracer:
+            yield
+            return
+        previous = set_tracer(self._tracer)
+        try:
+            yield
+        finally:
+            set_tracer(previous)
+            if save:
+                self._tracer.save()
+
+    def _add_stats(self, record):
+        s = self._stats.get((record.stage, record.source, record.target), None)
+        if s is None:
+            s = self._stats[(record.stage, record.source, record.target)] = Bunch(
+                count=0, time=0., size_in=0, size_out=0, pandoc_calls=0)
+        s.count += 1
+        s.time += record.time
+        s.size_in += record.size_in or 0
+        s.size_out += record.size_out or 0
+        s.pandoc_calls += record.pandoc_calls
+
+    def _run_stage(self, context, stage, source, target, func, obj):
+        start = self._start_stage()
+        out = func(obj, context=context)
+        end = perf_counter()
+        self._record_stage(context, stage, source, target, start, end=end,
+                           size_in=self._get_size(obj), size_out=self._get_size(out))
+        return out
+
+    def _run_passes(self, context, stage, source, target, obj):
+        passes = self._passes.get((stage, source, target), None)
+        if not passes:
+            return obj
+        start = self._start_stage()
+        times = {}
+        out = run_passes(obj, passes, times=times)
+        end = perf_counter()
+        self._record_stage(context, stage.replace('_filter', '_passes'), source, target, start,
+                           end=end, size_in=self._get_size(obj), size_out=self._get_size(out))
+        # Time spent in the rewrite methods of every pass.
+        for p in passes:
+            record = Bunch(stage='pass %s' % p.__class__.__name__, source=source,
+                           target=target, time=times.get(p, 0.),
+                           size_in=None, size_out=None, pandoc_calls=0)
+            context.setdefault('stats', []).append(record)
+            self._add_stats(record)
+        return out
+
+    def _get_stream_func(self, context):
+        """Return the function streaming the output of the last conversion into the
+        output file, or None if the output cannot be streamed."""
+        if not context.get('stream', None) or not context.output:
+            return None
+        t0, t1 = context.lang_chain[-2:]
+        fd = self._get_func(t0, t1)
+        # NOTE: the output of the last conversion must be written as is.
+        if (not fd or not fd.stream_func or fd.post_filter or
+                self._passes.get(('post_filter', t0, t1), None)):
+            return None
+        return fd.stream_func
+
+    def _make_conversion(self, obj, context, f=None):
+        """Convert an object along the language chain. If the file object `f` is set,
+        the output of the last conversion is streamed into it, and None is returned."""
         # Iterate over all successive pairs.
-        for t0, t1 in zip(context.lang_chain, context.lang_chain[1:]):
+        pairs = list(zip(context.lang_chain, context.lang_chain[1:]))
+        for i, (t0, t1) in enumerate(pairs):
             # Get the function registered for t0, t1.
-            fd = self._funcs.get((t0, t1), None)
+            fd = self._get_func(t0, t1)
             if not fd:
                 raise ValueError("No function registered for `{}` => `{}`.".
                                  format(t0, t1))
-            f = fd.func
             # Pre-filter.
-            obj = fd.pre_filter(obj, context=context) if fd.pre_filter else obj
+            if fd.pre_filter:
+                obj = self._run_stage(context, 'pre_filter', t0, t1, fd.pre_filter, obj)
+            obj = self._run_passes(context, 'pre_filter', t0, t1, obj)
+            if f is not None and i == len(pairs) - 1:
+                # Write the output of the last conversion into the file.
+                start = self._start_stage()
+                fd.stream_func(obj, f, context=context)
+                end = perf_counter()
+                self._record_stage(context, 'func', t0, t1, start, end=end,
+                                   size_in=self._get_size(obj), size_out=f.tell())
+                return None
             # Perform the conversion.
-            obj = f(obj, context=context)
+            obj = self._run_stage(context, 'func', t0, t1, fd.func, obj)
             # Post-filter.
-            obj = fd.post_filter(obj, context=context) if fd.post_filter else obj
+            if fd.post_filter:
+                obj = self._run_stage(context, 'post_filter', t0, t1, fd.post_filter, obj)
+            obj = self._run_passes(context, 'post_filter', t0, t1, obj)
         return obj
 
-    def _convert_from_context(self, obj_or_path, context, is_path=None, do_append=None):
-        # Load the object from disk if necessary.
-        obj = self.load(obj_or_path, context.source, context=context) if is_path else obj_or_path
-        # Make the conversion in memory.
-        obj = self._make_conversion(obj, context)
+    def _convert_from_context(self, obj_or_path, context, is_path=None, do_append=None,
+                              do_dump=True):
+        name = op.basename(context.path) if is_path else 'text'
+        if context.get('chunk_size', None):
+            return self._convert_chunks(obj_or_path, context, is_path=is_path,
+                                        do_append=do_append, do_dump=do_dump)
+        with span('convert %s' % name, cat='convert', lang_chain=context.lang_chain):
+            # Load the object from disk if necessary.
+            if is_path:
+                start = self._start_stage()
+                obj = self.load(obj_or_path, context.source, context=context)
+                end = perf_counter()
+                self._record_stage(context, 'load', None, context.source, start, end=end,
+                                   size_in=op.getsize(obj_or_path),
+                                   size_out=self._get_size(obj))
+            else:
+                obj = obj_or_path
+            if do_dump and not do_append and self._get_stream_func(context):
+                # Stream the output of the last conversion into the output file.
+                # NOTE: the output file is only replaced if the conversion succeeds.
+                _create_dir_if_not_exists(op.dirname(context.output))
+                with _open_atomic(context.output) as f:
+                    obj = self._make_conversion(obj, context, f=f)
+                context['output_file_required'] = True
+                return obj
+            # Make the conversion in memory.
+            obj = self._make_conversion(obj, context)
+            if do_dump:
+                self._dump_from_context(obj, context, do_append=do_append)
+        return obj
+
+    def _convert_chunks(self, obj_or_path, context, is_path=None, do_append=None,
+                        do_dump=True):
+        """Split the source in chunks, convert them independently, and dump their outputs
+        in order into the output file."""
+        if not context.output or not do_dump or do_append:
+            raise ValueError("The conversion by chunks requires one output file per input.")
+        split_func = self._get_lang(context.source).get('split_func', None)
+        dump_chunks = self._get_lang(context.target).get('dump_chunks', None)
+        if not split_func or not dump_chunks:
+            raise ValueError("Unable to convert `{}` to `{}` by chunks.".format(
+                             context.source, context.target))
+
+        def _iter_outputs(f_in):
+            chunks = split_func(f_in, context.chunk_size)
+            while True:
+                start = self._start_stage()
+                chunk = next(chunks, None)
+                if chunk is None:
+                    return
+                self._record_stage(context, 'load', None, context.source, start,
+                                   size_out=len(chunk))
+                yield self._make_conversion(chunk, context)
+
+        name = op.basename(context.path) if is_path else 'text'
+        with span('convert %s' % name, cat='convert', lang_chain=context.lang_chain):
+            _create_dir_if_not_exists(op.dirname(context.output))
+            f_in = open(obj_or_path, 'r') if is_path else StringIO(obj_or_path)
+            # NOTE: the output file is only replaced if the conversion succeeds.
+            with f_in, _open_atomic(context.output) as f:
+                dump_chunks(_iter_outputs(f_in), f, context=context)
+        context['output_file_required'] = True
+
+    def _dump_from_context(self, obj, context, do_append=None):
         # Save the file, unless the conversion function did it (output_file_required).
         if context.output and not context.get('output_file_required', None):
             output_dir = op.dirname(context.output)
             _create_dir_if_not_exists(output_dir)
+            start = self._start_stage()
             self.dump(obj, context.output, lang=context.target,
                       context=context, do_append=do_append)
-        return obj
+            end = perf_counter()
+            size_out = op.getsize(context.output) if op.exists(context.output) else None
+            self._record_stage(context, 'dump', context.target, None, start, end=end,
+                               size_in=self._get_size(obj), size_out=size_out)
 
     def convert_text(self, text, source=None, target=None, lang_chain=None,
-                     output=None, output_dir=None,
+                     output=None, output_dir=None, stream=False, chunk_size=None,
                      return_context=False):
         # Create the context object.
         context = self._create_context(source=source, target=target, lang_chain=lang_chain,
-                                       output=output, output_dir=output_dir,)
-        obj = self._convert_from_context(text, context, is_path=False)
+                                       output=output, output_dir=output_dir, stream=stream,
+                                       chunk_size=chunk_size)
+        with self._tracing():
+            obj = self._convert_from_context(text, context, is_path=False)
         if return_context:
             return obj, context
         return obj
 
     def convert_files(self, paths, source=None, target=None, lang_chain=None,
-                      output=None, output_dir=None):
-        """Convert a file by passing it through a chain of conversion functions."""
-        objs = []
-        for i, path in enumerate(paths):
-            # Create the context object.
-            context = self._create_context(path=path, source=source, target=target,
-                                           lang_chain=lang_chain,
-                                           output=output, output_dir=output_dir,
-                                           )
+                      output=None, output_dir=None, jobs=None, incremental=False,
+                      stream=False, chunk_size=None):
+        """Convert a file by passing it through a chain of conversion functions.
+
+        With `jobs > 1`, the files are converted in parallel in a pool of `jobs` processes.
+
+        With `stream=True`, the last conversion writes its output directly into the output
+        file when it supports it (see `register_func()`), and the object is None.
+
+        With `chunk_size`, every file is split in chunks of about `chunk_size` characters,
+        which are converted independently and written in order into the output file (see
+        `convert_file()`).
+
+        With `incremental=True`, a manifest in `output_dir` records the converted files,
+        and the files whose outputs are up to date are skipped (their object is None).
+
+        """
+        # Create the context objects.
+        contexts = [self._create_context(path=path, source=source, target=target,
+                                         lang_chain=lang_chain,
+                                         output=output, output_dir=output_dir,
+                                         stream=stream, chunk_size=chunk_size,
+                                         )
+                    for path in paths]
+        objs = [None] * len(contexts)
+        todo = list(range(len(contexts)))
+        manifest = None
+        if incremental:
+            if not output_dir:
+                raise ValueError("Incremental conversion requires an output directory.")
+            manifest = Manifest(output_dir, uses_pandoc=self._uses_pandoc)
+            todo = [i for i in todo if not manifest.is_up_to_date(contexts[i])]
+            logger.debug("Skipping %d up-to-date files.", len(contexts) - len(todo))
+        try:
+            with self._tracing():
+                converted = self._iter_convert_files([contexts[i] for i in todo], jobs=jobs)
+                for i, obj in zip(todo, converted):
+                    objs[i] = obj
+                    if manifest:
+                        manifest.update(contexts[i])
+        finally:
+            # NOTE: the successful conversions are recorded even if another one failed.
+            if manifest:
+                manifest.save()
+        return objs[0] if objs and len(objs) else objs
+
+    def _uses_pandoc(self, lang_chain):
+        """Return whether a conversion along a lang chain calls pandoc."""
+        return any(getattr(self._get_func(t0, t1), 'pandoc', False)
+                   for t0, t1 in zip(lang_chain, lang_chain[1:]))
+
+    def _iter_convert_files(self, contexts, jobs=None):
+        """Convert files and yield the objects in the order of the contexts."""
+        if jobs and jobs > 1 and len(contexts) > 1:
+            yield from self._iter_convert_files_parallel(contexts, jobs)
+            return
+        for i, context in enumerate(contexts):
             logger.debug("Converting `%s` from %s to %s.", op.basename(context.path),
                          context.source, context.target)
-            obj = self._convert_from_context(context.path, context,
+            yield self._convert_from_context(context.path, context,
                                              is_path=True, do_append=i >= 1)
-            objs.append(obj)
-        return objs[0] if objs and len(objs) else objs
+
+    def _iter_convert_files_parallel(self, contexts, jobs):
+        """Convert files in a pool of processes, and yield the objects in the order
+        of the contexts."""
+        # When all files are appended to a single output file, the workers only convert
+        # the files, and the parent process saves them in order.
+        single_output = len(set(context.output for context in contexts)) == 1
+        # NOTE: forked workers inherit a copy of this instance, including the functions
+        # registered at runtime and the precomputed route table.
+        self._get_routes()
+        methods = multiprocessing.get_all_start_methods()
+        mp_context = multiprocessing.get_context('fork') if 'fork' in methods else None
+        logger.debug("Converting %d files with %d processes.", len(contexts), jobs)
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=mp_context,
+                                 initializer=_init_worker, initargs=(self,)) as executor:
+            futures = [executor.submit(_convert_in_worker, context, not single_output)
+                       for context in contexts]
+            for i, (context, future) in enumerate(zip(contexts, futures)):
+                try:
+                    obj, worker_context, events = future.result()
+                except Exception as e:
+                    raise RuntimeError("Unable to convert `%s`: %s" %
+                                       (context.path, e)) from e
+                # Retrieve the information set by the conversion functions, like the
+                # resources.
+                context.update(worker_context)
+                for record in worker_context.get('stats', ()):
+                    self._add_stats(record)
+                if self._tracer:
+                    self._tracer.events.extend(events)
+                if single_output:
+                    self._dump_from_context(obj, context, do_append=i >= 1)
+                yield obj
 
     def convert_file(self, path, source=None, target=None, lang_chain=None,
-                     output=None, output_dir=None, return_context=False):
+                     output=None, output_dir=None, stream=False, chunk_size=None,
+                     return_context=False):
+        """Convert a file by passing it through a chain of conversion functions.
+
+        With `stream=True` and an output file, the last conversion writes its output
+        directly into the output file when it supports it, without creating the whole
+        output in memory, and the returned object is None.
+
+        With `chunk_size`, the file is split in chunks of about `chunk_size` characters at
+        safe block boundaries, with the `split_func(f, chunk_size)` registered with the
+        source language. The chunks are converted independently, and their outputs are
+        written in order into the output file object by the `dump_chunks(objs, f,
+        context=None)` function registered with the target language. The memory usage is then
+        proportional to the size of a chunk. This requires an output file, and the returned
+        object is None.
+
+        """
         # Create the context object.
         context = self._create_context(path=path, source=source, target=target,
                                        lang_chain=lang_chain,
                                        output=output, output_dir=output_dir,
+                                       stream=stream, chunk_size=chunk_size,
                                        )
         logger.debug("Converting `%s` from %s to %s.", op.basename(context.path),
                      context.source, context.target)
-        obj = self._convert_from_context(context.path, context, is_path=True)
+        with self._tracing():
+            obj = self._convert_from_context(context.path, context, is_path=True)
         if return_context:
             return obj, context
         return obj
 
+    def get_cost(self, source, target):
+        """Return the cost of a conversion function.
+
+        The learned cost (mean measured time) has precedence over the cost declared
+        in `register_func()`, which has precedence over the default cost.
+
+        """
+        learned = self._learned_costs.get((source, target), None)
+        if learned is not None:
+            return learned
+        cost = self._funcs[(source, target)].cost
+        return cost if cost is not None else DEFAULT_COST
+
+    def stats(self):
+        """Return the statistics of all conversions made so far.
+
+        This is a dictionary `{(stage, source, target): Bunch(count, time, size_in,
+        size_out, pandoc_calls)}`, where the stage is one of `load`, `pre_filter`,
+        `pre_passes`, `func`, `post_filter`, `post_passes`, `dump`, or `pass <Name>` for
+        the time spent in the rewrite methods of a registered pass. The times are in
+        seconds, the sizes are the lengths of the strings, the numbers of nodes of the
+        trees (see the `tree_sizes` parameter), or the file sizes in bytes. The source is
+        None for `load` and the target is None for `dump`.
+
+        """
+        return {key: s.copy() for key, s in self._stats.items()}
+
+    def learn_costs(self):
+        """Use the mean time of all conversions made so far as the conversion costs."""
+        # The cost of a conversion includes the pre- and post-filters.
+        totals = defaultdict(float)
+        for (stage, t0, t1), s in self._stats.items():
+            if stage in ('pre_filter', 'pre_passes', 'func', 'post_filter', 'post_passes'):
+                totals[(t0, t1)] += s.time
+        for (stage, t0, t1), s in self._stats.items():
+            if stage == 'func':
+                self._learned_costs[(t0, t1)] = totals[(t0, t1)] / s.count
+        # The costs have changed: the routes need to be recomputed.
+        self._routes = None
+
+    def _get_routes(self):
+        """Return the route table, computing it if the conversion graph has changed."""
+        if self._routes is None:
+            costs = {pair: self.get_cost(*pair) for pair in self._funcs}
+            self._routes = _all_shortest_paths(self._funcs, costs)
+        return self._routes
+
+    def get_route(self, source, target):
+        """Return a cheapest lang chain from a source to a target language, or None if
+        there is no conversion path between them."""
+        route = self._get_routes().get((source, target), None)
+        if not route and self._attach_lazy():
+            route = self._get_routes().get((source, target), None)
+        return list(route) if route else None
+
     def pre_filter(self, obj, source, target):
         fd = self._funcs.get((source, target), None)
         if fd and fd.pre_filter:
@@ -302,25 +792,36 @@ class Podoc(object):
     @property
     def languages(self):
         """List of all registered languages."""
+        self._attach_lazy()
         return sorted(self._langs)
 
     @property
     def file_extensions(self):
         """List of all registered file extensions."""
+        self._attach_lazy()
         return sorted(set(lang.file_ext for lang in self._langs.values()
                           if lang.file_ext))
 
     @property
     def conversion_pairs(self):
         """List of registered conversion pairs."""
+        self._attach_lazy()
         return sorted(self._funcs.keys())
 
+    @property
+    def conversion_routes(self):
+        """Mapping `(source, target) => lang_chain` with a cheapest conversion path
+        between all pairs of connected languages."""
+        self._attach_lazy()
+        return {pair: list(route) for pair, route in self._get_routes().items()}
+
     # File-related methods
     # --------------------------------------------------------------------------------------------
 
     def get_target_languages(self, lang):
         """List of languages to which a given language can be converted to."""
-        return _connected_component(self.conversion_pairs, lang)
+        self._attach_lazy()
+        return sorted(target for source, target in self._get_routes() if source == lang)
 
     def get_files_in_dir(self, path, lang=None):
         """Return the list of files of a given language in a directory."""
@@ -329,7 +830,7 @@ class Podoc(object):
         assert op.exists(path)
         assert op.isdir(path)
         # Find the file extension for the given language.
-        file_ext = (self._langs[lang].file_ext or '') if lang else ''
+        file_ext = (self._get_lang(lang).file_ext or '') if lang else ''
         filenames = glob.glob(op.join(path, '*' + file_ext))
         return [op.join(path, fn) for fn in filenames]
 
@@ -338,19 +839,21 @@ class Podoc(object):
         for name, b in self._langs.items():
             if b.file_ext == file_ext:
                 return name
+        if self._attach_lazy():
+            return self.get_lang_for_file_ext(file_ext)
         raise ValueError(("The file extension `{}` hasn't been "
                           "registered.").format(file_ext))
 
     def get_file_ext(self, lang):
         """Return the file extension registered for a given language."""
-        return self._langs[lang].file_ext
+        return self._get_lang(lang).file_ext
 
     def load(self, path, lang=None, context=None):
         """Load a file which has a registered file extension."""
         # Find the language corresponding to the file's extension.
         file_ext = op.splitext(path)[1]
         lang = lang or self.get_lang_for_file_ext(file_ext)
-        func = self._langs[lang].load_func
+        func = self._get_lang(lang).load_func
         kwargs = {'context': context} if 'context' in inspect.getargspec(func).args else {}
         # Load the file using the function registered for the language.
         return func(path, **kwargs)
@@ -360,7 +863,7 @@ class Podoc(object):
         # Find the language corresponding to the file's extension.
         file_ext = op.splitext(path)[1]
         lang = lang or self.get_lang_for_file_ext(file_ext)
-        func = self._langs[lang].dump_func
+        func = self._get_lang(lang).dump_func
         kwargs = {'context': context} if 'context' in inspect.getargspec(func).args else {}
         if 'do_append' in inspect.getargspec(func).args:
             kwargs.update({'do_append': do_append})
@@ -371,18 +874,18 @@ class Podoc(object):
         """Load an object from its string representation."""
         assert lang
         # Load the string using the function registered for the language.
-        return self._langs[lang].loads_func(s)
+        return self._get_lang(lang).loads_func(s)
 
     def dumps(self, contents, lang=None):
         """Dump an object to a string."""
         assert lang
         # Dump the string using the function registered for the language.
-        return self._langs[lang].dumps_func(contents)
+        return self._get_lang(lang).dumps_func(contents)
 
     def assert_equal(self, obj0, obj1, lang=None):
         """Assert that two objects are equal."""
         assert lang
-        f = self._langs[lang].eq_filter
+        f = self._get_lang(lang).eq_filter
         if not f:
             assert obj0 == obj1
             return
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+"""Manifest of converted files, used for incremental conversions."""
+
+
+#-------------------------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------------------------
+
+import hashlib
+import json
+import logging
+import os
+import os.path as op
+
+from .utils import _get_resources_path
+
+logger = logging.getLogger(__name__)
+
+
+#-------------------------------------------------------------------------------------------------
+# Utils
+#-------------------------------------------------------------------------------------------------
+
+MANIFEST_FILENAME = '.podoc-manifest.json'
+
+
+def _hash_file(path, block_size=1 << 16):
+    """Return the hexadecimal SHA-256 hash of the contents of a file."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _get_pandoc_version():
+    """Return the pandoc version, or None if pandoc is not available."""
+    from .utils import get_pandoc_version
+    try:
+        return get_pandoc_version()
+    except (OSError, RuntimeError):  # pragma: no cover
+        return None
+
+
+def _hash_resources(path):
+    """Return the hashes `{filename: hash}` of the resources of a document, stored in
+    the `*_files` directory next to it."""
+    res_path = _get_resources_path(path)
+    if not op.isdir(res_path):
+        return {}
+    return {fn: _hash_file(op.join(res_path, fn))
+            for fn in sorted(os.listdir(res_path))
+            if op.isfile(op.join(res_path, fn))}
+
+
+#-------------------------------------------------------------------------------------------------
+# Manifest
+#-------------------------------------------------------------------------------------------------
+
+class Manifest(object):
+    """Record of the files converted in an output directory.
+
+    Every output file has an entry with the hashes of its source file and resources,
+    the lang chain, and the podoc and pandoc versions. A conversion is up to date
+    if its output file exists and its entry has not changed.
+
+    The optional `uses_pandoc(lang_chain)` function returns whether a lang chain calls
+    pandoc: the pandoc version is only recorded for these conversions.
+
+    """
+
+    def __init__(self, output_dir, uses_pandoc=None):
+        self.output_dir = op.realpath(output_dir)
+        self.uses_pandoc = uses_pandoc
+        self.path = op.join(self.output_dir, MANIFEST_FILENAME)
+        self.entries = self._load()
+        self._fingerprints = {}
+
+    def _load(self):
+        if not op.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            logger.warning("Unable to read the manifest `%s`, ignoring it.", self.path)
+            return {}
+
+    def _key(self, context):
+        return op.relpath(context.output, self.output_dir)
+
+    def fingerprint(self, context):
+        """Return the entry of a conversion context."""
+        key = self._key(context)
+        if key not in self._fingerprints:
+            from podoc import __version__
+            uses_pandoc = self.uses_pandoc and self.uses_pandoc(context.lang_chain)
+            self._fingerprints[key] = {
+                'source': context.path,
+                'source_hash': _hash_file(context.path),
+                'resources': _hash_resources(context.path),
+                'lang_chain': list(context.lang_chain),
+                'podoc_version': __version__,
+                'pandoc_version': _get_pandoc_version() if uses_pandoc else None,
+            }
+        return self._fingerprints[key]
+
+    def is_up_to_date(self, context):
+        """Return whether the output of a conversion context is up to date."""
+        # NOTE: the fingerprint is computed before the conversion, so that a source
+        # modified during the conversion is converted again next time.
+        fingerprint = self.fingerprint(context)
+        if not op.exists(context.output):
+            return False
+        return self.entries.get(self._key(context), None) == fingerprint
+
+    def update(self, context):
+        """Record a successful conversion."""
+        self.entries[self._key(context)] = self.fingerprint(context)
+
+    def save(self):
+        """Save the manifest in the output directory."""
+        if not op.isdir(self.output_dir):  # pragma: no cover
+            return
+        # NOTE: write to a temporary file first so that an interrupted build does not
+        # leave a corrupted manifest.
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
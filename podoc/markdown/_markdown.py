@@ -7,17 +7,19 @@
 # Imports
 #-------------------------------------------------------------------------------------------------
 
+from io import StringIO
 import logging
 import os.path as op
-
-import pypandoc
+import re
 
 from podoc.ast import ASTNode, ASTPlugin
 from podoc.markdown.renderer import MarkdownRenderer
 from podoc.plugin import IPlugin
-from podoc.tree import TreeTransformer
-from podoc.utils import (PANDOC_MARKDOWN_FORMAT,
-                         _get_file,
+from podoc.profiling import get_profiler
+from podoc.tracing import span
+from podoc.tree import Node
+from podoc.utils import (PANDOC_MARKDOWN_FORMAT, PANDOC_COST,
+                         _get_file, pandoc,
                          _get_resources_path, _save_resources,
                          )
 
@@ -25,119 +27,357 @@ logger = logging.getLogger(__name__)
 
 
 #-------------------------------------------------------------------------------------------------
-# Markdown renderer
+# Markdown writer
 #-------------------------------------------------------------------------------------------------
 
-class ASTToMarkdown(TreeTransformer):
-    """Read an AST and render a Markdown string."""
+def _is_visit_block(node):
+    """Whether a node was flagged as a block during a visit.
+
+    The metadata slot is read directly so that no dict is created on nodes without metadata.
+
+    """
+    return node._meta.get('is_block', None) if node._meta else None
+
+
+# Placeholder of the contents in the strings returned by the renderer.
+_CONTENTS = '\x00'
+
+
+class _LinePrefixes(object):
+    """Stack of the line prefixes of the nested block quotes and list items.
+
+    Every layer of the stack is the streaming version of
+    `'\n'.join(prefix + line for line in text.splitlines())`, where the first line has a
+    different prefix, always written if the layer is eager, and where `text` is the output
+    of the inner layer.
+
+    A layer that has written its first line and has no pending line break passes the text
+    of the inner layers as is: when all layers are in this state, a new line is written
+    with the concatenation of their prefixes, cached until a layer is popped.
+
+    """
+
+    def __init__(self, write):
+        self._write = write
+        # Layers `[first_prefix, prefix, started, pending line break, last line break was \r]`.
+        self._layers = []
+        # Concatenated prefixes of the outermost layers, None until a line is written at
+        # this depth.
+        self._prefixes = ['']
+        self._unsteady = 0  # number of layers not started or with a pending line break
+
+    def _prefix(self, n):
+        """Return the concatenated prefixes of the `n` outermost layers."""
+        prefix = self._prefixes[n]
+        if prefix is None:
+            prefix = self._prefixes[n] = ''.join(layer[1] for layer in self._layers[:n])
+        return prefix
+
+    def push(self, first_prefix, prefix, eager=False):
+        assert prefix and '\n' not in prefix
+        layer = [first_prefix, prefix, eager, False, False]
+        self._layers.append(layer)
+        # NOTE: the prefixes are not concatenated at every level, which would be quadratic
+        # in the depth of the tree.
+        self._prefixes.append(None)
+        if not eager:
+            self._unsteady += 1
+        elif first_prefix:
+            self._feed([[first_prefix]], len(self._layers) - 2, 0)
+
+    def pop(self):
+        # NOTE: like `splitlines()`, the last line break of a layer is dropped.
+        layer = self._layers.pop()
+        self._prefixes.pop()
+        if not layer[2] or layer[3]:
+            self._unsteady -= 1
+
+    def write(self, text):
+        if not text:
+            return
+        layer = self._layers[-1]
+        if layer[4]:
+            layer[4] = False
+            if text[0] == '\n':
+                text = text[1:]
+                if not text:
+                    return
+        # Fast path: all layers pass the text as is.
+        if not self._unsteady and text == text.splitlines()[0]:
+            self._write(text)
+            return
+        # The lines are lists of strings, followed by None if the text ends with a line
+        # break.
+        lines = [[line] if line else [] for line in text.splitlines()]
+        if not text[-1].splitlines()[0]:
+            lines.append(None)
+        self._feed(lines, len(self._layers) - 1, 0)
+        layer[4] = text.endswith('\r')
+
+    def _feed(self, lines, j, above):
+        """Pass lines through the layer `j` and the outer ones, where `above` is the
+        number of unsteady layers above `j`.
+
+        The strings of the lines are in reverse order, so that the prefixes are appended.
+        Only the last line of the input of a layer may be None, for a line break that is
+        written with the next line.
+
+        """
+        layers = self._layers
+        while j >= 0 and lines != [[]]:
+            layer = layers[j]
+            first_prefix, prefix, started, pending, _ = layer
+            was_unsteady = not started or pending
+            below = self._unsteady - above - was_unsteady
+            trailing = lines[-1] is None
+            if trailing:
+                lines.pop()
+            if below == 0:
+                # The outer layers pass the text as is.
+                prefix = self._prefix(j + 1)
+            if pending:
+                lines.insert(0, [])
+                lines[1].append(prefix)
+            elif not started and first_prefix:
+                lines[0].append(first_prefix)
+            for line in lines[1 + pending:]:
+                line.append(prefix)
+            started, pending = True, trailing
+            layer[2], layer[3], layer[4] = started, pending, False
+            is_unsteady = not started or pending
+            self._unsteady += is_unsteady - was_unsteady
+            above += is_unsteady
+            j = -1 if below == 0 else j - 1
+        if lines != [[]]:
+            self._write('\n'.join(''.join(reversed(line)) for line in lines))
+
+
+_PUSH = object()
+_POP = object()
+
+
+class MarkdownWriter(object):
+    """Render an AST as Markdown in a single pass, into a file object or a buffer.
+
+    The text is written as soon as it is known instead of being returned and joined at
+    every level of the tree. The block quotes and the list items push their line prefixes
+    on a stack.
+
+    The `_write_<Name>(node)` methods return the operations rendering a node, and are
+    recorded by the transform profiler (see `podoc.profiling`).
+
+    """
 
     def __init__(self):
         self.renderer = MarkdownRenderer()
-        # Nested lists.
-        self._lists = []
-
-    def get_inner_contents(self, node):
-        delim = ''
-        # What is the delimiter between children? If the children are
-        # blocks, we should insert a new line between consecutive blocks.
-        # Otherwise we just concatenate the children.
-        if node.children:
-            child = node.children[0]
-            # TODO: improve this.
-            if (isinstance(child, ASTNode) and
-                    (child.is_block() or child.get('_visit_meta', {}).get('is_block', None))):
-                delim = '\n\n'
-        return delim.join(self.transform_children(node))
-
-    def transform_str(self, text):
-        return text
 
-    def transform_Node(self, node):
-        return self.get_inner_contents(node)
+    def write(self, ast, f=None):
+        """Write the Markdown of an AST into a file object, or return it as a string."""
+        profiler = get_profiler()
+        write_ops = (self._write_ops if profiler is None
+                     else profiler.wrap(self, self._write_ops))
+        if f is None:
+            buf = StringIO()
+            write_ops([ast], buf.write)
+            return buf.getvalue()
+        write_ops([ast], f.write)
+
+    def _write_ops(self, ops, write):
+        profiler = get_profiler()
+        prefixes = _LinePrefixes(write)
+        layers, write_prefixed = prefixes._layers, prefixes.write
+        # NOTE: the stack contains the strings to write, the nodes to render, and the
+        # `(_PUSH, first_prefix, prefix, eager)` and `_POP` operations on the line prefixes.
+        stack = list(reversed(ops))
+        while stack:
+            op = stack.pop()
+            if op.__class__ is str:
+                if layers:
+                    write_prefixed(op)
+                elif op:
+                    write(op)
+            elif op is _POP:
+                prefixes.pop()
+            elif isinstance(op, Node):
+                func = getattr(self, '_write_' + op.name, self._write_Node)
+                if profiler is not None:
+                    func = profiler.wrap(self, func)
+                stack.extend(reversed(func(op)))
+            else:
+                prefixes.push(*op[1:])
+
+    def _children(self, node):
+        children = node.children
+        if not children:
+            return []
+        # The blocks are separated by empty lines.
+        child = children[0]
+        if (len(children) > 1 and isinstance(child, ASTNode) and
+                (child.is_block() or _is_visit_block(child))):
+            ops = [child]
+            for child in children[1:]:
+                ops.append('\n\n')
+                ops.append(child)
+            return ops
+        return list(children)
+
+    def _wrap(self, rendered, node):
+        """Return the operations writing the rendered string with the node's contents."""
+        before, after = rendered.split(_CONTENTS, 1)
+        return [before] + self._children(node) + [after]
+
+    def _write_Node(self, node):
+        return self._children(node)
 
     # Block nodes
     # --------------------------------------------------------------------------------------------
 
-    def transform_Plain(self, node):
-        return self.renderer.text(self.get_inner_contents(node))
+    def _write_Plain(self, node):
+        return self._wrap(self.renderer.text(_CONTENTS), node)
 
-    def transform_Para(self, node):
-        return self.transform_Plain(node)
+    def _write_Para(self, node):
+        return self._write_Plain(node)
 
-    def transform_Header(self, node):
-        return self.renderer.heading(self.get_inner_contents(node),
-                                     level=node.level)
+    def _write_Header(self, node):
+        return self._wrap(self.renderer.heading(_CONTENTS, level=node.level), node)
 
-    def transform_CodeBlock(self, node):
-        return self.renderer.code(self.get_inner_contents(node),
-                                  lang=node.lang)
+    def _write_CodeBlock(self, node):
+        # NOTE: the renderer strips the trailing new lines of the code, which is rendered
+        # separately.
+        buf = StringIO()
+        self._write_ops(self._children(node), buf.write)
+        return [self.renderer.code(buf.getvalue(), lang=node.lang)]
 
-    def transform_BlockQuote(self, node):
-        return self.renderer.quote(self.get_inner_contents(node))
+    def _write_BlockQuote(self, node):
+        return [(_PUSH, '> ', '> ', False)] + self._children(node) + [_POP]
 
-    def transform_MathBlock(self, node):
-        return self.renderer.math_block(self.get_inner_contents(node))
+    def _write_MathBlock(self, node):
+        return self._wrap(self.renderer.math_block(_CONTENTS), node)
 
     def _write_list(self, node, list_type):
-        assert list_type in ('bullet', 'ordered')
         if list_type == 'bullet':
             bullet = node.bullet_char
             suffix = node.delimiter
-        elif list_type == 'ordered':
+        else:
             bullet = node.start
-            # NOTE: CommonMark doesn't appear to support non-decimal bullets
-            # node.style is not used
             suffix = ')' if node.delimiter == 'OneParen' else '.'
             if not suffix.endswith(' '):
                 suffix += ' '
-        # This is a list of processed items.
-        items = self.transform_children(node)
-        out = []
-        for item in items:
-            # We indent all lines in the item.
-            item_lines = item.splitlines()
-            item = '\n'.join((('  ' if i else '') + line) for i, line in enumerate(item_lines))
-            # We add the bullet and suffix to the first line in the item.
-            out.append(str(bullet) + suffix + item)
-            # We increase the current ordered list number.
+        ops = []
+        for i, item in enumerate(node.children):
+            if i:
+                ops.append('\n')
+            ops.extend(((_PUSH, str(bullet) + suffix, '  ', True), item, _POP))
             if list_type == 'ordered':
                 bullet += 1
-        return '\n'.join(out)
+        return ops
 
-    def transform_BulletList(self, node):
+    def _write_BulletList(self, node):
         return self._write_list(node, 'bullet')
 
-    def transform_OrderedList(self, node):
+    def _write_OrderedList(self, node):
         return self._write_list(node, 'ordered')
 
-    def transform_ListItem(self, node):
-        out = self.get_inner_contents(node)
-        return out
-
     # Inline nodes
     # --------------------------------------------------------------------------------------------
 
-    def transform_Emph(self, node):
-        return self.renderer.emph(self.get_inner_contents(node))
+    def _write_Emph(self, node):
+        return self._wrap(self.renderer.emph(_CONTENTS), node)
+
+    def _write_Strong(self, node):
+        return self._wrap(self.renderer.strong(_CONTENTS), node)
 
-    def transform_Strong(self, node):
-        return self.renderer.strong(self.get_inner_contents(node))
+    def _write_Code(self, node):
+        return self._wrap(self.renderer.inline_code(_CONTENTS), node)
 
-    def transform_Code(self, node):
-        return self.renderer.inline_code(
-            self.get_inner_contents(node))
+    def _write_LineBreak(self, node):
+        return [self.renderer.linebreak()]
 
-    def transform_LineBreak(self, node):
-        return self.renderer.linebreak()
+    def _write_Math(self, node):
+        return self._wrap(self.renderer.math(_CONTENTS), node)
 
-    def transform_Math(self, node):
-        return self.renderer.math(self.get_inner_contents(node))
+    def _write_Link(self, node):
+        return self._wrap(self.renderer.link(_CONTENTS, node.url), node)
 
-    def transform_Link(self, node):
-        return self.renderer.link(self.get_inner_contents(node), node.url)
+    def _write_Image(self, node):
+        return self._wrap(self.renderer.image(_CONTENTS, node.url), node)
+
+
+#-------------------------------------------------------------------------------------------------
+# Markdown chunks
+#-------------------------------------------------------------------------------------------------
 
-    def transform_Image(self, node):
-        return self.renderer.image(self.get_inner_contents(node), node.url)
+_FENCE = re.compile(r' {0,3}(`{3,}|~{3,})')
+_DIV = re.compile(r' {0,3}:{3,}(.*)')
+_DASHES = re.compile(r'-{3,}\s*$')
+# Link reference and footnote definitions.
+_REFERENCE = re.compile(r' {0,3}\[[^\]]+\]:')
+# Lines that may continue the previous block after a blank line: indented lines, list items,
+# definitions, and table captions.
+_CONTINUATION = re.compile(r'(?:[ \t]|[-+*:~](?:[ \t]|$)|Table:|'
+                           r'\(?(?:[0-9]+|#|@\w*|[a-zA-Z]|[ivxlcdmIVXLCDM]+)[.)](?:[ \t]|$))')
+
+
+def _iter_markdown_lines(f):
+    """Yield the lines of a Markdown file, whether they are in a fenced code block, and
+    whether a chunk can start at them."""
+    fence = None  # opening fence of the current code block
+    divs = 0  # depth of the fenced divs
+    table = False  # whether the lines are in a multiline table
+    blank = True
+    lines = iter(f)
+    line = next(lines, None)
+    while line is not None:
+        next_line = next(lines, None)
+        code = fence is not None
+        boundary = (blank and not code and not divs and not table and
+                    bool(line.strip()) and not _CONTINUATION.match(line))
+        m = _FENCE.match(line)
+        if code:
+            if (m and m.group(1)[0] == fence[0] and len(m.group(1)) >= len(fence) and
+                    not line[m.end():].strip()):
+                fence = None
+        elif m:
+            fence = m.group(1)
+        elif _DIV.match(line):
+            if _DIV.match(line).group(1).strip():
+                divs += 1
+            elif divs:
+                divs -= 1
+        elif _DASHES.match(line):
+            # NOTE: a multiline table starts with a row of dashes, and ends with a row of
+            # dashes followed by a blank line. A horizontal rule is followed by a blank line.
+            if table or blank:
+                table = bool(next_line and next_line.strip())
+        yield line, code, boundary
+        blank = not line.strip()
+        line = next_line
+
+
+def split_markdown(f, chunk_size):
+    """Split a Markdown file object into chunks of at least `chunk_size` characters.
+
+    The chunks are split before the top-level blocks, outside of the fenced code blocks,
+    fenced divs, multiline tables, and lists. A document with link reference or footnote
+    definitions is not split, as they can be used in any chunk.
+
+    """
+    assert chunk_size > 0
+    if any(not code and _REFERENCE.match(line) for line, code, _ in _iter_markdown_lines(f)):
+        logger.debug("Unable to split a Markdown document with reference definitions.")
+        f.seek(0)
+        yield f.read()
+        return
+    f.seek(0)
+    chunk, size = [], 0
+    for line, _, boundary in _iter_markdown_lines(f):
+        if boundary and size >= chunk_size:
+            yield ''.join(chunk)
+            chunk, size = [], 0
+        chunk.append(line)
+        size += len(line)
+    if chunk:
+        yield ''.join(chunk)
 
 
 #-------------------------------------------------------------------------------------------------
@@ -146,9 +386,14 @@ class ASTToMarkdown(TreeTransformer):
 
 class MarkdownPlugin(IPlugin):
     def attach(self, podoc):
-        podoc.register_lang('markdown', file_ext='.md', load_func=self.load, dump_func=self.dump,)
-        podoc.register_func(source='markdown', target='ast', func=self.read)
-        podoc.register_func(source='ast', target='markdown', func=self.write)
+        podoc.register_lang('markdown', file_ext='.md', load_func=self.load, dump_func=self.dump,
+                            split_func=split_markdown, dump_chunks=self.dump_chunks,
+                            )
+        # NOTE: reading Markdown requires a pandoc subprocess.
+        podoc.register_func(source='markdown', target='ast', func=self.read, cost=PANDOC_COST,
+                            pandoc=True)
+        podoc.register_func(source='ast', target='markdown', func=self.write,
+                            stream_func=self.stream)
 
     def load(self, file_or_path):
         """Load a Markdown file and return a string."""
@@ -162,17 +407,44 @@ class MarkdownPlugin(IPlugin):
             path = op.realpath(f.name)
             f.write(text)
             f.write('\n')
-        # Save the resources.
+        self._save_resources(path, context=context)
+
+    def dump_chunks(self, texts, f, context=None):
+        """Write a sequence of strings into a single Markdown file object, as successive
+        blocks, like `stream()`."""
+        for i, text in enumerate(texts):
+            if i:
+                f.write('\n\n')
+            f.write(text)
+        f.write('\n')
+        path = (context or {}).get('output', None) or op.realpath(f.name)
+        self._save_resources(path, context=context)
+
+    def _save_resources(self, path, context=None):
         if (context or {}).get('resources', {}):
             _save_resources(context.get('resources', {}), _get_resources_path(path))
 
     def read(self, contents, context=None):
         assert isinstance(contents, str)
-        js = pypandoc.convert_text(contents, 'json', format=PANDOC_MARKDOWN_FORMAT)
+        js = pandoc(contents, 'json', format=PANDOC_MARKDOWN_FORMAT)
         ast = ASTPlugin().loads(js)
         return ast
 
     def write(self, ast, context=None):
         assert isinstance(ast, (ASTNode, str))
-        text = ASTToMarkdown().transform(ast)
+        with span('MarkdownWriter', cat='transform'):
+            text = MarkdownWriter().write(ast)
         return text
+
+    def stream(self, ast, f, context=None):
+        """Write the Markdown of an AST directly into a file object, like `dump()`.
+
+        The resources are saved next to the output file of the context, if any.
+
+        """
+        assert isinstance(ast, (ASTNode, str))
+        with span('MarkdownWriter', cat='transform'):
+            MarkdownWriter().write(ast, f)
+        f.write('\n')
+        path = (context or {}).get('output', None) or op.realpath(f.name)
+        self._save_resources(path, context=context)
@@ -7,10 +7,14 @@
 # Imports
 #-------------------------------------------------------------------------------------------------
 
+from io import StringIO
+import os.path as op
+
 from pytest import fixture
 
 from podoc.ast import ASTNode
-from .._markdown import MarkdownPlugin
+from podoc.profiling import profile
+from .._markdown import MarkdownPlugin, MarkdownWriter, split_markdown
 
 
 #-------------------------------------------------------------------------------------------------
@@ -49,6 +53,80 @@ def test_markdown_write(ast, markdown):
     assert MarkdownPlugin().write(ast) == markdown
 
 
+def test_markdown_stream(tempdir, ast, markdown):
+    path = op.join(tempdir, 'a.md')
+    with open(path, 'w') as f:
+        MarkdownPlugin().stream(ast, f)
+    assert MarkdownPlugin().load(path) == markdown + '\n'
+
+
+def test_split_markdown():
+    def _split(text):
+        chunks = list(split_markdown(StringIO(text), 1))
+        assert ''.join(chunks) == text
+        return chunks
+
+    assert _split('') == []
+    assert _split('# a\n\nb\nc\n\nd') == ['# a\n\n', 'b\nc\n\n', 'd']
+    # Fenced code blocks and divs.
+    assert _split('```\na\n\nb\n```\n\nc\n') == ['```\na\n\nb\n```\n\n', 'c\n']
+    assert _split('::: a\nb\n\nc\n:::\n\nd\n') == ['::: a\nb\n\nc\n:::\n\n', 'd\n']
+    # Lists, indented lines, and definitions.
+    assert len(_split('a\n\n- b\n\n- c\n\n    d\n\n1. e\n\n2) f\n\n:   g\n')) == 1
+    # Multiline tables and horizontal rules.
+    table = '---\n a\n--- ---\n b\n\n c\n---\n\n'
+    assert _split(table + '---\n\nd\n') == [table, '---\n\n', 'd\n']
+    # Reference definitions.
+    assert len(_split('a\n\n[b]: http://c\n\nd\n')) == 1
+    assert len(_split('a\n\n```\n[b]: http://c\n```\n')) == 2
+
+    assert list(split_markdown(StringIO('a\n\nb\n\nc\n'), 5)) == ['a\n\nb\n\n', 'c\n']
+
+
+def test_markdown_write_deep():
+    # The depth of the tree is larger than the recursion limit.
+    ast = node = ASTNode('root')
+    for _ in range(2000):
+        node = node.add_child(ASTNode('BlockQuote'))
+    node.add_child(ASTNode('Para', children=['hello']))
+    assert MarkdownPlugin().write(ast) == '> ' * 2000 + 'hello'
+
+
+def test_markdown_writer(ast, markdown):
+    f = StringIO()
+    MarkdownWriter().write(ast, f)
+    assert f.getvalue() == markdown
+
+    # Line breaks in quotes and lists.
+    quote = ASTNode('BlockQuote', children=[
+        ASTNode('Para', children=['a\n\nb\r']),
+        ASTNode('CodeBlock', lang='py', children=['\ncode\n\n']),
+        ASTNode('BulletList', bullet_char='*', delimiter=' ', children=[
+            ASTNode('ListItem', children=['item\n']),
+            ASTNode('ListItem'),
+            ASTNode('ListItem', children=[ASTNode('BlockQuote', children=['x\ny'])]),
+        ])])
+    ast = ASTNode('root', children=[quote, ASTNode('BlockQuote'), quote.copy()])
+    quote_md = ('> a\n> \n> b\n> \n> ```py\n> \n> code\n> ```\n> \n'
+                '> * item\n> * \n> * > x\n>   > y')
+    assert MarkdownWriter().write(ast) == quote_md + '\n\n\n\n' + quote_md
+
+
+def test_markdown_writer_profile(ast, markdown):
+    with profile() as profiler:
+        assert MarkdownWriter().write(ast) == markdown
+    stats = profiler.stats()
+    assert stats[('MarkdownWriter', '_write_Emph')].calls == 1
+    assert stats[('MarkdownWriter', '_write_ops')].calls == 1
+
+
+def test_markdown_writer_no_meta(ast):
+    # Writing the tree does not create the visit metadata of the nodes.
+    MarkdownWriter().write(ast)
+    assert ast._meta is None
+    assert ast.children[0]._meta is None
+
+
 # ------------------------------------------------------------------------------------------------
 # Test Markdown renderer inline
 # Check safe round-tripping on CommonMark -> AST -> CommonMark
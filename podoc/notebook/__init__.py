@@ -9,4 +9,13 @@
 #-------------------------------------------------------------------------------------------------
 
 from ._notebook import NotebookPlugin
-from .manager import PodocContentsManager
+from podoc.utils import _set_lazy_attrs
+
+
+def _import_contents_manager():
+    from .manager import PodocContentsManager
+    return PodocContentsManager
+
+
+# NOTE: the contents manager is imported lazily as it requires the Jupyter Notebook.
+_set_lazy_attrs(__name__, PodocContentsManager=_import_contents_manager)
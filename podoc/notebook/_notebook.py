@@ -36,23 +36,17 @@ This all could (and should) be improved...
 #-------------------------------------------------------------------------------------------------
 
 import base64
-from collections import Counter
+from collections import Counter, deque
 import logging
 from mimetypes import guess_extension, guess_type
 import os.path as op
 import re
 
-import nbformat
-from nbformat.v4 import (new_notebook,
-                         new_markdown_cell,
-                         new_code_cell,
-                         new_output,
-                         )
-
 from podoc.markdown import MarkdownPlugin
 from podoc.ast import ASTNode  # , TreeTransformer
 from podoc.plugin import IPlugin
-from podoc.tree import TreeTransformer
+from podoc.tracing import span
+from podoc.tree import RewritePass, run_passes
 from podoc.utils import _get_file, _get_resources_path
 from ._utils import extract_image, extract_table
 
@@ -91,6 +85,7 @@ _NBFORMAT_VERSION = 4
 
 
 def open_notebook(path):
+    import nbformat
     with open(path, 'r') as f:
         return nbformat.read(f, _NBFORMAT_VERSION)
 
@@ -99,6 +94,7 @@ class NotebookReader(object):
     _NEW_CELL_DELIMITER = '@@@@@ PODOC-NEW-CELL @@@@@'
 
     def read(self, notebook, context=None):
+        import nbformat
         assert isinstance(notebook, nbformat.NotebookNode)
         self.resources = {}  # Dictionary {filename: data}.
         context = context or {}
@@ -116,7 +112,7 @@ class NotebookReader(object):
 
         # NOTE: for performance reasons, we parse the Markdown of all cells at once
         # to reduce the overhead of calling pandoc.
-        self._markdown_tree = []
+        self._markdown_tree = deque()
         self._read_all_markdown(notebook.cells)
 
         for cell_index, cell in enumerate(notebook.cells):
@@ -147,7 +143,7 @@ class NotebookReader(object):
 
     def read_markdown(self, cell, cell_index=None):
         if self._markdown_tree:
-            cell_tree = self._markdown_tree.pop(0)
+            cell_tree = self._markdown_tree.popleft()
             self.tree.children.extend(cell_tree.children)
         else:
             logger.warn("Isolated read_markdown() call: slow because of pandoc call overhead.")
@@ -232,7 +228,8 @@ class CodeCellWrapper(object):
         return mc[0][0] if mc else 'python'
 
     def wrap(self, ast):
-        self.ast = ast.copy()
+        # NOTE: the children are shared with the input AST.
+        self.ast = ast.shallow_copy()
         self.ast.children = []
         self._code_cell = None
         # Infer the notebook's language.
@@ -301,19 +298,17 @@ def replace_resource_paths(ast, context=None):
         logger.debug("No output or path given, not replacing resource paths.")
         return ast
 
-    class ResourceTransformer(TreeTransformer):
-        def transform_Image(self, node):
+    class ResourcePass(RewritePass):
+        inspects = ()
+
+        def rewrite_Image(self, node):
             url = node.url
             if url.startswith('{resource:'):
-                node.url = re.sub(r'\{resource:([^\}]+)\}', r'%s/\1' % path, url)
+                node = node.replace(url=re.sub(r'\{resource:([^\}]+)\}', r'%s/\1' % path, url))
                 logger.debug("Replace %s by %s.", url, node.url)
             return node
 
-        def transform_Node(self, node):
-            node.children = self.transform_children(node)
-            return node
-
-    return ResourceTransformer().transform(ast)
+    return run_passes(ast, [ResourcePass()])
 
 
 def _append_newlines(s):
@@ -334,6 +329,8 @@ def _get_b64_resource(data):
 
 class NotebookWriter(object):
     def write(self, ast, context=None):
+        import nbformat
+        from nbformat.v4 import new_notebook
         self.execution_count = 1
         self._md = MarkdownPlugin()
         # Add code cells in the AST.
@@ -365,9 +362,11 @@ class NotebookWriter(object):
         return nb
 
     def new_markdown_cell(self, node, index=None):
+        from nbformat.v4 import new_markdown_cell
         return new_markdown_cell(self._md.write(node))
 
     def new_code_cell(self, node, index=None):
+        from nbformat.v4 import new_code_cell, new_output
         # Get the code cell input: the first child of the CodeCell block.
         input_block = node.children[0]
         assert input_block.name == 'CodeBlock'
@@ -421,8 +420,9 @@ class NotebookWriter(object):
                     image_path = None
                 # If the image path exists, open it.
                 if image_path and op.exists(image_path):
-                    with open(image_path, 'rb') as f:
-                        data[mime_type] = _get_b64_resource(f.read())
+                    with span('load resource', cat='io', path=image_path):
+                        with open(image_path, 'rb') as f:
+                            data[mime_type] = _get_b64_resource(f.read())
                 else:  # pragma: no cover
                     logger.debug("File `%s` doesn't exist.", image_path)
                 # Save the caption in the output text.
@@ -464,18 +464,22 @@ class NotebookPlugin(IPlugin):
                             )
 
     def load(self, file_or_path):
+        import nbformat
         with _get_file(file_or_path, 'r') as f:
             nb = nbformat.read(f, _NBFORMAT_VERSION)
         return nb
 
     def dump(self, nb, file_or_path):
+        import nbformat
         with _get_file(file_or_path, 'w') as f:
             nbformat.write(nb, f, _NBFORMAT_VERSION)
 
     def loads(self, s):
+        import nbformat
         return nbformat.reads(s, _NBFORMAT_VERSION)
 
     def dumps(self, nb):
+        import nbformat
         return nbformat.writes(nb, _NBFORMAT_VERSION)
 
     def eq_filter(self, nb):
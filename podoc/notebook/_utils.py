@@ -15,8 +15,6 @@ import subprocess
 import sys
 import tempfile
 
-from IPython.lib.latextools import genelatex
-
 logger = logging.getLogger(__name__)
 
 
@@ -71,6 +69,7 @@ tbody tr:nth-child(odd) {
 
 
 def latex_to_png_base64(latex):
+    from IPython.lib.latextools import genelatex
     with tempfile.TemporaryDirectory() as tmpdir:
         tmpfile = os.path.join(tmpdir, "tmp.tex")
         dvifile = os.path.join(tmpdir, "tmp.dvi")
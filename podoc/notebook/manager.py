@@ -12,6 +12,7 @@ import os.path as op
 
 from tornado import web
 import nbformat
+from nbformat.v4 import new_notebook
 from traitlets import Unicode, Bool
 from traitlets.config import Configurable
 # BUG FIX: see https://github.com/jupyter/notebook/issues/3056
@@ -22,7 +23,6 @@ except ImportError:  # pragma: no cover
 from notebook.services.contents.filemanager import FileContentsManager
 
 from podoc.core import Podoc
-from ._notebook import new_notebook
 
 logger = logging.getLogger(__name__)
 
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+"""Profiling of the tree transformers."""
+
+
+#-------------------------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------------------------
+
+from contextlib import contextmanager
+from functools import wraps
+import inspect
+import logging
+from time import perf_counter
+
+from .utils import Bunch
+
+logger = logging.getLogger(__name__)
+
+
+#-------------------------------------------------------------------------------------------------
+# Transform profiler
+#-------------------------------------------------------------------------------------------------
+
+class TransformProfiler(object):
+    """Count the calls, cumulative time and self time of the `transform_<Name>()` methods
+    of all tree transformers, and of the `_write_<Name>()` methods of the Markdown writer.
+
+    The self time of a method excludes the time spent in the nested transform methods.
+    The cumulative time of recursive calls is only counted once.
+
+    """
+
+    def __init__(self):
+        self._stats = {}  # mapping `(class_name, method_name) => [calls, cumtime, selftime]`
+        self._stack = []  # time spent in nested calls, for every active call
+        self._active = {}  # mapping `key => number of active calls`
+
+    def _get_stats(self, key):
+        stats = self._stats.get(key, None)
+        if stats is None:
+            stats = self._stats[key] = [0, 0., 0.]
+        return stats
+
+    def _wrap_generator(self, key, func):
+        # NOTE: the self time of a generator method is the time spent in its steps, and
+        # its cumulative time includes the transformation of the children between the steps.
+        @wraps(func)
+        def wrapped(*args, **kwargs):
+            stats = self._get_stats(key)
+            active = self._active.get(key, 0)
+            self._active[key] = active + 1
+            start = perf_counter()
+            gen = func(*args, **kwargs)
+            value = None
+            try:
+                while True:
+                    self._stack.append(0.)
+                    t = perf_counter()
+                    try:
+                        request = gen.send(value)
+                    except StopIteration as e:
+                        return e.value
+                    finally:
+                        elapsed = perf_counter() - t
+                        nested = self._stack.pop()
+                        if self._stack:
+                            self._stack[-1] += elapsed
+                        stats[2] += elapsed - nested
+                    value = yield request
+            finally:
+                self._active[key] = active
+                stats[0] += 1
+                stats[1] += perf_counter() - start if not active else 0.
+        return wrapped
+
+    def wrap(self, transformer, func):
+        """Wrap a transform method to record its statistics."""
+        key = (transformer.__class__.__name__, func.__name__)
+        if inspect.isgeneratorfunction(func):
+            return self._wrap_generator(key, func)
+
+        @wraps(func)
+        def wrapped(*args, **kwargs):
+            stats = self._get_stats(key)
+            active = self._active.get(key, 0)
+            self._active[key] = active + 1
+            self._stack.append(0.)
+            t = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - t
+                nested = self._stack.pop()
+                if self._stack:
+                    self._stack[-1] += elapsed
+                self._active[key] = active
+                stats[0] += 1
+                stats[1] += elapsed if not active else 0.
+                stats[2] += elapsed - nested
+        return wrapped
+
+    def stats(self):
+        """Return the statistics `{(class_name, method_name): Bunch(calls, cumtime,
+        selftime)}`."""
+        return {key: Bunch(calls=calls, cumtime=cumtime, selftime=selftime)
+                for key, (calls, cumtime, selftime) in self._stats.items()}
+
+    def report(self, n=None):
+        """Return a table of the methods sorted by decreasing self time."""
+        items = sorted(self._stats.items(), key=lambda kv: -kv[1][2])[:n]
+        lines = ['{:<32s} {:<24s} {:>9s} {:>10s} {:>10s}'.format(
+                 'transformer', 'method', 'calls', 'cumtime', 'selftime')]
+        for (cls, method), (calls, cumtime, selftime) in items:
+            lines.append('{:<32s} {:<24s} {:>9d} {:>10.4f} {:>10.4f}'.format(
+                         cls, method, calls, cumtime, selftime))
+        return '\n'.join(lines)
+
+
+# Active transform profiler, None when profiling is disabled.
+_PROFILER = None
+
+
+def get_profiler():
+    """Return the active transform profiler, or None."""
+    return _PROFILER
+
+
+@contextmanager
+def profile(pstats_path=None):
+    """Profile the tree transformers in a `with` block, and yield the `TransformProfiler`.
+
+    If `pstats_path` is set, the code is also profiled with cProfile, and the statistics
+    are saved in this file (see the `pstats` module).
+
+    """
+    global _PROFILER
+    profiler, previous = TransformProfiler(), _PROFILER
+    _PROFILER = profiler
+    if pstats_path:
+        import cProfile
+        cprofiler = cProfile.Profile()
+        cprofiler.enable()
+    try:
+        yield profiler
+    finally:
+        _PROFILER = previous
+        if pstats_path:
+            cprofiler.disable()
+            cprofiler.dump_stats(pstats_path)
+            logger.debug("Saved the profile to `%s`.", pstats_path)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""Test benchmarks."""
+
+
+#-------------------------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------------------------
+
+import json
+import logging
+import os.path as op
+
+from click.testing import CliRunner
+
+from ..benchmark import (generate_markdown, generate_notebook, generate_ast_json,
+                         run_benchmarks, save_baseline, load_baseline, compare_to_baseline,
+                         benchmark)
+from ..core import Podoc
+
+logger = logging.getLogger(__name__)
+
+
+#-------------------------------------------------------------------------------------------------
+# Tests
+#-------------------------------------------------------------------------------------------------
+
+def test_generate_markdown():
+    md = generate_markdown(n_cells=3, list_depth=3, n_images=2, code_lines=4)
+    assert md == generate_markdown(n_cells=3, list_depth=3, n_images=2, code_lines=4)
+    assert md.count('## Section') == 3
+    assert md.count('```python') == 3
+    assert md.count('![Output') == 2
+    assert '\n    * ' in md
+    assert 'x_3 = ' in md
+
+    ast = Podoc(with_pandoc=False).convert_text(generate_markdown(n_cells=3), source='markdown',
+                                                target='ast')
+    assert [c.name for c in ast.children[:3]] == ['Header', 'Para', 'BulletList']
+
+
+def test_generate_notebook():
+    nb = generate_notebook(n_cells=3, n_images=1)
+    assert [c.cell_type for c in nb.cells] == ['markdown', 'code'] * 3
+    assert nb.cells[1].outputs[1].output_type == 'display_data'
+
+    ast = Podoc(with_pandoc=False).convert_text(nb, source='notebook', target='ast')
+    assert ast.children[0].name == 'Header'
+
+
+def test_generate_ast_json():
+    d = json.loads(generate_ast_json(n_cells=2))
+    assert d['blocks']
+
+
+def test_run_benchmarks(tempdir):
+    results = run_benchmarks(repeat=1, n_cells=2)
+    assert sorted(results) == ['ast->json', 'ast->markdown', 'ast->notebook',
+                               'json->ast', 'markdown->ast', 'notebook->ast']
+    assert all(t > 0 for t in results.values())
+
+    path = op.join(tempdir, 'baseline.json')
+    save_baseline(results, path, n_cells=2)
+    assert load_baseline(path) == results
+
+
+def test_compare_to_baseline():
+    baseline = {'a': 1., 'b': 1., 'c': 0.}
+    results = {'a': 1.1, 'b': 2., 'c': 1., 'd': 1.}
+    assert compare_to_baseline(results, baseline) == {'b': 2.}
+    assert compare_to_baseline(results, baseline, tolerance=1.5) == {}
+
+
+def test_benchmark_cli(tempdir):
+    path = op.join(tempdir, 'baseline.json')
+    runner = CliRunner()
+    result = runner.invoke(benchmark, ['--cells', '2', '--repeat', '1', '--save', path])
+    assert result.exit_code == 0
+    assert 'markdown->ast' in result.output
+
+    # Fake a much faster baseline.
+    with open(path, 'r') as f:
+        d = json.load(f)
+    d['results'] = {name: t / 100. for name, t in d['results'].items()}
+    with open(path, 'w') as f:
+        json.dump(d, f)
+    result = runner.invoke(benchmark, ['--cells', '2', '--repeat', '1', '--compare', path])
+    assert result.exit_code == 1
+    assert 'Regression' in result.output
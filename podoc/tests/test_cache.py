@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""Test conversion cache."""
+
+
+#-------------------------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------------------------
+
+import logging
+import os
+
+from ..cache import ConversionCache
+
+logger = logging.getLogger(__name__)
+
+
+#-------------------------------------------------------------------------------------------------
+# Tests
+#-------------------------------------------------------------------------------------------------
+
+def test_cache_key():
+    k = ConversionCache.make_key
+    assert k('hello', 'json', 'markdown') == k('hello', 'json', 'markdown')
+    assert k('hello', 'json', 'markdown') != k('hello!', 'json', 'markdown')
+    assert k('hello', 'json', 'markdown') != k('hello', 'json', 'rst')
+    assert k('hello', 'json', 'markdown', []) != k('hello', 'json', 'markdown', ['--toc'])
+
+
+def test_cache_memory():
+    cache = ConversionCache(max_size=10)
+    assert cache.get('a') is None
+    cache.set('a', 'aaaa')
+    cache.set('b', 'bbbb')
+    assert cache.get('a') == 'aaaa'
+    assert len(cache) == 2
+
+    # 'b' is the least recently used entry.
+    cache.set('c', 'cccc')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'aaaa'
+    assert cache.get('c') == 'cccc'
+
+    # Too large entries are not cached.
+    cache.set('d', 'd' * 20)
+    assert cache.get('d') is None
+
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.evictions) == (3, 3, 1)
+    assert (stats.count, stats.size) == (2, 8)
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_cache_disk(tempdir):
+    cache = ConversionCache(path=tempdir)
+    cache.set('ab01', 'hello')
+
+    # A new cache instance finds the output on disk.
+    cache = ConversionCache(path=tempdir)
+    assert cache.get('ab01') == 'hello'
+    assert cache.get('ab02') is None
+    assert len(cache) == 1
+
+
+def test_cache_disk_eviction(tempdir):
+    cache = ConversionCache(max_size=0, path=tempdir, max_disk_size=20)
+    for i in range(5):
+        cache.set('key%d' % i, '%d' % i * 8)
+        os.utime(cache._disk_path('key%d' % i), (i, i))
+    # The oldest entries are removed from the store.
+    assert cache.get('key0') is None
+    assert cache.get('key4') == '44444444'
+    assert sum(os.path.getsize(p) for p in cache._disk_files()) <= 20
+
+
+def test_cache_disk_overwrite(tempdir):
+    cache = ConversionCache(max_size=0, path=tempdir, max_disk_size=20)
+    for _ in range(5):
+        cache.set('key', 'x' * 8)
+    # Overwriting an entry does not grow the size of the store.
+    assert cache._disk_size == 8
+    assert cache.evictions == 0
@@ -53,6 +53,65 @@ def test_cli_2(tempdir):
     assert load_text(path) == 'hello world\n'
 
 
+def test_cli_jobs(tempdir):
+    """Convert several files in parallel."""
+    paths = [op.join(tempdir, 'hello%d.md' % i) for i in range(3)]
+    for i, path in enumerate(paths):
+        dump_text('hello world %d' % i, path)
+    _podoc('--no-pandoc -j 2 {} -t ast --output-dir={}'.format(' '.join(paths), tempdir))
+    for i in range(3):
+        assert 'world' in load_text(op.join(tempdir, 'hello%d.json' % i))
+
+
+def test_cli_incremental(tempdir):
+    """Only convert the files that changed."""
+    path = op.join(tempdir, 'hello.md')
+    path_o = op.join(tempdir, 'out', 'hello.json')
+    dump_text('hello world', path)
+    cmd = '--no-pandoc --incremental {} -t ast --output-dir={}'.format(
+        path, op.join(tempdir, 'out'))
+    _podoc(cmd)
+    mtime = op.getmtime(path_o)
+    _podoc(cmd)
+    assert op.getmtime(path_o) == mtime
+
+    # An output directory is required.
+    result = CliRunner().invoke(podoc, [path, '-t', 'ast', '--incremental'])
+    assert result.exit_code == 2
+    assert '--incremental' in result.output
+
+
+def test_cli_chunk_size(tempdir):
+    """Convert a file by chunks."""
+    path = op.join(tempdir, 'hello.md')
+    path_o = op.join(tempdir, 'hello.json')
+    dump_text('# hello\n\nhello world\n', path)
+    _podoc('--no-pandoc {} -o {} --chunk-size=1'.format(path, path_o))
+    assert Podoc(with_pandoc=False).load(path_o).children[1].children == ['hello world']
+
+    # An output file is required.
+    result = CliRunner().invoke(podoc, [path, '-t', 'ast', '--chunk-size=1'])
+    assert result.exit_code == 2
+    assert '--chunk-size' in result.output
+
+
+def test_cli_trace(tempdir):
+    path = op.join(tempdir, 'hello.md')
+    path_t = op.join(tempdir, 'trace.json')
+    dump_text('hello world', path)
+    _podoc('--no-pandoc {} -t ast --trace {}'.format(path, path_t))
+    assert 'traceEvents' in load_text(path_t)
+
+
+def test_cli_profile(tempdir):
+    path_p = op.join(tempdir, 'profile.pstats')
+    out = _podoc('--no-pandoc -f markdown -t ast --profile-output {}'.format(path_p),
+                 stdin='hello *world*')
+    assert 'PandocToPodoc' in out
+    assert 'selftime' in out
+    assert op.exists(path_p)
+
+
 def test_cli_3(tempdir):
     """From notebook to markdown."""
     path = op.join(tempdir, 'hello.md')
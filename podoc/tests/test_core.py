@@ -10,11 +10,14 @@
 import logging
 import os
 import os.path as op
+import time
 
 from pytest import fixture, raises
 
-from ..core import Podoc, _find_path, _get_annotation, _connected_component
+from ..core import (Podoc, _find_path, _get_annotation, _connected_component,
+                    _all_shortest_paths)
 from ..utils import get_test_file_path, load_text, dump_text
+from ..tree import RewritePass
 
 logger = logging.getLogger(__name__)
 
@@ -38,6 +41,25 @@ def test_find_path():
     assert _find_path([(1, 2), (2, 3), (1, 4), (4, 5)], 1, 5) == [1, 4, 5]
 
 
+def test_all_shortest_paths():
+    assert _all_shortest_paths([(1, 2), (2, 3)]) == {(1, 2): (1, 2),
+                                                     (1, 3): (1, 2, 3),
+                                                     (2, 3): (2, 3),
+                                                     }
+    routes = _all_shortest_paths([(1, 2), (2, 3), (1, 4), (4, 5), (5, 1)])
+    assert routes[(1, 5)] == (1, 4, 5)
+    assert routes[(5, 3)] == (5, 1, 2, 3)
+    assert (1, 1) not in routes
+    assert (3, 1) not in routes
+
+
+def test_find_path_costs():
+    edges = [(1, 2), (2, 3), (1, 3)]
+    assert _find_path(edges, 1, 3) == [1, 3]
+    assert _find_path(edges, 1, 3, costs={(1, 3): 3}) == [1, 2, 3]
+    assert _all_shortest_paths(edges, costs={(1, 3): 2})[(1, 3)] == (1, 2, 3)
+
+
 def test_connected_component():
     assert _connected_component([(1, 2), (2, 3)], 1) == [2, 3]
     assert _connected_component([(1, 2), (2, 3)], 2) == [3]
@@ -102,6 +124,13 @@ def test_podoc_convert_1(tempdir, podoc_fixture):
     with raises(ValueError):
         p.convert_text('hello', source='lower', target='unknown')
 
+    # Route table.
+    assert p.conversion_routes == {('lower', 'upper'): ['lower', 'upper'],
+                                   ('upper', 'lower'): ['upper', 'lower'],
+                                   }
+    assert p.get_route('lower', 'upper') == ['lower', 'upper']
+    assert p.get_route('lower', 'unknown') is None
+
     # Convert a file.
     path = op.join(tempdir, 'test.up')
     path2 = op.join(tempdir, 'test.low')
@@ -112,6 +141,133 @@ def test_podoc_convert_1(tempdir, podoc_fixture):
     assert p.convert_file(path, target='lower') == 'hello'
 
 
+def test_podoc_routes(podoc_fixture):
+    p = podoc_fixture
+    assert p.get_route('lower', 'title') is None
+
+    # The route table is invalidated when a new function is registered.
+    p.register_lang('title')
+    p.register_func(lambda text, context=None: text.title(), source='upper', target='title')
+    assert p.get_route('lower', 'title') == ['lower', 'upper', 'title']
+    assert p.get_target_languages('lower') == ['title', 'upper']
+    assert p.convert_text('hello world', source='lower', target='title') == 'Hello World'
+
+
+def test_podoc_declared_costs(podoc_fixture):
+    p = podoc_fixture
+    p.register_lang('title')
+    p.register_func(lambda text, context=None: text.title(),
+                    source='lower', target='title', cost=1.)
+    p.register_func(lambda text, context=None: text.title(),
+                    source='upper', target='title')
+
+    # The declared cost is used to find the cheapest path.
+    assert p.get_cost('lower', 'title') == 1.
+    assert p.get_route('lower', 'title') == ['lower', 'upper', 'title']
+
+
+def test_podoc_learned_costs(podoc_fixture):
+    p = podoc_fixture
+    p.register_lang('title')
+
+    @p.register_func(source='lower', target='title')
+    def totitle_slow(text, context=None):
+        time.sleep(.05)
+        return text.title()
+
+    @p.register_func(source='upper', target='title')
+    def totitle(text, context=None):
+        return text.title()
+
+    # Without declared costs, the shortest path is used.
+    assert p.get_route('lower', 'title') == ['lower', 'title']
+
+    # Learn the costs from the measured conversion times.
+    for lang_chain in (['lower', 'title'], ['lower', 'upper', 'title']):
+        assert p.convert_text('hello', lang_chain=lang_chain) == 'Hello'
+    p.learn_costs()
+    assert p.get_cost('lower', 'title') >= .05
+    assert p.get_route('lower', 'title') == ['lower', 'upper', 'title']
+
+
+def test_podoc_stats(tempdir, podoc_fixture):
+    p = podoc_fixture
+    p.register_lang('title', file_ext='.title')
+    p.register_func(lambda text, context=None: text.title(),
+                    source='upper', target='title',
+                    pre_filter=lambda text, context=None: text + '!',
+                    )
+
+    path = op.join(tempdir, 'test.low')
+    dump_text('hello', path)
+    obj, context = p.convert_file(path, target='title', output=op.join(tempdir, 'test.title'),
+                                  return_context=True)
+    assert obj == 'Hello!'
+
+    # Per-conversion statistics.
+    stages = [(r.stage, r.source, r.target) for r in context.stats]
+    assert stages == [('load', None, 'lower'),
+                      ('func', 'lower', 'upper'),
+                      ('pre_filter', 'upper', 'title'),
+                      ('func', 'upper', 'title'),
+                      ('dump', 'title', None),
+                      ]
+    assert [(r.size_in, r.size_out) for r in context.stats] == [
+        (5, 5), (5, 5), (5, 6), (6, 6), (6, 6)]
+    assert all(r.time >= 0 and r.pandoc_calls == 0 for r in context.stats)
+
+    # Aggregated statistics.
+    p.convert_text('hello', source='lower', target='title')
+    stats = p.stats()
+    assert stats[('func', 'lower', 'upper')].count == 2
+    assert stats[('func', 'lower', 'upper')].size_in == 10
+    assert stats[('load', None, 'lower')].count == 1
+    assert stats[('dump', 'title', None)].count == 1
+
+
+def test_podoc_stats_tree():
+    p = Podoc(with_pandoc=False, tree_sizes=True)
+    ast, context = p.convert_text('hello *world*', source='markdown', target='ast',
+                                  return_context=True)
+    record = context.stats[0]
+    assert record.size_in == len('hello *world*')
+    # root, Para, 'hello ', Emph, 'world'
+    assert record.size_out == 5
+    assert record.pandoc_calls <= 1
+
+    # By default, the trees are only counted when tracing.
+    p = Podoc(with_pandoc=False)
+    ast, context = p.convert_text('hello *world*', source='markdown', target='ast',
+                                  return_context=True)
+    assert context.stats[0].size_out is None
+
+
+def test_podoc_passes():
+    p = Podoc(with_pandoc=False)
+
+    class UpperPass(RewritePass):
+        def rewrite_Emph(self, node):
+            return node.replace(children=[child.upper() for child in node.children])
+
+    class StrongPass(RewritePass):
+        def rewrite_Emph(self, node):
+            return node.replace(name='Strong')
+
+    # The passes are applied in order.
+    p.register_pass(UpperPass(), source='markdown', target='ast')
+    p.register_pass(StrongPass(), source='markdown', target='ast')
+    with raises(ValueError):
+        p.register_pass(UpperPass(), source='markdown', target='ast', stage='func')
+
+    ast, context = p.convert_text('hello *world*', source='markdown', target='ast',
+                                  return_context=True)
+    assert p.convert_text(ast, source='ast', target='markdown') == 'hello **WORLD**'
+
+    stages = [r.stage for r in context.stats]
+    assert stages == ['func', 'post_passes', 'pass UpperPass', 'pass StrongPass']
+    assert p.stats()[('pass UpperPass', 'markdown', 'ast')].count == 1
+
+
 def test_podoc_convert_2(tempdir, podoc_fixture):
     p = podoc_fixture
 
@@ -136,6 +292,58 @@ def test_podoc_convert_2(tempdir, podoc_fixture):
     assert load_text(op.join(tempdir, 'out', 'test2.low')) == 'test2'
 
 
+def test_podoc_convert_parallel(tempdir, podoc_fixture):
+    p = podoc_fixture
+
+    paths = [op.join(tempdir, 'test%d.up' % i) for i in range(6)]
+    for i, path in enumerate(paths):
+        dump_text('TEST%d' % i, path)
+
+    # Convert input files to the same directory.
+    assert p.convert_files(paths, target='lower', output_dir=tempdir, jobs=3) == 'test0'
+    for i in range(6):
+        assert load_text(op.join(tempdir, 'test%d.low' % i)) == 'test%d' % i
+
+    # The outputs are appended in order to the same output file.
+    p.convert_files(paths, output=op.join(tempdir, 'out.low'), jobs=3)
+    assert load_text(op.join(tempdir, 'out.low')) == ''.join('test%d' % i for i in range(6))
+
+
+def test_podoc_convert_parallel_fail(tempdir, podoc_fixture):
+    p = podoc_fixture
+
+    @p.register_func(source='upper', target='title')
+    def totitle(text, context=None):
+        if 'FAIL' in text:
+            raise ValueError("Invalid text.")
+        return text.title()
+    p.register_lang('title', file_ext='.title')
+
+    paths = [op.join(tempdir, 'test%d.up' % i) for i in range(3)]
+    for path, text in zip(paths, ('HELLO', 'FAIL', 'WORLD')):
+        dump_text(text, path)
+
+    # The error refers to the input file that could not be converted.
+    with raises(RuntimeError) as e:
+        p.convert_files(paths, target='title', output_dir=tempdir, jobs=2)
+    assert 'test1.up' in str(e.value)
+    assert 'Invalid text.' in str(e.value)
+    assert load_text(op.join(tempdir, 'test0.title')) == 'Hello'
+
+
+def test_podoc_convert_parallel_notebook(tempdir):
+    p = Podoc(with_pandoc=False)
+
+    paths = [op.join(tempdir, 'test%d.md' % i) for i in range(3)]
+    for i, path in enumerate(paths):
+        dump_text('hello *world %d*' % i, path)
+
+    out_dir = op.join(tempdir, 'out')
+    nb = p.convert_files(paths, target='notebook', output_dir=out_dir, jobs=2)
+    assert nb.cells[0].source == 'hello *world 0*'
+    assert sorted(os.listdir(out_dir)) == ['test0.ipynb', 'test1.ipynb', 'test2.ipynb']
+
+
 def test_podoc_2(tempdir):
     p = Podoc(with_pandoc=False)
 
@@ -173,6 +381,108 @@ def test_podoc_pandoc(tempdir):
     assert 'test.docx' in os.listdir(tempdir)
 
 
+def test_podoc_lazy(podoc_fixture):
+    p = podoc_fixture
+    calls = []
+
+    def attach(podoc):
+        calls.append(podoc)
+        podoc.register_lang('title', file_ext='.title')
+        podoc.register_func(lambda text, context=None: text.title(),
+                            source='lower', target='title')
+
+    p.register_lazy(attach)
+    # The lazy function is not called when the languages are known.
+    assert p.convert_text('hello', source='lower', target='upper') == 'HELLO'
+    assert not calls
+    # It is called once when an unknown language is requested.
+    assert p.convert_text('hello', source='lower', target='title') == 'Hello'
+    assert p.get_file_ext('title') == '.title'
+    assert calls == [p]
+
+
+def test_podoc_convert_stream(tempdir):
+    p = Podoc(plugins=[], with_pandoc=False)
+    p.register_lang('a', file_ext='.a', load_func=load_text, dump_func=dump_text)
+    p.register_lang('b', file_ext='.b', load_func=load_text, dump_func=dump_text)
+
+    def _stream(text, f, context=None):
+        f.write(text.upper())
+        if text == 'fail':
+            raise ValueError()
+
+    p.register_func(lambda text, context=None: text.upper(), 'a', 'b',
+                    stream_func=_stream)
+    fn = op.join(tempdir, 'in.a')
+    dump_text('hello', fn)
+    out = op.join(tempdir, 'sub', 'out.b')
+
+    obj, context = p.convert_file(fn, output=out, stream=True, return_context=True)
+    assert obj is None
+    assert load_text(out) == 'HELLO'
+    assert [r.stage for r in context.stats] == ['load', 'func']
+    assert context.stats[-1].size_out == 5
+
+    # A failed conversion does not replace the output file.
+    dump_text('fail', fn)
+    with raises(ValueError):
+        p.convert_file(fn, output=out, stream=True)
+    assert load_text(out) == 'HELLO'
+    assert os.listdir(op.dirname(out)) == ['out.b']
+    dump_text('hello', fn)
+
+    # The output is not streamed with a post filter.
+    p.register_pass(RewritePass(), 'a', 'b')
+    assert p.convert_file(fn, output=out, stream=True) == 'HELLO'
+    assert load_text(out) == 'HELLO'
+
+
+def test_podoc_convert_chunks(tempdir):
+    p = Podoc(plugins=[], with_pandoc=False)
+
+    def _split(f, chunk_size):
+        yield from f
+
+    def _dump_chunks(texts, f, context=None):
+        f.write('-'.join(texts))
+
+    p.register_lang('a', file_ext='.a', split_func=_split)
+    p.register_lang('b', file_ext='.b', dump_chunks=_dump_chunks)
+
+    def _upper(text, context=None):
+        if text.strip() == 'fail':
+            raise ValueError()
+        return text.strip().upper()
+
+    p.register_func(_upper, 'a', 'b')
+    fn = op.join(tempdir, 'in.a')
+    dump_text('a\nb\nc\n', fn)
+    out = op.join(tempdir, 'out.b')
+
+    obj, context = p.convert_file(fn, output=out, chunk_size=1, return_context=True)
+    assert obj is None
+    assert load_text(out) == 'A-B-C'
+    assert [r.stage for r in context.stats] == ['load', 'func'] * 3
+
+    p.convert_text('d\ne', 'a', 'b', output=out, chunk_size=1)
+    assert load_text(out) == 'D-E'
+
+    # A failed conversion does not replace the output file.
+    with raises(ValueError):
+        p.convert_text('f\nfail\n', 'a', 'b', output=out, chunk_size=1)
+    assert load_text(out) == 'D-E'
+    assert sorted(os.listdir(tempdir)) == ['in.a', 'out.b']
+
+    # An output file is required.
+    with raises(ValueError):
+        p.convert_file(fn, 'a', 'b', chunk_size=1)
+    # The target language must support the chunks.
+    p.register_lang('c', file_ext='.c')
+    p.register_func(lambda text, context=None: text, 'a', 'c')
+    with raises(ValueError):
+        p.convert_file(fn, output=op.join(tempdir, 'out.c'), chunk_size=1)
+
+
 def test_podoc_file(tempdir):
     p = Podoc(plugins=[], with_pandoc=False)
 
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+"""Test incremental conversions."""
+
+
+#-------------------------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------------------------
+
+import json
+import logging
+import os
+import os.path as op
+
+from pytest import fixture, raises
+
+from .. import utils
+from ..core import Podoc
+from ..manifest import MANIFEST_FILENAME, _hash_resources
+from ..utils import dump_text, load_text
+
+logger = logging.getLogger(__name__)
+
+
+#-------------------------------------------------------------------------------------------------
+# Fixtures
+#-------------------------------------------------------------------------------------------------
+
+@fixture
+def counting_podoc():
+    p = Podoc(plugins=[], with_pandoc=False)
+    p.calls = []
+
+    p.register_lang('lower', file_ext='.low')
+    p.register_lang('upper', file_ext='.up')
+
+    @p.register_func(source='upper', target='lower')
+    def tolower(text, context=None):
+        p.calls.append(op.basename(context.path))
+        return text.lower()
+
+    return p
+
+
+#-------------------------------------------------------------------------------------------------
+# Tests
+#-------------------------------------------------------------------------------------------------
+
+def test_hash_resources(tempdir):
+    path = op.join(tempdir, 'test.up')
+    assert _hash_resources(path) == {}
+    os.mkdir(op.join(tempdir, 'test_files'))
+    dump_text('data', op.join(tempdir, 'test_files', 'image.png'))
+    assert list(_hash_resources(path)) == ['image.png']
+
+
+def test_incremental(tempdir, counting_podoc, monkeypatch):
+    p = counting_podoc
+
+    # The conversion does not call pandoc: the pandoc version is not needed.
+    def _get_pandoc_version():  # pragma: no cover
+        raise AssertionError("pandoc should not be probed.")
+    monkeypatch.setattr(utils, 'get_pandoc_version', _get_pandoc_version)
+    out_dir = op.join(tempdir, 'out')
+
+    paths = [op.join(tempdir, 'test%d.up' % i) for i in range(3)]
+    for i, path in enumerate(paths):
+        dump_text('TEST%d' % i, path)
+
+    def convert():
+        del p.calls[:]
+        p.convert_files(paths, target='lower', output_dir=out_dir, incremental=True)
+        return sorted(p.calls)
+
+    # First conversion.
+    assert convert() == ['test0.up', 'test1.up', 'test2.up']
+    assert load_text(op.join(out_dir, 'test1.low')) == 'test1'
+    manifest = json.loads(load_text(op.join(out_dir, MANIFEST_FILENAME)))
+    assert sorted(manifest) == ['test0.low', 'test1.low', 'test2.low']
+    assert manifest['test0.low']['lang_chain'] == ['upper', 'lower']
+    assert manifest['test0.low']['pandoc_version'] is None
+
+    # Nothing changed.
+    assert convert() == []
+
+    # Changed source.
+    dump_text('CHANGED', paths[1])
+    assert convert() == ['test1.up']
+    assert load_text(op.join(out_dir, 'test1.low')) == 'changed'
+
+    # Changed resources.
+    os.mkdir(op.join(tempdir, 'test2_files'))
+    dump_text('data', op.join(tempdir, 'test2_files', 'image.png'))
+    assert convert() == ['test2.up']
+
+    # Deleted output.
+    os.remove(op.join(out_dir, 'test0.low'))
+    assert convert() == ['test0.up']
+
+    # Without incremental mode, all files are converted.
+    del p.calls[:]
+    p.convert_files(paths, target='lower', output_dir=out_dir)
+    assert len(p.calls) == 3
+
+
+def test_incremental_fail(tempdir, counting_podoc):
+    p = counting_podoc
+    path = op.join(tempdir, 'test.up')
+    dump_text('TEST', path)
+    with raises(ValueError):
+        p.convert_files([path], target='lower', incremental=True)
+
+    # Corrupted manifest.
+    dump_text('{', op.join(tempdir, MANIFEST_FILENAME))
+    p.convert_files([path], target='lower', output_dir=tempdir, incremental=True)
+    assert p.calls == ['test.up']
+
+
+def test_incremental_pandoc(tempdir):
+    p = Podoc(plugins=[], with_pandoc=False)
+    p.register_lang('lower', file_ext='.low')
+    p.register_lang('upper', file_ext='.up')
+    p.register_func(lambda text, context=None: text.lower(), 'upper', 'lower', pandoc=True)
+    path = op.join(tempdir, 'test.up')
+    dump_text('TEST', path)
+    out_dir = op.join(tempdir, 'out')
+    p.convert_files([path], target='lower', output_dir=out_dir, incremental=True)
+    manifest = json.loads(load_text(op.join(out_dir, MANIFEST_FILENAME)))
+    assert manifest['test.low']['pandoc_version'] == utils.get_pandoc_version()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""Test profiling."""
+
+
+#-------------------------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------------------------
+
+import logging
+import os.path as op
+import pstats
+
+from ..profiling import get_profiler, profile
+from ..tree import Node, TreeTransformer
+
+logger = logging.getLogger(__name__)
+
+
+#-------------------------------------------------------------------------------------------------
+# Tests
+#-------------------------------------------------------------------------------------------------
+
+class _Transformer(TreeTransformer):
+    def transform_Node(self, node):
+        return ''.join(self.transform_children(node))
+
+    def transform_str(self, text):
+        return text.upper()
+
+
+class _GeneratorTransformer(_Transformer):
+    def transform_Node(self, node):
+        children = yield node
+        return ''.join(children)
+
+
+def test_profile_generator():
+    tree = Node('A', children=[Node('B', children=['b']), 'a'])
+    with profile() as profiler:
+        assert _GeneratorTransformer().transform(tree) == 'BA'
+    node_stats = profiler.stats()[('_GeneratorTransformer', 'transform_Node')]
+    assert node_stats.calls == 2
+    assert node_stats.selftime <= node_stats.cumtime
+
+
+def test_profile(tempdir):
+    tree = Node('A', children=[Node('B', children=['b']), 'a'])
+    assert get_profiler() is None
+
+    path = op.join(tempdir, 'profile.pstats')
+    with profile(path) as profiler:
+        assert get_profiler() is profiler
+        assert _Transformer().transform(tree) == 'BA'
+    assert get_profiler() is None
+
+    stats = profiler.stats()
+    node_stats = stats[('_Transformer', 'transform_Node')]
+    str_stats = stats[('_Transformer', 'transform_str')]
+    assert (node_stats.calls, str_stats.calls) == (2, 2)
+    # The cumulative time of the recursive calls is only counted once.
+    assert node_stats.selftime <= node_stats.cumtime
+    assert node_stats.selftime + str_stats.selftime <= node_stats.cumtime * 1.01 + 1e-6
+    assert 'transform_str' in profiler.report()
+
+    # cProfile statistics.
+    assert pstats.Stats(path).total_calls > 0
+
+    # Nothing is recorded when profiling is disabled.
+    _Transformer().transform(tree)
+    assert profiler.stats()[('_Transformer', 'transform_str')].calls == 2
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""Scaling tests: check that the transformations are linear in the size of the documents."""
+
+
+#-------------------------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------------------------
+
+import logging
+
+from pytest import fixture
+
+from ..ast import ASTNode, ast_from_pandoc
+from ..benchmark import generate_ast, generate_notebook, measure_scaling
+from ..core import Podoc
+from ..markdown._markdown import MarkdownWriter
+from ..notebook._notebook import NotebookReader, NotebookWriter
+from ..tree import Node, show_tree
+from ..utils import _merge_str
+
+logger = logging.getLogger(__name__)
+
+
+#-------------------------------------------------------------------------------------------------
+# Fixtures
+#-------------------------------------------------------------------------------------------------
+
+# Number of cells of the smallest synthetic documents. The documents have N, 2N, 4N cells.
+N_CELLS = 4
+
+# Maximum growth exponent of a linear transformation, with some margin for timing noise.
+MAX_EXPONENT = 1.5
+
+
+@fixture(scope='module')
+def podoc():
+    return Podoc(with_pandoc=False)
+
+
+@fixture(scope='module')
+def asts(podoc):
+    return {n: generate_ast(podoc=podoc, n_cells=n, list_depth=3)
+            for n in (N_CELLS, 2 * N_CELLS, 4 * N_CELLS)}
+
+
+def _check_linear(func, make_input, n=N_CELLS):
+    exponent, times = measure_scaling(func, make_input, n)
+    logger.debug("Growth exponent: %.2f.", exponent)
+    assert exponent < MAX_EXPONENT
+
+
+#-------------------------------------------------------------------------------------------------
+# Tests
+#-------------------------------------------------------------------------------------------------
+
+def test_scaling_merge_str():
+    _check_linear(_merge_str, lambda n: ['ab'] * n + [None] + ['cd'] * n, n=10000)
+
+
+def test_scaling_show_tree(asts):
+    _check_linear(show_tree, asts.get)
+
+
+def test_scaling_show_tree_deep():
+    def chain(n):
+        root = node = Node('root')
+        for i in range(n):
+            child = Node('node')
+            node.add_child(child)
+            node.add_child('text')
+            node = child
+        return root
+    # NOTE: the size of the representation of a chain is quadratic in its depth.
+    exponent, _ = measure_scaling(show_tree, chain, 50)
+    assert exponent < 2 + MAX_EXPONENT - 1
+
+
+def test_scaling_markdown_writer(asts):
+    _check_linear(MarkdownWriter().write, asts.get)
+
+
+def test_scaling_markdown_list():
+    def make_list(n):
+        return ASTNode('BulletList', bullet_char='*', delimiter=' ',
+                       children=[ASTNode('ListItem', children=[
+                                 ASTNode('Plain', children=['item %d' % i])])
+                                 for i in range(n)])
+    _check_linear(MarkdownWriter().write, make_list, n=500)
+
+
+def test_scaling_markdown_deep():
+    def make_quotes(n):
+        ast = node = ASTNode('root')
+        for _ in range(n):
+            node = node.add_child(ASTNode('BlockQuote'))
+        node.add_child(ASTNode('Para', children=['a\nb']))
+        return ast
+    _check_linear(MarkdownWriter().write, make_quotes, n=1000)
+
+
+def test_scaling_podoc_to_pandoc(asts):
+    _check_linear(lambda ast: ast.to_pandoc(), asts.get)
+
+
+def test_scaling_pandoc_to_podoc(podoc, asts):
+    dicts = {n: ast.to_pandoc() for n, ast in asts.items()}
+    _check_linear(ast_from_pandoc, dicts.get)
+
+
+def test_scaling_notebook_reader():
+    # NOTE: the reader calls pandoc on every Markdown cell.
+    _check_linear(NotebookReader().read, lambda n: generate_notebook(n_cells=n), n=2)
+
+
+def test_scaling_notebook_writer(asts):
+    _check_linear(NotebookWriter().write, asts.get)
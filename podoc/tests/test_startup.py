@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""Startup benchmark: check that heavy dependencies are only imported when needed."""
+
+
+#-------------------------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------------------------
+
+import json
+import logging
+import subprocess
+import sys
+from textwrap import dedent
+
+logger = logging.getLogger(__name__)
+
+
+#-------------------------------------------------------------------------------------------------
+# Utils
+#-------------------------------------------------------------------------------------------------
+
+# Modules that should not be imported when starting podoc.
+HEAVY_MODULES = ('pytest', 'nbformat', 'IPython', 'notebook', 'pypandoc')
+
+# Generous upper bound for the startup time, in seconds.
+MAX_STARTUP_TIME = 2.
+
+
+def _run_startup(code):
+    """Run some code in a new Python process, and return the elapsed time and the list
+    of heavy modules imported."""
+    script = dedent('''
+    import json
+    import sys
+    from time import perf_counter
+    t0 = perf_counter()
+    {}
+    elapsed = perf_counter() - t0
+    heavy = sorted(m for m in {!r} if m in sys.modules)
+    print(json.dumps({{'elapsed': elapsed, 'heavy': heavy}}))
+    ''').format(dedent(code).strip(), HEAVY_MODULES)
+    out = subprocess.check_output([sys.executable, '-c', script])
+    d = json.loads(out.decode('utf8').strip().splitlines()[-1])
+    logger.debug("Startup time: %.3fs.", d['elapsed'])
+    return d['elapsed'], d['heavy']
+
+
+#-------------------------------------------------------------------------------------------------
+# Tests
+#-------------------------------------------------------------------------------------------------
+
+def test_startup_import():
+    elapsed, heavy = _run_startup('import podoc')
+    assert heavy == []
+    assert elapsed < MAX_STARTUP_TIME
+
+
+def test_startup_version():
+    elapsed, heavy = _run_startup('''
+        from podoc.cli import podoc
+        try:
+            podoc(['--version'])
+        except SystemExit:
+            pass
+        ''')
+    assert heavy == []
+    assert elapsed < MAX_STARTUP_TIME
+
+
+def test_startup_markdown_to_ast():
+    elapsed, heavy = _run_startup('''
+        from podoc import Podoc, utils
+        ast = Podoc().convert_text('hello *world*', source='markdown', target='ast')
+        assert ast.children
+        # The pandoc languages are not needed for this conversion.
+        assert utils._PANDOC_INFO is None
+        ''')
+    assert heavy == ['pypandoc']
+    assert elapsed < MAX_STARTUP_TIME
+
+
+def test_startup_lazy_attrs():
+    elapsed, heavy = _run_startup('''
+        import podoc
+        from podoc import notebook
+        assert podoc.__version_git__.startswith(podoc.__version__)
+        assert notebook.PodocContentsManager.__name__ == 'PodocContentsManager'
+        ''')
+    assert 'notebook' in heavy
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+"""Test tracing."""
+
+
+#-------------------------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------------------------
+
+import json
+import logging
+import os
+import os.path as op
+
+from ..core import Podoc
+from ..tracing import Tracer, get_tracer, set_tracer, span
+from ..utils import dump_text, load_text
+
+logger = logging.getLogger(__name__)
+
+
+#-------------------------------------------------------------------------------------------------
+# Tests
+#-------------------------------------------------------------------------------------------------
+
+def test_tracer(tempdir):
+    # No active tracer.
+    assert get_tracer() is None
+    with span('nothing'):
+        pass
+
+    tracer = Tracer()
+    assert set_tracer(tracer) is None
+    try:
+        with span('outer', a=1):
+            with span('inner'):
+                pass
+    finally:
+        assert set_tracer(None) is tracer
+
+    inner, outer = tracer.events
+    assert (inner['name'], outer['name']) == ('inner', 'outer')
+    assert outer['ph'] == 'X'
+    assert outer['args'] == {'a': 1}
+    assert outer['ts'] <= inner['ts']
+    assert inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+
+    path = op.join(tempdir, 'trace.json')
+    tracer.save(path)
+    assert len(json.loads(load_text(path))['traceEvents']) == 2
+
+
+def test_podoc_trace(tempdir):
+    path = op.join(tempdir, 'trace.json')
+    p = Podoc(with_pandoc=False, trace=path)
+    p.convert_text('hello *world*', source='markdown', target='notebook')
+    assert get_tracer() is None
+
+    names = [e['name'] for e in json.loads(load_text(path))['traceEvents']]
+    assert 'convert text' in names
+    assert 'func markdown => ast' in names
+    assert 'func ast => notebook' in names
+    assert 'MarkdownWriter' in names
+
+
+def test_podoc_trace_parallel(tempdir):
+    path = op.join(tempdir, 'trace.json')
+    p = Podoc(with_pandoc=False, trace=path)
+    paths = [op.join(tempdir, 'test%d.md' % i) for i in range(3)]
+    for i, md_path in enumerate(paths):
+        dump_text('hello %d' % i, md_path)
+    p.convert_files(paths, target='ast', output_dir=op.join(tempdir, 'out'), jobs=2)
+
+    events = json.loads(load_text(path))['traceEvents']
+    names = [e['name'] for e in events]
+    for i in range(3):
+        assert 'convert test%d.md' % i in names
+    # The events were recorded in the worker processes.
+    assert os.getpid() not in set(e['pid'] for e in events)
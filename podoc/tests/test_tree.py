@@ -7,12 +7,15 @@
 # Imports
 #-------------------------------------------------------------------------------------------------
 
+import gc
+import pickle
 from textwrap import dedent
 
 from pytest import fixture
 
 from ..utils import captured_output
-from ..tree import Node, TreeTransformer, show_tree, filter_tree
+from ..tree import (Node, TreeTransformer, RewritePass, show_tree, filter_tree,
+                    run_passes)
 
 
 #-------------------------------------------------------------------------------------------------
@@ -41,6 +44,116 @@ def test_copy(root):
     assert root_2 != root
 
 
+def test_node_attributes(root):
+    assert not hasattr(root, '__dict__')
+    assert root.hello == 'world'
+    assert root['hello'] == 'world'
+    assert root.get('hello') == 'world'
+    assert root.get('unknown', 0) == 0
+    assert not hasattr(root, 'unknown')
+    assert 'hello' in root
+    assert 'unknown' not in root
+    assert 'copy' not in root
+    assert list(root) == ['name', 'children', 'hello']
+
+    root['a'] = 1
+    assert root.a == 1
+    assert root.pop('a') == 1
+    assert 'a' not in root
+    assert root.pop('a', None) is None
+
+    # The visit metadata is not an attribute.
+    root._visit_meta['is_block'] = True
+    assert '_visit_meta' not in root
+    assert root == Node('root', hello='world', children=root.children)
+    assert root != Node('root', children=root.children)
+
+
+def test_node_pickle(root):
+    root.children[0]._visit_meta['is_block'] = True
+    root_2 = pickle.loads(pickle.dumps(root))
+    assert root_2 == root
+    assert root_2.hello == 'world'
+    assert root_2.children[0]._visit_meta == {}
+
+
+def test_node_equal_deep():
+    def chain(n, leaf):
+        root = node = Node('root')
+        for i in range(n):
+            node = node.add_child(Node('node'))
+        node.add_child(leaf)
+        return root
+    assert chain(5000, 'a') == chain(5000, 'a')
+    assert chain(5000, 'a') != chain(5000, 'b')
+
+
+def test_tree_hash(root):
+    h = root.tree_hash()
+    assert len(h) == 32
+    assert root.tree_hash() == h
+
+    # Equal trees have the same hash, copies keep the hash.
+    root_2 = root.copy()
+    assert root_2.tree_hash() == h
+    assert root_2 == root
+    children = [c.copy() if isinstance(c, Node) else c for c in root.children]
+    root_3 = Node('root', hello='world', children=children)
+    assert root_3.tree_hash() == h
+
+    # Modifications invalidate the hashes.
+    root_2.children[0].children[0].add_child('new')
+    assert root_2.tree_hash() != h
+    assert root_2 != root
+    root_3.hello = 'new'
+    assert root_3.tree_hash() != h
+    assert root.tree_hash() == h
+
+    # Strings and nodes are distinguished.
+    assert Node('a', children=['b']).tree_hash() != Node('a', children=[Node('b')]).tree_hash()
+
+    # Equal trees with attributes of different types.
+    a = Node('a', children=[Node('b', start=1)])
+    b = Node('a', children=[Node('b', start=1.0)])
+    assert a.tree_hash() != b.tree_hash()
+    assert a == b
+    b.children[0].start = 2.
+    assert a != b
+
+
+def test_index(root):
+    assert [node.name for node in root.find_all('1.1')] == ['1.1']
+    index = root.index()
+    assert root.index() is index
+    assert index.find('2') == []
+
+    # Modified tree.
+    root.children[0].children[0].add_child(Node('1.1'))
+    assert not index.valid
+    assert len(root.find_all('1.1')) == 2
+    assert root.index() is not index
+
+    # The index is not copied.
+    assert root.copy().index() is not root.index()
+
+    # The root is not indexed, but found.
+    assert root.index().find('root') == []
+    assert root.find_all('root') == [root]
+
+
+def test_index_no_cycle():
+    gc.collect()
+    gc.disable()
+    try:
+        root = Node('root', children=[Node('a', children=['b'])])
+        root.build_index()
+        del root
+        # The indexed tree is freed by reference counting.
+        assert gc.collect() == 0
+    finally:
+        gc.enable()
+
+
 def test_show_tree_1():
     root = Node('root')
     root.add_child(Node('1'))
@@ -123,6 +236,80 @@ def test_transform_3(root):
     assert t.transform(root).children[0].name == root.children[0].name + ' visited'
 
 
+def test_transform_dispatch(root):
+
+    class MyTreeTransformer(TreeTransformer):
+        def transform_Node(self, node):
+            return node.name
+
+    class MySubTransformer(MyTreeTransformer):
+        def transform_Node(self, node):
+            return 'sub ' + node.name
+
+    node = Node('A')
+    assert MyTreeTransformer().transform(node) == 'A'
+    assert MySubTransformer().transform(node) == 'sub A'
+    assert MyTreeTransformer().transform(node) == 'A'
+    assert MyTreeTransformer._dispatch_table is not MySubTransformer._dispatch_table
+    assert MySubTransformer().get_transform_func(node)(node) == 'sub A'
+
+
+def test_transform_generator(root):
+
+    class MyTreeTransformer(TreeTransformer):
+        def transform_Node(self, node):
+            children = yield node
+            return '%s(%s)' % (node.name, ','.join(children))
+
+    assert MyTreeTransformer().transform(root) == 'root(1(1.1(1.1.1,1.1.2),1.2),2)'
+
+
+def test_transform_siblings(root):
+
+    class MyTreeTransformer(TreeTransformer):
+        def transform_str(self, text):
+            return text
+
+        def transform_Node(self, node):
+            siblings = (getattr(self.prev_sibling, 'name', self.prev_sibling),
+                        getattr(self.next_sibling, 'name', self.next_sibling))
+            children = yield node
+            # The siblings are the same after the transformation of the children.
+            assert siblings == (getattr(self.prev_sibling, 'name', self.prev_sibling),
+                                getattr(self.next_sibling, 'name', self.next_sibling))
+            return [(node.name,) + siblings] + [c for c in children if isinstance(c, tuple)]
+
+    class MyRecursiveTransformer(MyTreeTransformer):
+        def transform_Node(self, node):
+            siblings = (getattr(self.prev_sibling, 'name', self.prev_sibling),
+                        getattr(self.next_sibling, 'name', self.next_sibling))
+            children = self.transform_children(node)
+            return [(node.name,) + siblings] + [c for c in children if isinstance(c, tuple)]
+
+    expected = [('root', None, None), ('1', None, '2'), ('1.1', None, '1.2')]
+    assert MyTreeTransformer().transform(root) == expected
+    assert MyRecursiveTransformer().transform(root) == expected
+    # No links are stored in the tree.
+    assert root.children[0]._meta is None
+
+
+def test_transform_deep():
+
+    class MyTreeTransformer(TreeTransformer):
+        def transform_Node(self, node):
+            children = yield node
+            return len(children) + sum(children)
+
+        def transform_str(self, text):
+            return 0
+
+    root = node = Node('root')
+    for i in range(10000):
+        node = node.add_child(Node('node'))
+    node.add_child('leaf')
+    assert MyTreeTransformer().transform(root) == 10001
+
+
 def test_filter(root):
     assert root == root
     assert filter_tree(root, lambda node: node) == root
@@ -140,3 +327,132 @@ def test_filter(root):
     root_without_ones = root.copy()
     root_without_ones.children.pop(0)
     assert filter_tree(root, remove_ones) == root_without_ones
+
+
+def test_filter_sharing(root):
+    assert filter_tree(root, lambda node: node) is root
+
+    def rename(node):
+        if node.name == '1.1':
+            node.name = 'renamed'
+        return node
+    root_renamed = filter_tree(root, rename)
+    assert root_renamed is not root
+    assert root_renamed.children[0].children[0].name == 'renamed'
+    # The untouched subtrees are shared, and the input is not modified.
+    assert root_renamed.children[1] is root.children[1]
+    assert root.children[0].children[0].name == '1.1'
+
+
+def test_replace(root):
+    assert root.replace() is root
+    assert root.replace(hello='world', children=list(root.children)) is root
+
+    node = root.replace(hello='you')
+    assert node.hello == 'you'
+    assert root.hello == 'world'
+    assert node.children is root.children
+
+    node = root.replace(children=root.children[1:])
+    assert len(node.children) == 1
+    assert len(root.children) == 2
+
+    node = root.shallow_copy()
+    assert node == root
+    assert node.children is not root.children
+    assert node.children[0] is root.children[0]
+
+
+def test_run_passes(root):
+    calls = []
+
+    class Rename(RewritePass):
+        inspects = ()
+
+        def rewrite_1(self, node):
+            calls.append(node.name)
+            return node.replace(name='one')
+
+    class Mark(RewritePass):
+        inspects = ()
+
+        def rewrite_one(self, node):
+            return node.replace(marked=True)
+
+        def rewrite_root(self, node):
+            calls.append(node.name)
+            return node
+
+    # Identity passes.
+    assert run_passes(root, []) is root
+    assert run_passes(root, [RewritePass()]) is root
+
+    # Fused passes.
+    out = run_passes(root, [Rename(), RewritePass(), Mark()])
+    assert calls == ['1', 'root']
+    assert out.children[0].name == 'one'
+    assert out.children[0].marked
+    assert out.children[0].children[0] is root.children[0].children[0]
+    assert root.children[0].name == '1'
+
+    # Nodes added in place, after the index was built, are rewritten.
+    tree = Node('root')
+    tree.build_index()
+    tree.children.append(Node('1'))
+    assert run_passes(tree, [Rename()]).children[0].name == 'one'
+
+    # No rewritten node.
+    del calls[:]
+    assert run_passes(out, [Rename(), Mark()]) is out
+    assert calls == ['root']
+    assert run_passes(out, [Rename()]) is out
+
+
+def test_run_passes_dependent():
+    calls = []
+
+    class WithEmph(RewritePass):
+        def rewrite_Para(self, node):
+            calls.append('WithEmph')
+            if any(child.name == 'Emph' for child in node.children):
+                node = node.replace(name='ParaWithEmph')
+            return node
+
+    class Strong(RewritePass):
+        def rewrite_Emph(self, node):
+            calls.append('Strong')
+            return node.replace(name='Strong')
+
+    def make_tree():
+        return Node('root', children=[Node('Para', children=[Node('Emph')]),
+                                      Node('Para', children=[Node('Emph')])])
+
+    def names(tree):
+        return [(node.name, node.children[0].name) for node in tree.children]
+
+    # The first pass depends on the names rewritten by the second one: the passes are
+    # not fused.
+    sequential = run_passes(run_passes(make_tree(), [WithEmph()]), [Strong()])
+    del calls[:]
+    out = run_passes(make_tree(), [WithEmph(), Strong()])
+    assert names(out) == names(sequential) == [('ParaWithEmph', 'Strong')] * 2
+    assert calls == ['WithEmph'] * 2 + ['Strong'] * 2
+
+    # A pass declaring the nodes it inspects is fused with the later passes that do not
+    # rewrite them.
+    class InspectsEmph(WithEmph):
+        inspects = ('Emph',)
+
+    class NoInspect(Strong):
+        inspects = ()
+
+    del calls[:]
+    out = run_passes(make_tree(), [InspectsEmph(), NoInspect()])
+    assert names(out) == names(sequential)
+    assert calls == ['WithEmph'] * 2 + ['Strong'] * 2
+
+    sequential = run_passes(run_passes(make_tree(), [Strong()]), [WithEmph()])
+    del calls[:]
+    out = run_passes(make_tree(), [NoInspect(), InspectsEmph()])
+    assert names(out) == names(sequential) == [('Para', 'Strong')] * 2
+    assert calls == ['Strong', 'WithEmph'] * 2
@@ -9,15 +9,21 @@
 
 import json
 import logging
+import os
 import os.path as op
+import pickle
 
-from pytest import mark
+from pytest import mark, warns
 
+from .. import utils
 from ..utils import (Bunch, Path, load_text, dump_text, _get_file, _merge_str, _shorten_string,
                      _get_resources_path, _save_resources, _load_resources,
                      get_test_file_path, _create_dir_if_not_exists,
-                     pandoc, has_pandoc, get_pandoc_formats,
+                     pandoc, has_pandoc, get_pandoc_formats, get_pandoc_info,
+                     get_pandoc_version, get_pandoc_api_version,
+                     get_pandoc_cache, set_pandoc_cache, get_pandoc_call_count,
                      )
+from ..cache import ConversionCache
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +43,12 @@ def test_bunch():
     assert obj['b'] == 2
     assert obj.copy().a == 1
 
+    # The attributes and the items are still the same after pickling.
+    obj = pickle.loads(pickle.dumps(obj))
+    assert obj == {'a': 1, 'b': 2}
+    obj.c = 3
+    assert obj['c'] == 3
+
 
 def test_path():
     print(Path(__file__))
@@ -106,6 +118,77 @@ def test_pandoc():
     out = pandoc('hello *world*', 'json', format='markdown')
     assert isinstance(json.loads(out), dict)
 
+    n = get_pandoc_call_count()
+    pandoc('count *pandoc* calls', 'json', format='markdown')
+    pandoc('count *pandoc* calls', 'json', format='markdown')
+    assert get_pandoc_call_count() == n + 1
+
     sl, tl = get_pandoc_formats()
     assert 'markdown' in sl
     assert 'markdown' in tl
+
+
+def test_pandoc_cache(tempdir, monkeypatch):
+    calls = []
+    _run_pandoc = utils._run_pandoc
+
+    def _run_pandoc_count(*args, **kwargs):
+        calls.append(args)
+        return _run_pandoc(*args, **kwargs)
+    monkeypatch.setattr(utils, '_run_pandoc', _run_pandoc_count)
+
+    monkeypatch.setattr(utils, '_PANDOC_CACHE', None)
+    assert isinstance(get_pandoc_cache(), ConversionCache)
+
+    # In-memory cache.
+    out = pandoc('hello *world*', 'json', format='markdown')
+    assert pandoc('hello *world*', 'json', format='markdown') == out
+    assert len(calls) == 1
+    pandoc('hello *world*', 'json', format='rst')
+    assert len(calls) == 2
+    assert (get_pandoc_cache().hits, get_pandoc_cache().misses) == (1, 2)
+
+    # On-disk cache.
+    set_pandoc_cache(ConversionCache(path=tempdir))
+    assert pandoc('hello *world*', 'json', format='markdown') == out
+    set_pandoc_cache(ConversionCache(path=tempdir))
+    assert pandoc('hello *world*', 'json', format='markdown') == out
+    assert len(calls) == 3
+
+    # No cache.
+    set_pandoc_cache(None)
+    assert get_pandoc_cache() is None
+    assert pandoc('hello *world*', 'json', format='markdown') == out
+    assert len(calls) == 4
+
+
+def test_pandoc_info_cache(tempdir, monkeypatch):
+    monkeypatch.setenv('PODOC_CACHE_DIR', tempdir)
+    monkeypatch.setattr(utils, '_PANDOC_INFO', None)
+    info = get_pandoc_info()
+    assert info['version'] == get_pandoc_version()
+    assert info['api_version'] == get_pandoc_api_version()
+    assert op.exists(op.join(tempdir, 'pandoc.json'))
+
+    # The capabilities are now loaded from the disk cache, without launching pandoc.
+    def _probe_pandoc():  # pragma: no cover
+        raise AssertionError("pandoc should not be launched.")
+    monkeypatch.setattr(utils, '_PANDOC_INFO', None)
+    monkeypatch.setattr(utils, '_probe_pandoc', _probe_pandoc)
+    assert get_pandoc_info() == info
+
+    # A truncated cache file is a cache miss, and it is rewritten.
+    monkeypatch.undo()
+    monkeypatch.setenv('PODOC_CACHE_DIR', tempdir)
+    for contents in ('{"key": ', '[]'):
+        dump_text(contents, op.join(tempdir, 'pandoc.json'))
+        monkeypatch.setattr(utils, '_PANDOC_INFO', None)
+        assert get_pandoc_info() == info
+        with open(op.join(tempdir, 'pandoc.json')) as f:
+            assert json.load(f) == info
+    assert os.listdir(tempdir) == ['pandoc.json']
+
+
+def test_pandoc_api_version_deprecated():
+    with warns(DeprecationWarning):
+        assert utils.PANDOC_API_VERSION == get_pandoc_api_version()
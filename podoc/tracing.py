@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+"""Tracing of conversions in the Chrome trace-event format.
+
+The trace files can be loaded in `chrome://tracing` or https://ui.perfetto.dev.
+
+"""
+
+
+#-------------------------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------------------------
+
+from contextlib import contextmanager
+import json
+import logging
+import os
+import threading
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+
+#-------------------------------------------------------------------------------------------------
+# Tracer
+#-------------------------------------------------------------------------------------------------
+
+class Tracer(object):
+    """Record nested spans as Chrome complete ('X') events.
+
+    The timestamps are taken from the monotonic `perf_counter()` clock, so that the
+    events recorded by several processes of a conversion can be merged.
+
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.events = []
+
+    def add(self, name, start, end, cat='podoc', **args):
+        """Add a span between two `perf_counter()` times."""
+        self.events.append({'name': name,
+                            'cat': cat,
+                            'ph': 'X',
+                            'ts': start * 1e6,
+                            'dur': (end - start) * 1e6,
+                            'pid': os.getpid(),
+                            'tid': threading.get_ident(),
+                            'args': args,
+                            })
+
+    @contextmanager
+    def span(self, name, cat='podoc', **args):
+        """Record the code executed in a `with` block as a span."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, perf_counter(), cat=cat, **args)
+
+    def save(self, path=None):
+        """Save the trace in a JSON file."""
+        path = path or self.path
+        assert path
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+        logger.debug("Saved %d trace events to `%s`.", len(self.events), path)
+
+
+#-------------------------------------------------------------------------------------------------
+# Active tracer
+#-------------------------------------------------------------------------------------------------
+
+# Tracer recording the spans, None when tracing is disabled.
+_TRACER = None
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def get_tracer():
+    """Return the active tracer, or None."""
+    return _TRACER
+
+
+def set_tracer(tracer):
+    """Set the active tracer, or disable tracing with None. Return the previous one."""
+    global _TRACER
+    previous, _TRACER = _TRACER, tracer
+    return previous
+
+
+def span(name, cat='podoc', **args):
+    """Return a context manager recording a span in the active tracer.
+
+    This does nothing when tracing is disabled.
+
+    """
+    if _TRACER is None:
+        return _NULL_SPAN
+    return _TRACER.span(name, cat=cat, **args)
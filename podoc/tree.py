@@ -7,10 +7,16 @@
 # Imports
 #-------------------------------------------------------------------------------------------------
 
-from itertools import zip_longest
+from hashlib import blake2b
+from inspect import CO_GENERATOR
+import json
 import logging
+from operator import attrgetter
+from time import perf_counter
+from types import MethodType
 
-from .utils import Bunch, _shorten_string
+from .profiling import get_profiler
+from .utils import _shorten_string
 
 logger = logging.getLogger(__name__)
 
@@ -19,14 +25,55 @@ logger = logging.getLogger(__name__)
 # Tree transformer
 #-------------------------------------------------------------------------------------------------
 
+def _is_generator_function(func):
+    code = getattr(func, '__code__', None)
+    return code is not None and bool(code.co_flags & CO_GENERATOR)
+
+
+def _add_transformed(out, transformed):
+    if isinstance(transformed, list):
+        out.extend(transformed)
+    else:
+        out.append(transformed)
+
+
 class TreeTransformer(object):
     """Transform any kind of tree.
 
     By default, this object acts on Node instances. However, derived
     classes can act on other types of trees, for example nested dictionaries.
 
+    A `transform_<Name>(node)` method can either call `self.transform_children(node)`,
+    or be a generator that yields the node and receives the list of the transformed
+    children:
+
+        def transform_Para(self, node):
+            children = yield node
+            return ''.join(children)
+
+    The generator methods are run with an explicit stack rather than recursively, so
+    that the depth of the trees is not limited by the recursion limit.
+
+    In a transform method, `self.prev_sibling` and `self.next_sibling` are the siblings
+    of the node being transformed.
+
+    The transform methods are looked up once per class and node name, so methods added
+    to a class after its first transformation are not taken into account.
+
     """
 
+    # Dispatch table of the class, mapping `node name => (function, is generator)`. Every
+    # subclass has its own table, filled on first use.
+    _dispatch_table = {}
+
+    # Siblings of the node being transformed, and its index.
+    _visit_siblings = ()
+    _visit_index = 0
+
+    def __init_subclass__(cls, **kwargs):
+        super(TreeTransformer, cls).__init_subclass__(**kwargs)
+        cls._dispatch_table = {}
+
     # To override
     # --------------------------------------------------------------------------------------------
 
@@ -46,12 +93,20 @@ class TreeTransformer(object):
         """
         return node.children
 
-    def set_next_child(self, child, next_child):
-        """To be overriden. Set the next and previous children."""
-        if child is not None and not isinstance(child, str):
-            child._visit_meta['nxt'] = next_child
-        if next_child is not None and not isinstance(next_child, str):
-            next_child._visit_meta['prv'] = child
+    # Siblings
+    # --------------------------------------------------------------------------------------------
+
+    @property
+    def prev_sibling(self):
+        """Previous sibling of the node being transformed, or None."""
+        i = self._visit_index
+        return self._visit_siblings[i - 1] if i > 0 else None
+
+    @property
+    def next_sibling(self):
+        """Next sibling of the node being transformed, or None."""
+        siblings, i = self._visit_siblings, self._visit_index
+        return siblings[i + 1] if i + 1 < len(siblings) else None
 
     # Transformation methods
     # --------------------------------------------------------------------------------------------
@@ -59,14 +114,11 @@ class TreeTransformer(object):
     def transform_children(self, node):
         out = []
         children = self.get_node_children(node)
-        for child, next_child in zip_longest(children, children[1:]):
-            # Double-linked list for children.
-            self.set_next_child(child, next_child)
-            transformed_children = self.transform(child)
-            if isinstance(transformed_children, list):
-                out.extend(transformed_children)
-            else:
-                out.append(transformed_children)
+        siblings, index = self._visit_siblings, self._visit_index
+        for i, child in enumerate(children):
+            self._visit_siblings, self._visit_index = children, i
+            _add_transformed(out, self.transform(child))
+        self._visit_siblings, self._visit_index = siblings, index
         # Remove None children.
         return [_ for _ in out if _ is not None]
 
@@ -76,42 +128,302 @@ class TreeTransformer(object):
     def transform_Node(self, node):
         return node  # pragma: no cover
 
-    def get_transform_func(self, node):
+    def _get_transform_func(self, node):
+        """Return the transform function of a node, to be called with `(self, node)`, and
+        whether it is a generator function."""
         assert node is not None
         name = ('str' if isinstance(node, str)
                 else self.get_node_name(node))
-        return getattr(self, 'transform_' + name, self.transform_Node)
+        entry = self._dispatch_table.get(name, None)
+        if entry is None:
+            cls = self.__class__
+            func = getattr(cls, 'transform_' + name, cls.transform_Node)
+            entry = self._dispatch_table[name] = (func, _is_generator_function(func))
+        profiler = get_profiler()
+        if profiler is not None:
+            return profiler.wrap(self, entry[0]), entry[1]
+        return entry
+
+    def get_transform_func(self, node):
+        """Return the bound transform method of a node."""
+        return MethodType(self._get_transform_func(node)[0], self)
 
     def transform(self, node):
         """Transform a node and the tree below it."""
-        return self.get_transform_func(node)(node)
+        func, is_generator = self._get_transform_func(node)
+        if not is_generator:
+            return func(self, node)
+        get_transform_func = self._get_transform_func
+        # NOTE: the strings are the leaves, they are transformed without a generator.
+        transform_str = self.get_transform_func('')
+        # Siblings of the root node.
+        siblings, index = self._visit_siblings, self._visit_index
+        # Stack of frames `[generator, children, index of the next child, transformed
+        # children]`, for the generators waiting for the transformed children of a node.
+        stack = []
+        gen, value = func(self, node), None
+        while True:
+            try:
+                parent = gen.send(value)
+            except StopIteration as e:
+                if not stack:
+                    return e.value
+                transformed, out = e.value, stack[-1][3]
+                if isinstance(transformed, list):
+                    out.extend(transformed)
+                else:
+                    out.append(transformed)
+            else:
+                stack.append([gen, self.get_node_children(parent), 0, []])
+            # Transform the next children of the node at the top of the stack, until a
+            # generator needs to be run.
+            frame = stack[-1]
+            owner, children, i, out = frame
+            n = len(children)
+            self._visit_siblings = children
+            while i < n:
+                child = children[i]
+                self._visit_index = i
+                i += 1
+                if isinstance(child, str):
+                    transformed = transform_str(child)
+                else:
+                    func, is_generator = get_transform_func(child)
+                    if is_generator:
+                        frame[2] = i
+                        gen, value = func(self, child), None
+                        break
+                    transformed = func(self, child)
+                if isinstance(transformed, list):
+                    out.extend(transformed)
+                else:
+                    out.append(transformed)
+            else:
+                # Send the transformed children to the generator that requested them,
+                # with the siblings of its node.
+                stack.pop()
+                if stack:
+                    self._visit_siblings, self._visit_index = stack[-1][1], stack[-1][2] - 1
+                else:
+                    self._visit_siblings, self._visit_index = siblings, index
+                gen, value = owner, [_ for _ in out if _ is not None]
 
 
 #-------------------------------------------------------------------------------------------------
 # Node
 #-------------------------------------------------------------------------------------------------
 
-def _remove_visit_meta(node):
-    if '_visit_meta' in node:
-        node._visit_meta = {}
-    return node
+def _get_fields(cls):
+    """Return the names of the slot attributes of a Node class, their set, and a getter
+    returning their values."""
+    fields = _FIELDS.get(cls, None)
+    if fields is None:
+        names = tuple(name for c in reversed(cls.__mro__)
+                      for name in c.__dict__.get('__slots__', ())
+                      if not name.startswith('_'))
+        fields = _FIELDS[cls] = (names, frozenset(names), attrgetter(*names))
+    return fields
+
+
+_FIELDS = {}  # mapping `class => (names, set of names, getter)`
+_MISSING = object()
+_setattr = object.__setattr__
 
+# Incremented when a tracked node is modified, to invalidate all cached tree hashes and
+# all indexes.
+_EPOCH = 0
+
+
+class NodeIndex(object):
+    """Index of the descendant nodes of a tree by name.
+
+    The indexed nodes are tracked like the hashed nodes: the index is invalid once one
+    of them, or the root, is modified. Modifications of the lists of children in place
+    are not detected: use `add_child()` or assign the `children` attribute.
+
+    """
+
+    def __init__(self, tree):
+        self._by_name = {}
+        add = self.add
+        # NOTE: the root is not indexed, so that the index stored in the visit metadata
+        # of the root does not create a reference cycle, which would prevent the tree
+        # from being freed by reference counting.
+        tree._track()
+        stack = list(reversed(tree.children))
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):
+                continue
+            node._track()
+            add(node)
+            stack.extend(reversed(node.children))
+        self._epoch = _EPOCH
+
+    def add(self, node):
+        """Add a node in the index."""
+        self._by_name.setdefault(node.name, []).append(node)
+
+    @property
+    def valid(self):
+        """Whether no indexed node has been modified since the index was built."""
+        return self._epoch == _EPOCH
+
+    def find(self, name):
+        """Return the descendant nodes with a given name, in depth-first order."""
+        return list(self._by_name.get(name, ()))
+
+
+def _is_same(value, new_value):
+    if isinstance(value, list) and isinstance(new_value, list):
+        return len(value) == len(new_value) and all(a is b for a, b in zip(value, new_value))
+    return value is new_value or value == new_value
+
+
+class Node(object):
+    """Generic node type, represents a tree.
+
+    The attributes are stored in slots: `name`, `children`, and the attributes declared
+    in the `__slots__` of the subclasses, which are None when they are not set. Other
+    attributes are stored in a dictionary allocated on first use. The attributes are
+    also accessible with a dictionary-like API.
+
+    """
+    __slots__ = ('name', 'children', '_meta', '_extras', '_hash')
+
+    # Class of the index returned by `index()`.
+    index_class = NodeIndex
 
-class Node(Bunch):
-    """Generic node type, represents a tree."""
     def __init__(self, name='Node', children=None, **kwargs):
-        super(Node, self).__init__(**kwargs)
-        self._visit_meta = {}
+        _setattr(self, '_meta', None)
+        _setattr(self, '_extras', None)
+        _setattr(self, '_hash', None)
+        for attr in _get_fields(self.__class__)[0][2:]:
+            _setattr(self, attr, None)
         # Empty names are forbidden.
         assert name
         assert isinstance(name, str)
         self.name = name
         self.children = children or []
         assert isinstance(self.children, list)
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    # Attributes
+    # --------------------------------------------------------------------------------------------
+
+    @property
+    def _visit_meta(self):
+        """Metadata set during the tree transformations, and index of the tree."""
+        if self._meta is None:
+            _setattr(self, '_meta', {})
+        return self._meta
+
+    @_visit_meta.setter
+    def _visit_meta(self, meta):
+        _setattr(self, '_meta', meta)
+
+    def __getattr__(self, name):
+        # NOTE: only called when the attribute is not found in the slots.
+        if not name.startswith('_'):
+            extras = self._extras
+            if extras is not None and name in extras:
+                return extras[name]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if self._hash is not None:
+            self._invalidate()
+        try:
+            _setattr(self, name, value)
+        except AttributeError:
+            if self._extras is None:
+                _setattr(self, '_extras', {})
+            self._extras[name] = value
+
+    def __delattr__(self, name):
+        if self._hash is not None:
+            self._invalidate()
+        if name in _get_fields(self.__class__)[1]:
+            _setattr(self, name, None)
+        elif self._extras and name in self._extras:
+            del self._extras[name]
+        else:
+            raise AttributeError(name)
+
+    # Dictionary-like API
+    # --------------------------------------------------------------------------------------------
+
+    def items(self):
+        names, _, getter = _get_fields(self.__class__)
+        items = [(name, value) for name, value in zip(names, getter(self))
+                 if value is not None]
+        if self._extras:
+            items.extend(self._extras.items())
+        return items
+
+    def keys(self):
+        return [key for key, _ in self.items()]
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def get(self, key, default=None):
+        if key in _get_fields(self.__class__)[1]:
+            value = getattr(self, key)
+            return default if value is None else value
+        extras = self._extras
+        return extras.get(key, default) if extras else default
+
+    def pop(self, key, *default):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        delattr(self, key)
+        return value
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            setattr(self, key, value)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.items())
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        delattr(self, key)
+
+    def _attrs(self):
+        """Return the attributes other than the name and the children."""
+        return {key: value for key, value in self.items()
+                if key not in ('name', 'children')}
+
+    # Public methods
+    # --------------------------------------------------------------------------------------------
 
     def add_child(self, child):
         """A child is either a Node or a string."""
         assert isinstance(child, (Node, str))
+        if self._hash is not None:
+            self._invalidate()
         self.children.append(child)
         return child
 
@@ -120,18 +432,175 @@ class Node(Bunch):
         return self.name
 
     def __eq__(self, other):
-        """Ensure that nxt and prv items are discarded when testing
-        the equality of two trees."""
-        self = filter_tree(self, _remove_visit_meta)
-        return super(Node, self).__eq__(filter_tree(other, _remove_visit_meta))
+        """The visit metadata is discarded when testing the equality of two
+        trees."""
+        if isinstance(other, dict):
+            return dict(self.items()) == other
+        if not isinstance(other, Node):
+            return NotImplemented
+        # NOTE: the trees are compared with an explicit stack rather than recursively.
+        stack = [(self, other)]
+        while stack:
+            a, b = stack.pop()
+            if a is b:
+                continue
+            ha, hb = a._get_cached_hash(), b._get_cached_hash()
+            # NOTE: different hashes do not prove that the trees are different, as equal
+            # attributes may have different serializations, like 1 and 1.0.
+            if ha is not None and ha == hb:
+                continue
+            if (a.name != b.name or len(a.children) != len(b.children) or
+                    a._attrs() != b._attrs()):
+                return False
+            for ca, cb in zip(a.children, b.children):
+                if isinstance(ca, Node) and isinstance(cb, Node):
+                    stack.append((ca, cb))
+                elif ca != cb:
+                    return False
+        return True
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # NOTE: the visit metadata is not pickled.
+        return (self.__class__, (self.name, self.children), self._attrs())
+
+    def __setstate__(self, attrs):
+        self.update(attrs)
+
+    def _copy_node(self):
+        """Return a copy of the node, sharing the list of children."""
+        # NOTE: the slots are set directly, without going through __init__().
+        cls = self.__class__
+        node = cls.__new__(cls)
+        names, _, getter = _get_fields(cls)
+        for name, value in zip(names, getter(self)):
+            _setattr(node, name, value)
+        _setattr(node, '_meta', None)
+        _setattr(node, '_extras', dict(self._extras) if self._extras else None)
+        # The copy has the same hash.
+        _setattr(node, '_hash', self._hash)
+        return node
 
-    def copy(self):
-        node = super(Node, self).copy()
-        node = self.__class__(**node)
-        node.children = [child.copy() if hasattr(child, 'copy') else child
-                         for child in node.children]
+    def shallow_copy(self):
+        """Return a copy of the node, with a new list of the same children."""
+        node = self._copy_node()
+        _setattr(node, 'children', list(self.children))
+        _setattr(node, '_hash', None)
         return node
 
+    def replace(self, **changes):
+        """Return a copy of the node with some attributes changed, sharing the children
+        that are not changed.
+
+        The node itself is returned if the new values are the same as the current ones,
+        or if the new children are the same nodes.
+
+        """
+        if all(_is_same(self.get(key, None), value) for key, value in changes.items()):
+            return self
+        node = self._copy_node()
+        _setattr(node, '_hash', None)
+        for key, value in changes.items():
+            setattr(node, key, value)
+        return node
+
+    def copy(self):
+        """Return a deep copy of the tree."""
+        root = self._copy_node()
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            children = []
+            for child in node.children:
+                if isinstance(child, Node):
+                    child = child._copy_node()
+                    stack.append(child)
+                elif hasattr(child, 'copy'):
+                    child = child.copy()
+                children.append(child)
+            node.children = children
+        return root
+
+    # Hashing
+    # --------------------------------------------------------------------------------------------
+
+    def _invalidate(self):
+        # NOTE: a cached hash depends on the whole subtree, but the nodes do not know
+        # their parents: the modification of a tracked node (hashed or indexed)
+        # invalidates all cached hashes and all indexes.
+        global _EPOCH
+        _EPOCH += 1
+        _setattr(self, '_hash', None)
+
+    def _track(self):
+        # A tracked node without a hash has a `(epoch, None)` hash.
+        if self._hash is None:
+            _setattr(self, '_hash', (_EPOCH, None))
+
+    def _get_cached_hash(self):
+        cached = self._hash
+        if cached is not None and cached[0] == _EPOCH:
+            return cached[1]
+
+    def tree_hash(self):
+        """Return a hash of the tree, as a hexadecimal string.
+
+        The hashes of all subtrees are cached in the nodes, until a hashed node is
+        modified. Trees with the same hash are equal, which speeds up the equality test of
+        two hashed trees. Equal trees usually have the same hash, except when the
+        attributes are equal values of different types, like 1 and 1.0.
+
+        Modifications of the lists of children in place are not detected: use
+        `add_child()` or assign the `children` attribute.
+
+        """
+        stack = [(self, False)]
+        while stack:
+            node, children_hashed = stack.pop()
+            if node._get_cached_hash() is not None:
+                continue
+            if not children_hashed:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children
+                             if isinstance(child, Node))
+                continue
+            # The children nodes are replaced by their hash in a list.
+            data = json.dumps([node.name, node._attrs(),
+                               [[child._hash[1]] if isinstance(child, Node) else child
+                                for child in node.children]],
+                              sort_keys=True, default=repr)
+            _setattr(node, '_hash', (_EPOCH,
+                                     blake2b(data.encode('utf-8'), digest_size=16).hexdigest()))
+        return self._hash[1]
+
+    def build_index(self):
+        """Build and return the index of the nodes of the tree."""
+        index = self.index_class(self)
+        self._visit_meta['index'] = index
+        return index
+
+    def index(self, build=True):
+        """Return the index of the nodes of the tree, built if there is no valid index, or
+        None if `build` is False.
+
+        Like the tree hashes, the index is invalid once a node of the tree is modified.
+
+        """
+        index = self._meta.get('index', None) if self._meta else None
+        if index is None or not index.valid:
+            index = self.build_index() if build else None
+        return index
+
+    def find_all(self, name):
+        """Return the nodes of the tree with a given name, in depth-first order."""
+        nodes = self.index().find(name)
+        return [self] + nodes if self.name == name else nodes
+
     def show(self):
         print(show_tree(self, lambda node: node.name,
                         lambda node: node.children))
@@ -143,15 +612,124 @@ class Node(Bunch):
 
 
 def filter_tree(tree, func):
+    """Return a tree where every node is replaced by `func(node)`, or removed if it
+    returns None.
+
+    `func` receives a shallow copy of every node, that it can modify. The subtrees that
+    are not modified are shared with the input tree.
+
+    """
     class FilterTransformer(TreeTransformer):
         def transform_Node(self, node):
-            node = func(node.copy())
-            if node:
-                node.children = self.transform_children(node)
-            return node
+            new = func(node.shallow_copy())
+            if not new:
+                return new
+            children = yield new
+            if (new.name == node.name and _is_same(node.children, children) and
+                    new._attrs() == node._attrs()):
+                return node
+            new.children = children
+            return new
     return FilterTransformer().transform(tree)
 
 
+#-------------------------------------------------------------------------------------------------
+# Rewrite passes
+#-------------------------------------------------------------------------------------------------
+
+class RewritePass(object):
+    """Pass rewriting some nodes of a tree.
+
+    The `rewrite_<Name>(node)` methods return the rewritten node: the node itself, a new
+    node (see `Node.replace()`), or None to remove it. They are called bottom-up, after the
+    children of the node have been rewritten, and must only depend on the node and its
+    subtree. A pass without rewrite methods is the identity.
+
+    `inspects` is the tuple of the names of the nodes, below a rewritten node, that the
+    rewrite methods read or create: `()` if they only use the rewritten node itself, and
+    None (the default) if they may read any node of the subtree, for example to test the
+    names of the children. `run_passes()` relies on it to fuse several passes in a single
+    traversal of the tree.
+
+    """
+    inspects = None
+
+    def get_rewriters(self):
+        """Return the rewrite methods `{name: method}`."""
+        return {attr[8:]: getattr(self, attr) for attr in dir(self)
+                if attr.startswith('rewrite_')}
+
+
+def _timed(func, times, key):
+    def timed(node):
+        t = perf_counter()
+        try:
+            return func(node)
+        finally:
+            times[key] = times.get(key, 0.) + perf_counter() - t
+    return timed
+
+
+def _can_fuse(group, table):
+    """Whether a pass with the rewrite methods `table` can be run in the same traversal as
+    the passes of `group`, with the same result as if they were run one after the other.
+
+    In a fused traversal, the rewrite methods of a pass see the subtrees already rewritten
+    by the later passes, so this is only the case when none of the nodes inspected by the
+    earlier passes are rewritten by the later pass.
+
+    """
+    return all(p.inspects is not None and not set(p.inspects).intersection(table)
+               for p, _ in group)
+
+
+def _run_fused(tree, tables):
+    class PassesTransformer(TreeTransformer):
+        def transform_Node(self, node):
+            children = yield node
+            node = node.replace(children=children)
+            for table in tables:
+                rewrite = table.get(node.name, None)
+                if rewrite is not None:
+                    node = rewrite(node)
+                    if node is None:
+                        return
+            return node
+    return PassesTransformer().transform(tree)
+
+
+def run_passes(tree, passes, times=None):
+    """Apply several rewrite passes to a tree, and return the new tree.
+
+    The result is the same as if the passes were applied one after the other. Consecutive
+    passes are fused in a single traversal of the tree when their `inspects` attribute shows
+    that this does not change the result (see `RewritePass`).
+
+    The identity passes are skipped, and the tree is returned as is when no node is
+    rewritten. The subtrees without rewritten nodes are shared with the input tree.
+
+    If `times` is a dictionary, the time spent in the rewrite methods of every pass is
+    added to `times[pass]`, in seconds.
+
+    """
+    groups = []
+    for p in passes:
+        table = p.get_rewriters()
+        if not table:
+            continue
+        if times is not None:
+            table = {name: _timed(func, times, p) for name, func in table.items()}
+        if groups and _can_fuse(groups[-1], table):
+            groups[-1].append((p, table))
+        else:
+            groups.append([(p, table)])
+    # NOTE: the index of the tree is not used to skip the traversal, as it is not
+    # invalidated by the modifications of the lists of children in place.
+    for group in groups:
+        tree = _run_fused(tree, [table for _, table in group])
+    return tree
+
+
 #-------------------------------------------------------------------------------------------------
 # Show tree
 #-------------------------------------------------------------------------------------------------
@@ -173,33 +751,47 @@ class TreePrinter(TreeTransformer):
 
     def transform_str(self, contents):
         # Escape new lines in strings.
-        return contents.replace('\n', '\\n')
+        return [[-1, contents.replace('\n', '\\n')]]
 
     def transform_Node(self, node):
+        # NOTE: the transformed nodes are lists of lines `[depth, text]`, so that the lines
+        # of a subtree are not joined and split again at every level of the tree. `depth`
+        # is the number of `prefix_d` to prepend to the text, or -1 if the line has no
+        # prefix yet. The lines are joined in `show_tree()`.
         pt, pl, pd = self.prefix_t, self.prefix_l, self.prefix_d
-        out = ''
-        l = '\n'.join(self.transform_children(node))
-        l = l.splitlines()
+        l = yield node
+        if l and l[-1][0] < 0 and not l[-1][1]:
+            l.pop()
         # Split long strings in the tree representation.
-        if len(l) == 1:
-            l = [_shorten_string(l[0])]
+        if len(l) == 1 and l[0][0] < 0:
+            l[0][1] = _shorten_string(l[0][1])
         n = len(l)
-        for i, _ in enumerate(l):
+        for i, line in enumerate(l):
+            depth, _ = line
             # Choose the prefix.
+            if depth >= 0:
+                # The line has already been prefixed by a descendant.
+                line[0] += 1
+                continue
             prefix = pt if i < n - 1 else pl
             prefix = (pd if (pt in _ or pl in _)
                       else prefix)
-            out += prefix + _ + '\n'
-        out = out.strip()
-        if out:
-            out = '\n' + out
+            line[:] = [0, prefix + _]
+        if l and l[-1][0] == 0:
+            l[-1][1] = l[-1][1].rstrip()
+            # The stripped prefix is not recognized as a prefix anymore.
+            if pt not in l[-1][1] and pl not in l[-1][1]:
+                l[-1][0] = -1
         # NOTE: the print-friendly representation of a node is available
         # in node.display() if available, otherwise str(node).
         # Overriding __repr__() leads to hard-to-debug equality assertions
         # with py.test.
-        return getattr(node, 'display', lambda: str(node))() + out
+        display = getattr(node, 'display', lambda: str(node))()
+        return [[-1, _] for _ in display.split('\n')] + l
 
 
 def show_tree(node, get_node_name=None, get_children_name=None):
     tp = TreePrinter(get_node_name, get_children_name)
-    return tp.transform(node)
+    pd = tp.prefix_d
+    return '\n'.join((pd * depth + text if depth > 0 else text)
+                     for depth, text in tp.transform(node))
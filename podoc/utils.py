@@ -3,16 +3,18 @@
 """Utility functions."""
 
 from contextlib import contextmanager
+from importlib.util import find_spec
 from io import StringIO
 import json
 import logging
 import os
 import os.path as op
+import shutil
 import sys
+import warnings
 
-import pypandoc
+from .tracing import span
 
-pandoc = pypandoc.convert
 logger = logging.getLogger(__name__)
 
 
@@ -29,6 +31,26 @@ class Bunch(dict):
     def copy(self):
         return Bunch(super(Bunch, self).copy())
 
+    def __reduce__(self):
+        # NOTE: the instance dictionary is the object itself, so that the default
+        # pickling would restore the attributes in a separate dictionary.
+        return (self.__class__, (), dict(self))
+
+
+def _set_lazy_attrs(module_name, **getters):
+    """Define attributes of a module that are computed when they are accessed."""
+    module = sys.modules[module_name]
+
+    # NOTE: a module subclass rather than a module-level `__getattr__()`, which requires
+    # Python 3.7.
+    class _LazyModule(module.__class__):
+        def __getattr__(self, name):
+            if name in getters:
+                return getters[name]()
+            raise AttributeError("module %r has no attribute %r" % (module_name, name))
+
+    module.__class__ = _LazyModule
+
 
 #-------------------------------------------------------------------------------------------------
 # File I/O
@@ -53,6 +75,20 @@ def _get_file(file_or_path, mode=None):
         return file_or_path
 
 
+@contextmanager
+def _open_atomic(path, mode='w'):
+    """Open a temporary file next to a file, and move it onto the file only if no
+    exception is raised, so that a failure does not leave a partial file."""
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if op.exists(tmp_path):
+            os.remove(tmp_path)
+
+
 def _create_dir_if_not_exists(path):
     if not op.exists(path):
         logger.debug("Create directory `%s`.", path)
@@ -98,11 +134,12 @@ def _save_resources(resources, res_path=None):
         logger.debug("Create directory `%s`.", res_path)
         os.makedirs(res_path)
     resources = resources or {}
-    for fn, data in resources.items():
-        path = op.join(res_path, fn)
-        with open(path, 'wb') as f:
-            logger.debug("Writing %d bytes to `%s`.", len(data), path)
-            f.write(data)
+    with span('save resources', cat='io', path=res_path, count=len(resources)):
+        for fn, data in resources.items():
+            path = op.join(res_path, fn)
+            with open(path, 'wb') as f:
+                logger.debug("Writing %d bytes to `%s`.", len(data), path)
+                f.write(data)
 
 
 def _load_resources(res_path):
@@ -113,12 +150,13 @@ def _load_resources(res_path):
     # List all files in the resources path.
     if not op.exists(res_path) or not op.isdir(res_path):
         return resources
-    for fn in os.listdir(res_path):
-        path = op.join(res_path, fn)
-        with open(path, 'rb') as f:
-            data = f.read()
-        logger.debug("Read %d bytes from `%s`.", len(data), path)
-        resources[fn] = data
+    with span('load resources', cat='io', path=res_path):
+        for fn in os.listdir(res_path):
+            path = op.join(res_path, fn)
+            with open(path, 'rb') as f:
+                data = f.read()
+            logger.debug("Read %d bytes from `%s`.", len(data), path)
+            resources[fn] = data
     return resources
 
 
@@ -160,12 +198,17 @@ def get_test_file_path(lang, filename):
 def _merge_str(l):
     """Concatenate consecutive strings in a list of nodes."""
     out = []
+    run = []  # current run of consecutive strings
     for node in l:
-        if (out and isinstance(out[-1], str) and
-                isinstance(node, str)):
-            out[-1] += node
-        else:
-            out.append(node)
+        if isinstance(node, str):
+            run.append(node)
+            continue
+        if run:
+            out.append(''.join(run))
+            run = []
+        out.append(node)
+    if run:
+        out.append(''.join(run))
     return out
 
 
@@ -185,30 +228,191 @@ PANDOC_MARKDOWN_FORMAT = ('markdown'
                           )
 
 
-def get_pandoc_formats():
-    import pypandoc
-    return pypandoc.get_pandoc_formats()
+# Cache of the pandoc conversions, created lazily.
+_PANDOC_CACHE = None
 
 
-def get_pandoc_api_version():
+def get_pandoc_cache():
+    """Return the cache of the pandoc conversions, or None if caching is disabled.
+
+    By default, the conversions are only cached in memory.
+
+    """
+    global _PANDOC_CACHE
+    if _PANDOC_CACHE is None:
+        from .cache import ConversionCache
+        _PANDOC_CACHE = ConversionCache()
+    return _PANDOC_CACHE if _PANDOC_CACHE is not False else None
+
+
+def set_pandoc_cache(cache):
+    """Set the cache of the pandoc conversions, a `ConversionCache` instance, or None to
+    disable caching."""
+    global _PANDOC_CACHE
+    _PANDOC_CACHE = cache if cache is not None else False
+
+
+# Number of pandoc subprocesses launched by this process.
+_PANDOC_CALLS = 0
+
+
+def get_pandoc_call_count():
+    """Return the number of pandoc subprocesses launched so far by this process."""
+    return _PANDOC_CALLS
+
+
+def _run_pandoc(source, to, format=None, **kwargs):
+    global _PANDOC_CALLS
     import pypandoc
-    return json.loads(pypandoc.convert_text('', 'json', format='markdown'))['pandoc-api-version']
+    _PANDOC_CALLS += 1
+    with span('pandoc', cat='pandoc', format=format, to=to, size=len(source)):
+        return pypandoc.convert_text(source, to, format=format, **kwargs)
+
+
+def pandoc(source, to, format=None, **kwargs):
+    """Convert a string with pandoc.
+
+    The outputs are cached, unless they are written to an output file.
+
+    """
+    cache = get_pandoc_cache()
+    if cache is None or kwargs.get('outputfile', None):
+        return _run_pandoc(source, to, format=format, **kwargs)
+    # NOTE: the in-memory cache lives in a single process using a single pandoc binary,
+    # the pandoc version is only required for the on-disk store.
+    version = get_pandoc_version() if cache.path else None
+    key = cache.make_key(source, to, format, sorted(kwargs.items()), version)
+    out = cache.get(key)
+    if out is None:
+        out = _run_pandoc(source, to, format=format, **kwargs)
+        cache.set(key, out)
+    return out
+
+
+# Rough cost of a conversion function launching a pandoc subprocess, in seconds.
+PANDOC_COST = .1
 
 
-PANDOC_API_VERSION = get_pandoc_api_version()
+def _get_cache_dir():
+    """Return the directory where podoc caches data on disk."""
+    return (os.environ.get('PODOC_CACHE_DIR', None) or
+            op.join(op.expanduser('~'), '.cache', 'podoc'))
 
 
-def has_pandoc():  # pragma: no cover
+def _find_pandoc():
+    """Return the path to the pandoc binary used by pypandoc, without launching it."""
+    path = os.environ.get('PYPANDOC_PANDOC', None)
+    if path and op.exists(path):
+        return path
+    # pandoc binary shipped with pypandoc (pypandoc-binary).
+    spec = find_spec('pypandoc')
+    if spec is None:
+        return None
+    for directory in spec.submodule_search_locations or []:
+        path = op.join(directory, 'files', 'pandoc.exe' if sys.platform == 'win32' else 'pandoc')
+        if op.exists(path):
+            return path
+    return shutil.which('pandoc')
+
+
+def _probe_pandoc():
+    """Launch pandoc to get its version, API version, and supported formats."""
+    global _PANDOC_CALLS
+    import pypandoc
+    # Version, input formats, output formats, and API version.
+    _PANDOC_CALLS += 4
+    with captured_output():
+        version = pypandoc.get_pandoc_version()
+    source_formats, target_formats = pypandoc.get_pandoc_formats()
+    d = json.loads(pypandoc.convert_text('', 'json', format='markdown'))
+    return {'version': version,
+            'api_version': d['pandoc-api-version'],
+            'source_formats': source_formats,
+            'target_formats': target_formats,
+            }
+
+
+# In-memory cache of the pandoc capabilities, False if pandoc is not available.
+_PANDOC_INFO = None
+
+
+def get_pandoc_info():
+    """Return a dictionary with the pandoc version, API version, and supported formats,
+    or None if pandoc is not available.
+
+    The result is cached on disk, keyed by the path and modification time of the
+    pandoc binary, so that pandoc is only launched once per installation.
+
+    """
+    global _PANDOC_INFO
+    if _PANDOC_INFO is not None:
+        return _PANDOC_INFO or None
+    path = _find_pandoc()
+    key = {'path': path, 'mtime': op.getmtime(path)} if path else None
+    cache_path = op.join(_get_cache_dir(), 'pandoc.json')
+    # Try to load the pandoc capabilities from the disk cache.
+    if key and op.exists(cache_path):
+        try:
+            with open(cache_path, 'r') as f:
+                info = json.load(f)
+            if isinstance(info, dict) and info.get('key', None) == key:
+                _PANDOC_INFO = info
+                return info
+        except (OSError, ValueError):
+            # NOTE: an undecodable cache file is a cache miss, and it is overwritten.
+            logger.debug("Unable to read the pandoc cache `%s`.", cache_path)
     try:
-        with captured_output():
-            import pypandoc
-            pypandoc.get_pandoc_version()
-        return True
+        info = _probe_pandoc()
     except (OSError, ImportError):
-        logger.info("pypandoc is not installed.")
-    except FileNotFoundError:
-        logger.info("pandoc is not installed.")
-    return False
+        logger.info("pypandoc or pandoc is not installed.")
+        _PANDOC_INFO = False
+        return None
+    info['key'] = key
+    _PANDOC_INFO = info
+    # Save the pandoc capabilities in the disk cache.
+    if key:
+        try:
+            _create_dir_if_not_exists(op.dirname(cache_path))
+            # NOTE: concurrent processes or an interruption do not leave a partial file.
+            with _open_atomic(cache_path) as f:
+                json.dump(info, f)
+        except OSError:  # pragma: no cover
+            logger.debug("Unable to write the pandoc cache `%s`.", cache_path)
+    return info
+
+
+def get_pandoc_formats():
+    """Return the lists of pandoc source and target formats."""
+    info = get_pandoc_info()
+    if not info:  # pragma: no cover
+        raise OSError("pandoc is not available.")
+    return info['source_formats'], info['target_formats']
+
+
+def get_pandoc_version():
+    """Return the pandoc version, or None if pandoc is not available."""
+    info = get_pandoc_info()
+    return info['version'] if info else None
+
+
+def get_pandoc_api_version():
+    """Return the pandoc API version, or None if pandoc is not available."""
+    info = get_pandoc_info()
+    return info['api_version'] if info else None
+
+
+def has_pandoc():
+    return get_pandoc_info() is not None
+
+
+def _get_deprecated_pandoc_api_version():
+    warnings.warn("PANDOC_API_VERSION is deprecated, use get_pandoc_api_version() instead.",
+                  DeprecationWarning, stacklevel=3)
+    return get_pandoc_api_version()
+
+
+# NOTE: PANDOC_API_VERSION launched pandoc at import time.
+_set_lazy_attrs(__name__, PANDOC_API_VERSION=_get_deprecated_pandoc_api_version)
 
 
 def generate_json_test_files():  # pragma: no cover